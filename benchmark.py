@@ -0,0 +1,664 @@
+#!/usr/bin/env python
+# Performance benchmarks for the Layout model and conversion layers
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from factorilog import CircuitEnt, EdgeList, Layout, WireColor
+from synthetic import connect, makeCircuit, makeCombinatorArray, makePoleChain, signal
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+
+def makeMemoryArray(size, clock_period = 1000):
+  """
+  Build a Layout of `size` combinators with sparse activity: idle memory cells
+  holding their own output, and one clock per `clock_period` cells driving a
+  decider that only fires on one tick of each clock cycle.
+  """
+  layout = Layout()
+  for i in range(size):
+    if i%clock_period==0:
+      ent = CircuitEnt.fromName("arithmetic-combinator")
+      ent.behavior = {"arithmetic_conditions": {"operation": "+", "constant": 0,
+        "first_signal": signal("A"), "output_signal": signal("A")}}
+      connect(ent.terminals[0], ent.terminals[1], WireColor.green)
+      clock = ent
+    elif i%clock_period==1:
+      ent = CircuitEnt.fromName("constant-combinator")
+      ent.behavior = {"filters": [{"count": 1, "index": 1, "signal": signal("A")}]}
+      connect(ent.terminals[0], clock.terminals[0], WireColor.red)
+    elif i%clock_period==2:
+      ent = CircuitEnt.fromName("decider-combinator")
+      ent.behavior = {"decider_conditions": {"comparator": "=", "constant": 500,
+        "first_signal": signal("A"), "output_signal": signal("B"), "copy_count_from_input": False}}
+      connect(clock.terminals[1], ent.terminals[0], WireColor.red)
+    else:
+      ent = CircuitEnt.fromName("decider-combinator")
+      ent.behavior = {"decider_conditions": {"comparator": "=", "constant": 0,
+        "first_signal": signal("R"), "output_signal": signal("everything"), "copy_count_from_input": True}}
+      connect(ent.terminals[0], ent.terminals[1], WireColor.green)
+    ent.number = i+1
+    layout.addEntity(ent)
+  return layout
+
+def benchSimulation(sizes, ticks):
+  from simulation import Simulator, EventSimulator
+  print("{:>8} {:>8} {:>10} {:>12} {:>10} {:>10}".format(
+    "combs", "circuit", "mode", "seconds", "ticks/s", "evals/tick"))
+  for size in sizes:
+    for circuit, makeLayout in (("dense", makeCombinatorArray), ("sparse", makeMemoryArray)):
+      layout = makeLayout(size)
+      for mode, sim in (("full", Simulator(layout)), ("event", EventSimulator(layout))):
+        start = time.perf_counter()
+        sim.step(ticks)
+        elapsed = time.perf_counter() - start
+        if mode=="event":
+          evals = sum(act["evaluated"] for act in sim.activity)/ticks
+        else:
+          evals = len(sim.deciders)+len(sim.arithmetics)
+        print("{:>8} {:>8} {:>10} {:>12.4f} {:>10.0f} {:>10.1f}".format(
+          size, circuit, mode, elapsed, ticks/elapsed, evals))
+
+def benchHyperwires(sizes):
+  print("{:>8} {:>10} {:>12} {:>10}".format("entities", "hyperwires", "seconds", "us/entity"))
+  for size in sizes:
+    layout = makePoleChain(size)
+    start = time.perf_counter()
+    hyperwires = layout.getHyperwires()
+    elapsed = time.perf_counter() - start
+    print("{:>8} {:>10} {:>12.4f} {:>10.2f}".format(
+      size, len(hyperwires), elapsed, elapsed/size*1e6))
+
+def benchFanout(sizes):
+  """ Import one net with `size` taps, which should take time linear in the taps """
+  from netlist_layer import importNetlist
+  print("{:>8} {:>12} {:>10}".format("taps", "seconds", "us/tap"))
+  for size in sizes:
+    netlist = "clk <= : 1 A if A > 0\n" + "clk: medium-electric-pole\n"*size
+    start = time.perf_counter()
+    layout = importNetlist(netlist)
+    elapsed = time.perf_counter() - start
+    assert max(len(hyper.terminals) for hyper in layout.hyperwires)==size+1
+    print("{:>8} {:>12.4f} {:>10.2f}".format(size, elapsed, elapsed/size*1e6))
+
+def checkParserConformance(documents, seed = 0):
+  """
+  Parse a generated corpus with both the fast parser and the grako parser,
+  and compare the semantic output. Returns the number of mismatches.
+  """
+  from netlist_layer import NetlistSemantics
+  from netlist_fastparser import parseNetlist
+  from netlist_parser import NetlistParser
+  from synthetic import makeNetlistDocument, mutateDocument, parseOutcome
+  grako_parse = lambda text: NetlistParser(parseinfo=False).parse(
+    text, rule_name='start', semantics=NetlistSemantics())
+  fast_parse = lambda text: parseNetlist(text, NetlistSemantics())
+
+  rng = random.Random(seed)
+  mismatches = failures = 0
+  for i in range(documents):
+    text = makeNetlistDocument(rng, rng.randint(1, 8))
+    if i%4==3:
+      text = mutateDocument(rng, text)
+    expected = parseOutcome(grako_parse, text)
+    failures += isinstance(expected, str)
+    if parseOutcome(fast_parse, text)!=expected:
+      mismatches += 1
+      if mismatches<=5:
+        print("Mismatch on document {}:\n{}\n".format(i, text))
+  print("{} documents ({} rejected by grako): {} mismatches".format(documents, failures, mismatches))
+  return mismatches
+
+def benchParser(sizes):
+  from netlist_layer import NetlistSemantics, exportNetlist
+  from netlist_fastparser import parseNetlist
+  from netlist_parser import NetlistParser
+  print("{:>8} {:>10} {:>12} {:>12}".format("lines", "parser", "seconds", "lines/s"))
+  for size in sizes:
+    netlist = exportNetlist(makeCombinatorArray(size))
+    for name, parse in (
+        ("grako", lambda: NetlistParser(parseinfo=False).parse(
+          netlist, rule_name='start', semantics=NetlistSemantics())),
+        ("fast", lambda: parseNetlist(netlist, NetlistSemantics()))):
+      start = time.perf_counter()
+      parse()
+      elapsed = time.perf_counter() - start
+      print("{:>8} {:>10} {:>12.4f} {:>12.0f}".format(size, name, elapsed, size/elapsed))
+
+def makeScaledEntityTable(path, scale):
+  """ Lua entity table text repeating the entities of the table in `path` `scale` times """
+  with open(path, 'r') as f:
+    text = f.read()
+  inner = text[text.index("{")+1:text.rindex("}")]
+  return "{" + ",".join([inner]*scale) + "}"
+
+def benchLuaCodec(scale, path = os.path.join(package_dir, "blueprints", "sample.bp")):
+  import lua_table
+  try:
+    from slpp import slpp as lua
+  except ImportError:
+    lua = None
+    print("slpp is not installed, only timing lua_table")
+  text = makeScaledEntityTable(path, scale)
+  print("{:>10} {:>10} {:>12} {:>10}".format("codec", "operation", "seconds", "MB/s"))
+  def report(codec, operation, elapsed, size):
+    print("{:>10} {:>10} {:>12.4f} {:>10.2f}".format(codec, operation, elapsed, size/elapsed/1e6))
+
+  start = time.perf_counter()
+  table = lua_table.decode(text)
+  report("lua_table", "decode", time.perf_counter() - start, len(text))
+  start = time.perf_counter()
+  encoded = lua_table.encode(table)
+  report("lua_table", "encode", time.perf_counter() - start, len(encoded))
+  if lua:
+    start = time.perf_counter()
+    slpp_table = lua.decode(text)
+    report("slpp", "decode", time.perf_counter() - start, len(text))
+    start = time.perf_counter()
+    slpp_encoded = lua.encode(slpp_table)
+    report("slpp", "encode", time.perf_counter() - start, len(slpp_encoded))
+    if slpp_table!=table:
+      print("Decoded tables differ")
+  if lua_table.decode(encoded)!=table:
+    print("lua_table round trip differs")
+
+def makePlacedLayout(size):
+  """ makeCombinatorArray on a grid, so it can be exported as a blueprint """
+  return makeCircuit("array", size)
+
+def checkHyperwires(layout):
+  """ Whether the maintained hyperwires, back-references and names match a full recompute """
+  expected = {(color, frozenset(terms)) for color, components in layout.getComponents().items()
+              for terms in components}
+  actual = {(hyper.color, frozenset(hyper.terminals)) for hyper in layout.hyperwires}
+  back_refs = all(term in hyper.terminals for ent in layout.entities for term in ent.terminals
+                  for hyper in term.hyperwires)
+  back_refs &= sum(len(term.hyperwires) for ent in layout.entities for term in ent.terminals) == \
+               sum(len(hyper.terminals) for hyper in layout.hyperwires)
+  names = {hyper.name: hyper for hyper in layout.hyperwires}
+  wires = {wire for ent in layout.entities for term in ent.terminals for wire in term.wires}
+  bucketed = [wire for hyper in layout.hyperwires for wire in hyper.wires
+              if wire.color==hyper.color and wire.terminals[0] in hyper.terminals]
+  return (actual==expected and back_refs and names==layout.hyperwires_by_name
+          and len(bucketed)==len(wires) and set(bucketed)==wires)
+
+def randomEdit(rng, layout, terminals):
+  """ Apply a random edit: connect, disconnect, or remove an entity and add it back unwired """
+  choice = rng.random()
+  if choice<0.45:
+    term_a, term_b = rng.sample(terminals, 2)
+    layout.connect(term_a, term_b, rng.choice(list(WireColor)))
+  elif choice<0.9:
+    term = rng.choice(terminals)
+    if term.wires:
+      layout.disconnect(rng.choice(list(term.wires)))
+  else:
+    ent = rng.choice(terminals).ent
+    layout.removeEntity(ent)
+    layout.addEntity(ent)
+
+def benchMutation(sizes, edits = 10000, seed = 0):
+  """ Check incremental hyperwire maintenance against recomputes, then time edits """
+  rng = random.Random(seed)
+  layout = makeCombinatorArray(40)
+  layout.getHyperwires()
+  layout.nameHyperwires()
+  terminals = [term for ent in layout.entities for term in ent.terminals]
+  for i in range(2000):
+    randomEdit(rng, layout, terminals)
+    if not checkHyperwires(layout):
+      print("Hyperwires inconsistent after edit {}".format(i))
+      return False
+
+  print("{:>8} {:>10} {:>12}".format("entities", "edits", "us/edit"))
+  for size in sizes:
+    layout = makeCombinatorArray(size)
+    layout.getHyperwires()
+    layout.nameHyperwires()
+    terminals = [term for ent in layout.entities for term in ent.terminals]
+    start = time.perf_counter()
+    for _ in range(edits):
+      randomEdit(rng, layout, terminals)
+    elapsed = time.perf_counter() - start
+    print("{:>8} {:>10} {:>12.2f}".format(size, edits, elapsed/edits*1e6))
+  return True
+
+def benchLookups(sizes, queries = 100000):
+  """ Indexed Layout lookups against linear scans of layout.entities """
+  print("{:>8} {:>14} {:>12} {:>12}".format("entities", "lookup", "indexed us", "scan us"))
+  rng = random.Random(0)
+  for size in sizes:
+    layout = makePlacedLayout(size)
+    layout.getHyperwires()
+    layout.nameHyperwires()
+    numbers = [rng.randrange(size)+1 for _ in range(queries)]
+    positions = [(layout.getEntity(number).position["x"], layout.getEntity(number).position["y"])
+                 for number in numbers]
+    names = [hyper.name for hyper in layout.hyperwires]
+    names = [rng.choice(names) for _ in range(queries)]
+    scan_queries = max(1, min(queries, 10**7//size))
+    lookups = (
+      ("number", lambda i: layout.getEntity(numbers[i]),
+        lambda i: next(ent for ent in layout.entities if ent.number==numbers[i])),
+      ("position", lambda i: layout.getEntityAt(*positions[i]),
+        lambda i: next(ent for ent in layout.entities if (ent.position["x"], ent.position["y"])==positions[i])),
+      ("drivers", lambda i: layout.getDrivers(layout.getHyperwire(names[i])),
+        lambda i: [term for ent in layout.entities for term in ent.terminals
+                   if term.type.name=="out" and any(hyper.name==names[i] for hyper in term.hyperwires)]),
+    )
+    for lookup, indexed, scan in lookups:
+      timings = []
+      for query, count in ((indexed, queries), (scan, scan_queries)):
+        start = time.perf_counter()
+        for i in range(count):
+          query(i)
+        timings.append((time.perf_counter() - start)/count*1e6)
+      print("{:>8} {:>14} {:>12.2f} {:>12.2f}".format(size, lookup, *timings))
+
+class NullWriter:
+  """ Text stream that discards its input, noting when the first write happened """
+  def __init__(self):
+    self.first_write = None
+
+  def write(self, text):
+    if self.first_write is None:
+      self.first_write = time.perf_counter()
+    return len(text)
+
+class CountingWriter:
+  """ Text stream that discards its input, counting characters """
+  def __init__(self):
+    self.chars = 0
+
+  def write(self, text):
+    self.chars += len(text)
+    return len(text)
+
+def benchNetlistExport(sizes):
+  """ Whole-string exportNetlist against writeNetlist to a stream: time, first byte and peak memory """
+  from netlist_layer import exportNetlist, writeNetlist
+  print("{:>8} {:>8} {:>12} {:>12} {:>12}".format("entities", "export", "seconds", "first byte", "peak MB"))
+  for size in sizes:
+    layout = makePlacedLayout(size)
+    layout.getHyperwires()
+    layout.nameHyperwires()
+    exports = (("string", lambda stream: stream.write(exportNetlist(layout, meta=True))),
+               ("stream", lambda stream: writeNetlist(layout, stream, meta=True)))
+    for name, export in exports:
+      stream = NullWriter()
+      start = time.perf_counter()
+      export(stream)
+      elapsed = time.perf_counter() - start
+      # tracing slows the export down, so measure memory on a second run
+      tracemalloc.start()
+      export(NullWriter())
+      peak = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+      print("{:>8} {:>8} {:>12.4f} {:>12.4f} {:>12.2f}".format(
+        size, name, elapsed, stream.first_write - start, peak/1e6))
+
+def benchBlueprintExport(sizes, levels = (1, 6, 9)):
+  """ Streaming blueprint export to a null stream at several compression levels """
+  from blueprint_layer import writeBlueprint
+  print("{:>8} {:>8} {:>6} {:>12} {:>12} {:>12}".format(
+    "combs", "format", "level", "chars", "seconds", "peak MB"))
+  for size in sizes:
+    layout = makePlacedLayout(size)
+    for format in ("lua", "json"):
+      for level in levels:
+        counter = CountingWriter()
+        start = time.perf_counter()
+        writeBlueprint(layout, counter, format=format, level=level)
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        writeBlueprint(layout, NullWriter(), format=format, level=level)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("{:>8} {:>8} {:>6} {:>12} {:>12.4f} {:>12.2f}".format(
+          size, format, level, counter.chars, elapsed, peak/1e6))
+
+def benchBlueprintFormats(sizes):
+  from blueprint_layer import exportBlueprint, importBlueprint
+  print("{:>8} {:>8} {:>12} {:>12} {:>12}".format("combs", "format", "chars", "seconds", "MB/s"))
+  for size in sizes:
+    layout = makePlacedLayout(size)
+    for format in ("lua", "json"):
+      bp_string = exportBlueprint(layout, format=format)
+      start = time.perf_counter()
+      importBlueprint(bp_string)
+      elapsed = time.perf_counter() - start
+      print("{:>8} {:>8} {:>12} {:>12.4f} {:>12.2f}".format(
+        size, format, len(bp_string), elapsed, len(bp_string)/elapsed/1e6))
+
+def tracedBytes(build):
+  """ (result, bytes still allocated) of calling `build` """
+  tracemalloc.start()
+  try:
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+  finally:
+    tracemalloc.stop()
+  return result, size
+
+# Most bytes per entity a layout may take with its hyperwires, about 5% above the
+# measurements on CPython 3.11 (chain 1492, array 2310, placed 2847 at 100k entities)
+memory_targets = {"chain": 1600, "array": 2450, "placed": 3000}
+
+def benchMemory(sizes):
+  """ Memory per entity of each circuit; returns False if one takes more than its memory_targets entry """
+  print("{:>8} {:>8} {:>12} {:>12} {:>12}".format("entities", "circuit", "layout", "+hyperwires", "edge list"))
+  within = True
+  for size in sizes:
+    for circuit, makeLayout in (("chain", makePoleChain), ("array", makeCombinatorArray),
+                                ("placed", makePlacedLayout)):
+      layout, layout_bytes = tracedBytes(lambda: makeLayout(size))
+      tracemalloc.start()
+      layout.getHyperwires()
+      hyperwire_bytes = tracemalloc.get_traced_memory()[0]
+      tracemalloc.stop()
+      (edges, _), edge_bytes = tracedBytes(lambda: EdgeList.fromLayout(layout))
+      del edges
+      print("{:>8} {:>8} {:>12.0f} {:>12.0f} {:>12.0f}  bytes/entity".format(
+        size, circuit, layout_bytes/size, (layout_bytes+hyperwire_bytes)/size, edge_bytes/size))
+      if (layout_bytes+hyperwire_bytes)/size > memory_targets[circuit]:
+        print("{} of {} entities takes more than {} bytes/entity".format(circuit, size, memory_targets[circuit]))
+        within = False
+  return within
+
+def benchServer(requests = 200, path = os.path.join(package_dir, "blueprints", "Sample.blueprint")):
+  """ Latency of converting a small blueprint with a fresh netlist.py process against requests to the server """
+  import json
+  import subprocess
+  import tempfile
+  script = os.path.join(package_dir, "netlist.py")
+  with open(path, 'r') as stream:
+    blueprint = stream.read()
+  print("{:>12} {:>10} {:>12} {:>12}".format("mode", "requests", "ms/request", "p99 ms"))
+  def report(mode, times):
+    times = sorted(times)
+    print("{:>12} {:>10} {:>12.2f} {:>12.2f}".format(
+      mode, len(times), sum(times)/len(times)*1e3, times[int(len(times)*0.99)]*1e3))
+
+  with tempfile.TemporaryDirectory() as workdir:
+    out_path = os.path.join(workdir, "out.netlist")
+    times = []
+    for _ in range(max(requests//20, 1)):
+      start = time.perf_counter()
+      subprocess.run([sys.executable, script, "-b", path, "-o", out_path, "--no-cache"], check=True,
+        stdout=subprocess.DEVNULL)
+      times.append(time.perf_counter() - start)
+    report("process", times)
+
+  server = subprocess.Popen([sys.executable, script, "--serve", "-j", "1", "--no-cache"],
+    stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+  def call(id, method, params):
+    server.stdin.write(json.dumps({"jsonrpc": "2.0", "id": id, "method": method, "params": params}) + "\n")
+    server.stdin.flush()
+  try:
+    call(0, "blueprintToNetlist", {"blueprint": blueprint}) # the first request starts the worker
+    json.loads(server.stdout.readline())
+    times = []
+    for id in range(1, requests+1):
+      start = time.perf_counter()
+      call(id, "blueprintToNetlist", {"blueprint": blueprint})
+      response = json.loads(server.stdout.readline())
+      times.append(time.perf_counter() - start)
+      assert response["id"]==id and "result" in response, response
+    report("server", times)
+
+    start = time.perf_counter()
+    for id in range(requests):
+      call(id, "blueprintToNetlist", {"blueprint": blueprint})
+    ids = {json.loads(server.stdout.readline())["id"] for _ in range(requests)}
+    assert ids==set(range(requests))
+    elapsed = time.perf_counter() - start
+    print("{:>12} {:>10} {:>12.2f}".format("pipelined", requests, elapsed/requests*1e3))
+    call(None, "shutdown", {})
+  finally:
+    server.stdin.close()
+    server.wait()
+
+def benchLibrary(sizes, blueprints = 200):
+  """ Index synthetic blueprints of each size, re-index them unchanged, and time queries """
+  import tempfile
+  import cache
+  from blueprint_layer import writeBlueprint
+  from library import Library
+  from synthetic import shapes
+  cache.disable()
+  print("{:>8} {:>10} {:>12} {:>12} {:>12} {:>12}".format(
+    "entities", "blueprints", "index s", "reindex s", "signal ms", "count ms"))
+  for size in sizes:
+    with tempfile.TemporaryDirectory() as workdir:
+      shape_names = sorted(shapes)
+      for i in range(blueprints):
+        shape = shape_names[i%len(shape_names)]
+        layout = makeCircuit(shape, size + i%10)
+        layout.meta["name"] = "{} {}".format(shape, i)
+        with open(os.path.join(workdir, "{}-{}.blueprint".format(shape, i)), 'w') as stream:
+          writeBlueprint(layout, stream)
+      with Library(os.path.join(workdir, "library.sqlite")) as library:
+        start = time.perf_counter()
+        counts = library.index([workdir])
+        index_time = time.perf_counter() - start
+        assert counts["indexed"]==blueprints, counts
+        start = time.perf_counter()
+        counts = library.index([workdir])
+        reindex_time = time.perf_counter() - start
+        assert counts["unchanged"]==blueprints, counts
+        start = time.perf_counter()
+        found = library.findBySignal("each")
+        signal_time = time.perf_counter() - start
+        assert len(found)==blueprints//len(shape_names)
+        start = time.perf_counter()
+        library.findByEntityCount("decider-combinator", size//4)
+        count_time = time.perf_counter() - start
+      print("{:>8} {:>10} {:>12.4f} {:>12.4f} {:>12.3f} {:>12.3f}".format(
+        size, blueprints, index_time, reindex_time, signal_time*1e3, count_time*1e3))
+
+def benchBook(sizes, pages = 100):
+  """ Import books of synthetic pages of each size, building the pages serially and in parallel """
+  from blueprint_layer import BlueprintBook, exportBlueprintBook, importBlueprintBook
+  from synthetic import shapes
+  print("{:>8} {:>8} {:>8} {:>12} {:>12} {:>12} {:>12}".format(
+    "entities", "pages", "format", "chars", "serial s", "parallel s", "speedup"))
+  shape_names = sorted(shapes)
+  for size in sizes:
+    book = BlueprintBook(meta={"name": "benchmark"})
+    for i in range(pages):
+      shape = shape_names[i%len(shape_names)]
+      layout = makeCircuit(shape, size + i%10)
+      layout.meta["name"] = "{} {}".format(shape, i)
+      book.pages.append(layout)
+    for format in ("lua", "json"):
+      bp_string = exportBlueprintBook(book, format)
+      times = []
+      for jobs in (1, os.cpu_count()):
+        start = time.perf_counter()
+        imported = importBlueprintBook(bp_string, jobs)
+        times.append(time.perf_counter() - start)
+        assert len(imported.pages)==pages
+      print("{:>8} {:>8} {:>8} {:>12} {:>12.4f} {:>12.4f} {:>12.2f}".format(
+        size, pages, format, len(bp_string), times[0], times[1], times[0]/times[1]))
+
+# Scenarios of the suite, timed on each synthetic circuit
+suite_shapes = ["chain", "fanout", "array", "mesh"]
+regression_floor = 0.01 # seconds a scenario may slow down by regardless of the threshold
+
+def getSuiteScenarios(layout, paths, workdir):
+  """ (name, function) for each scenario; functions return the characters they output, if any """
+  import argparse
+  import contextlib
+  import io
+  import conversion
+  import netlist
+  from blueprint_layer import writeBlueprint
+  from netlist_layer import importNetlist, writeNetlist
+
+  def importFile(path):
+    with open(path, 'r') as stream:
+      conversion.importBlueprintFile(stream)
+
+  def importNetlistFile():
+    with open(paths["netlist"], 'r') as stream:
+      importNetlist(stream.read())
+
+  def exportBlueprint(format):
+    counter = CountingWriter()
+    writeBlueprint(layout, counter, format=format)
+    return counter.chars
+
+  def roundTrip():
+    """ Blueprint to netlist and back through the command line entry point """
+    net_path = os.path.join(workdir, "round-trip.netlist")
+    bp_path = os.path.join(workdir, "round-trip.blueprint")
+    options = dict(entity_table=False, no_meta=False, format="lua", level=9)
+    with contextlib.redirect_stdout(io.StringIO()):
+      netlist.convert(argparse.Namespace(blueprint=paths["blueprint"], netlist=None, outfile=net_path, **options))
+      netlist.convert(argparse.Namespace(blueprint=None, netlist=net_path, outfile=bp_path, **options))
+    return os.path.getsize(bp_path)
+
+  return [
+    ("import blueprint", lambda: importFile(paths["blueprint"])),
+    ("import entity table", lambda: importFile(paths["entity table"])),
+    ("import netlist", importNetlistFile),
+    ("export netlist", lambda: writeNetlist(layout, CountingWriter(), meta=True)),
+    ("export blueprint lua", lambda: exportBlueprint("lua")),
+    ("export blueprint json", lambda: exportBlueprint("json")),
+    ("round trip", roundTrip),
+  ]
+
+def getSuiteEnvironment():
+  import datetime
+  import platform
+  import subprocess
+  try:
+    commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+      check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    commit = None
+  return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+          "date": datetime.datetime.now().isoformat(timespec="seconds")}
+
+def runSuite(sizes, shapes = suite_shapes, repeat = 3):
+  """
+  Time every scenario on synthetic circuits of each shape and size, keeping the best of
+  `repeat` runs. Returns the results as a JSON-serializable dict.
+  """
+  import tempfile
+  import cache
+  from synthetic import writeCircuitFiles
+  cache.disable() # time the conversions, not cache hits
+  results = []
+  print("{:>8} {:>8} {:<24} {:>12} {:>12}".format("entities", "shape", "scenario", "seconds", "chars"))
+  with tempfile.TemporaryDirectory() as workdir:
+    for size in sizes:
+      for shape in shapes:
+        layout = makeCircuit(shape, size)
+        paths = writeCircuitFiles(layout, workdir, "{}-{}".format(shape, size))
+        for scenario, run in getSuiteScenarios(layout, paths, workdir):
+          times = []
+          for _ in range(repeat):
+            start = time.perf_counter()
+            chars = run()
+            times.append(time.perf_counter() - start)
+          results.append({"scenario": scenario, "shape": shape, "size": size,
+                          "seconds": min(times), "runs": times, "chars": chars})
+          print("{:>8} {:>8} {:<24} {:>12.4f} {:>12}".format(
+            size, shape, scenario, min(times), chars if chars is not None else ""))
+  return {"environment": getSuiteEnvironment(), "repeat": repeat, "results": results}
+
+def findRegressions(results, baseline, threshold):
+  """
+  Compare suite results with a baseline from an earlier run. A scenario regresses if it takes
+  more than `threshold` times as long as in the baseline, and at least regression_floor longer.
+  Returns a message for each regression.
+  """
+  key = lambda result: (result["scenario"], result["shape"], result["size"])
+  baseline_seconds = {key(result): result["seconds"] for result in baseline["results"]}
+  regressions = []
+  for result in results["results"]:
+    before = baseline_seconds.get(key(result))
+    if before is None:
+      continue
+    seconds = result["seconds"]
+    if seconds > before*threshold and seconds-before >= regression_floor:
+      regressions.append("{} on {} x {}: {:.4f} s -> {:.4f} s ({:.2f}x)".format(
+        result["scenario"], result["shape"], result["size"], before, seconds, seconds/before))
+  return regressions
+
+def benchSuite(sizes, output = None, baseline = None, threshold = 1.25, repeat = 3):
+  """ Run the suite, optionally writing its results and checking them against a baseline. Returns whether it passed """
+  import json
+  results = runSuite(sizes, repeat=repeat)
+  if output:
+    with open(output, 'w') as stream:
+      json.dump(results, stream, indent=2)
+  if baseline:
+    with open(baseline, 'r') as stream:
+      regressions = findRegressions(results, json.load(stream), threshold)
+    for regression in regressions:
+      print("REGRESSION " + regression)
+    print("{} regressions against {} (threshold {:.2f}x)".format(len(regressions), baseline, threshold))
+    return not regressions
+  return True
+
+if __name__=="__main__":
+  parser = argparse.ArgumentParser(description="Run performance benchmarks")
+  parser.add_argument('benchmarks', nargs='*', default=["hyperwires"],
+    choices=["hyperwires", "simulation", "parser", "conformance", "luacodec", "formats", "memory", "fanout", "lookups", "mutation", "export", "bpexport", "suite", "server", "library", "book"], help="Benchmarks to run")
+  parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+    help="Entity counts to benchmark")
+  parser.add_argument('--ticks', type=int, default=1000, help="Ticks to simulate")
+  parser.add_argument('--scale', type=int, default=1000,
+    help="Copies of the sample entity table in the Lua codec benchmark")
+  parser.add_argument('--documents', type=int, default=2000,
+    help="Generated netlists to check in the conformance run")
+  parser.add_argument('--json', metavar="PATH", help="Write the suite results to a JSON file")
+  parser.add_argument('--baseline', metavar="PATH",
+    help="Suite results of an earlier run to check for regressions; exits with status 1 if any")
+  parser.add_argument('--threshold', type=float, default=1.25,
+    help="Slowdown factor against the baseline counted as a regression")
+  parser.add_argument('--repeat', type=int, default=3, help="Runs of each suite scenario, keeping the fastest")
+  args = parser.parse_args()
+
+  if "hyperwires" in args.benchmarks:
+    benchHyperwires(args.sizes)
+  if "fanout" in args.benchmarks:
+    benchFanout(args.sizes)
+  if "simulation" in args.benchmarks:
+    benchSimulation(args.sizes, args.ticks)
+  if "parser" in args.benchmarks:
+    benchParser(args.sizes)
+  if "export" in args.benchmarks:
+    benchNetlistExport(args.sizes)
+  if "bpexport" in args.benchmarks:
+    benchBlueprintExport(args.sizes)
+  if "formats" in args.benchmarks:
+    benchBlueprintFormats(args.sizes)
+  if "mutation" in args.benchmarks:
+    if not benchMutation(args.sizes):
+      sys.exit(1)
+  if "lookups" in args.benchmarks:
+    benchLookups(args.sizes)
+  if "memory" in args.benchmarks:
+    if not benchMemory(args.sizes):
+      sys.exit(1)
+  if "luacodec" in args.benchmarks:
+    benchLuaCodec(args.scale)
+  if "conformance" in args.benchmarks:
+    if checkParserConformance(args.documents):
+      sys.exit(1)
+  if "suite" in args.benchmarks:
+    if not benchSuite(args.sizes, args.json, args.baseline, args.threshold, args.repeat):
+      sys.exit(1)
+  if "server" in args.benchmarks:
+    benchServer()
+  if "library" in args.benchmarks:
+    benchLibrary(args.sizes)
+  if "book" in args.benchmarks:
+    benchBook(args.sizes)
@@ -1,11 +1,19 @@
 #!/usr/bin/env python
 # Blueprint import/export
 
-from slpp import slpp as lua
 import re
-import base64, gzip
+import io
+import itertools
+import json
+import os
+import base64, codecs, gzip, zlib
 
-from factorilog import Layout, Wire, WireColor, CircuitEnt, Direction
+from factorilog import Layout, Wire, WireColor, CircuitEnt, Direction, pausedCollector
+from string_ops import internSignal, internSignals
+import lua_table
+from lua_table import LuaTableDecoder, LuaDecodeError
+import cache
+import profiling
 
 from collections import defaultdict
 
@@ -15,136 +23,651 @@ def buildEntFromBlueprint(ent_bp):
   ent.name = ent_bp["name"]
   ent.number = ent_bp["entity_number"]
   if "control_behavior" in ent_bp:
-    ent.behavior = ent_bp["control_behavior"]
+    ent.behavior = internSignals(ent_bp["control_behavior"])
   ent.position = ent_bp["position"]
   if "direction" in ent_bp:
     ent.direction = Direction(ent_bp["direction"])
   return ent
 
 
-def importBlueprint(blueprint, string = True):
+blueprint_formats = ("lua", "json")
+json_version_byte = "0"
+# Map version written to JSON blueprints: 1.0.0.0, as four 16-bit fields
+json_blueprint_version = 1 << 48
+
+# Characters other than these are discarded when decoding base64, like base64.b64decode does
+base64_junk_re = re.compile(r'[^A-Za-z0-9+/=]+')
+
+def iterBlueprintText(chunks, chunk_size = 1 << 16):
+  """
+  Decode a blueprint string (gzip+base64), given as an iterable of string chunks,
+  into chunks of Lua text of at most about `chunk_size` characters.
+  """
+  inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) # expect a gzip header
+  text_decoder = codecs.getincrementaldecoder("utf-8")()
+  pending = ""
+  started = False
+  try:
+    for chunk in chunks:
+      profiling.count("blueprint chars", len(chunk))
+      pending += base64_junk_re.sub("", chunk)
+      usable = len(pending) - len(pending)%4
+      if usable:
+        data, pending = base64.b64decode(pending[:usable]), pending[usable:]
+        started = True
+        while data and not inflater.eof:
+          text = text_decoder.decode(inflater.decompress(data, chunk_size))
+          profiling.count("decompressed chars", len(text))
+          yield text
+          data = inflater.unconsumed_tail
+    if pending:
+      base64.b64decode(pending) # raises binascii.Error for bad padding
+    yield text_decoder.decode(inflater.flush(), final=True)
+  except zlib.error as e:
+    raise gzip.BadGzipFile(str(e)) from e
+  if started and not inflater.eof:
+    raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+def isEntityPath(path):
+  """ Lua table path of an entity: in the entity list, or the entities of a blueprint """
+  if len(path)==1:
+    return type(path[0]) is int
+  return len(path)==2 and path[0]=="entities" and type(path[1]) is int
+
+def addBlueprintEntity(layout, bp_ent, connections):
+  """
+  Build the entity of a blueprint entity table and add it to the layout.
+  Its wires are collected in `connections` as (source terminal, color, target entity id,
+  target terminal index), to be created by connectBlueprintWires once all entities exist.
+  """
+  ent = buildEntFromBlueprint(bp_ent)
+  layout.addEntity(ent)
+
+  for term_i,lua_terminal in bp_ent.get("connections", {}).items():
+    source_term = ent.terminals[int(term_i)-1]
+    for color,lua_wires in lua_terminal.items():
+      for lua_wire in lua_wires:
+        terminal_i = lua_wire.get("circuit_id", 1)-1
+        connections.append((source_term, color, lua_wire["entity_id"], terminal_i))
+
+def connectBlueprintWires(layout, connections):
+  """ Add each wire to its source terminal, once even if a blueprint lists it twice """
+  added = set()
+  for source_term, color, target_ent_id, terminal_i in connections:
+    target_term = layout.getEntity(target_ent_id).terminals[terminal_i]
+    wire = Wire({source_term, target_term},WireColor[color])
+    if (source_term, wire) not in added:
+      added.add((source_term, wire))
+      source_term.addWire(wire)
+
+def addBlueprintMeta(layout, bp, name_key = "name"):
+  """ Copy the blueprint name (under `name_key`) and icons to layout.meta, or the meta of a BlueprintBook """
+  if name_key in bp:
+    layout.meta["name"] = bp[name_key]
+
+  if "icons" in bp:
+    layout.meta["icons"] = [internSignal(elem["signal"]["type"], elem["signal"]["name"])
+                            for elem in sorted(bp["icons"], key=lambda e: e["index"])]
+
+def isJsonBlueprint(blueprint):
+  """ JSON blueprint strings start with a version byte; Lua ones with the gzip header H4sI """
+  return blueprint.lstrip().startswith(json_version_byte)
+
+def importJsonBlueprint(blueprint):
+  """
+  Convert JSON blueprint string (version byte, then base64 of zlib-compressed JSON) to Layout.
+  The blueprint label becomes the layout name.
+  """
+  profiling.count("blueprint chars", len(blueprint))
+  with profiling.stage("base64+zlib"):
+    text = zlib.decompress(base64.b64decode(blueprint.strip()[1:]))
+  profiling.count("decompressed chars", len(text))
+  with profiling.stage("json decode"):
+    data = json.loads(text)
+  del text
+  if "blueprint_book" in data:
+    raise RuntimeError("Blueprint is a blueprint book, import it with importBlueprintBook")
+  if "blueprint" not in data:
+    raise RuntimeError("Not a blueprint: {}".format(", ".join(data)))
+  return buildJsonLayout(data["blueprint"])
+
+def buildJsonLayout(bp):
+  """ Build the Layout of a decoded JSON blueprint table """
+  layout = Layout()
+  connections = []
+  with profiling.stage("build entities"):
+    for i, bp_ent in enumerate(bp.get("entities", ()), 1):
+      bp_ent.setdefault("entity_number", i)
+      addBlueprintEntity(layout, bp_ent, connections)
+  with profiling.stage("connect wires"):
+    connectBlueprintWires(layout, connections)
+  addBlueprintMeta(layout, bp, name_key="label")
+
+  layout.flags["meta_valid"] = True
+  return layout
+
+@profiling.staged("import blueprint")
+def importBlueprintChunks(chunks, string = True):
+  """
+  Convert a blueprint, given as an iterable of string chunks, to Layout.
+  JSON blueprint strings are detected and decoded whole. Lua entities are built
+  as soon as their table is decoded, so only the wiring of earlier entities is
+  kept around rather than the whole decoded blueprint.
+  """
+  if string:
+    chunks = iter(chunks)
+    first = ""
+    for first in chunks:
+      if first.strip():
+        break
+    if isJsonBlueprint(first):
+      return importJsonBlueprint(first + "".join(chunks))
+    chunks = iterBlueprintText(itertools.chain((first,), chunks))
+
+  layout = Layout()
+  connections = []
+
+  def addEntity(path, bp_ent):
+    # blueprint entities contain entity_numbers, but blueprint stringifiers remove it
+    bp_ent.setdefault("entity_number", path[-1])
+    addBlueprintEntity(layout, bp_ent, connections)
+
+  decoder = LuaTableDecoder(stream=isEntityPath)
+  chunks = iter(chunks)
+  try:
+    while True:
+      # decoding is interleaved with building entities, so time each step separately
+      with profiling.stage("base64+gzip" if string else "read"):
+        chunk = next(chunks, None)
+      with profiling.stage("lua decode"):
+        bp_ents = decoder.feed(chunk) if chunk is not None else decoder.close()
+      with profiling.stage("build entities"):
+        for path, bp_ent in bp_ents:
+          addEntity(path, bp_ent)
+      if chunk is None:
+        break
+  except LuaDecodeError as e:
+    raise RuntimeError("Could not parse blueprint: {}".format(e)) from e
+
+  if isinstance(decoder.result, dict):
+    if "book" in decoder.result:
+      raise RuntimeError("Blueprint is a blueprint book, import it with importBlueprintBook")
+    addBlueprintMeta(layout, decoder.result)
+  with profiling.stage("connect wires"):
+    connectBlueprintWires(layout, connections)
+
+  layout.flags["meta_valid"] = True
+  return layout
+
+def importBlueprintStream(stream, string = True, chunk_size = 1 << 16):
+  """ Convert blueprint read from a text file object to Layout, see importBlueprint """
+  return importBlueprintChunks(iter(lambda: stream.read(chunk_size), ""), string)
+
+def importBlueprint(blueprint, string = True, chunk_size = 1 << 16):
   """ 
-  Convert lua blueprint to Layout.
-  If string==True, expect blueprint string (gzip+base64)
+  Convert blueprint to Layout.
+  If string==True, expect blueprint string: gzip+base64 of Lua, or a version
+  byte and base64 of zlib-compressed JSON, detected automatically.
   Otherwise, expect lua table obtained via
   "/c serpent.line(game.player.cursor_stack.get_blueprint_entities()):
+  The Layout is taken from the active conversion cache if it holds one for this blueprint.
   """
+  chunks = (blueprint[i:i+chunk_size] for i in range(0, len(blueprint), chunk_size))
+  return cache.cachedLayout("blueprint layout", blueprint, lambda: importBlueprintChunks(chunks, string),
+    string=string)
 
-  # Decode blueprint string
-  if string:
-    blueprint = gzip.decompress(base64.b64decode(blueprint)).decode("utf-8")
+class Base64Writer:
+  """ Binary stream writing the base64 encoding of its input to a text stream """
+  def __init__(self, stream):
+    self.stream = stream
+    self.pending = b"" # bytes past the last multiple of 3
 
-  # strip any serpent-made lua around the table
-  table = re.search(r'\{.*\}', blueprint, re.DOTALL)
-  if table:
-    bp = lua.decode(table.group(0))
-  else:
-    raise RuntimeError("Could not parse blueprint")
+  def write(self, data):
+    if self.pending:
+      data = self.pending + data
+    end = len(data) - len(data)%3
+    self.pending = data[end:]
+    if end:
+      with profiling.stage("base64"):
+        text = base64.b64encode(memoryview(data)[:end]).decode('ascii')
+      self.stream.write(text)
 
-  layout = Layout()
-  ents_by_id = {} # lua form of entities indexed by id
-  wires = set()
+  def close(self):
+    self.stream.write(base64.b64encode(self.pending).decode('ascii'))
+    self.pending = b""
+
+class CompressingWriter:
+  """
+  Text stream compressing the utf-8 encoding of its input with zlib into a binary stream.
+  `wbits` selects the container as for zlib.compressobj: 16+MAX_WBITS for gzip, MAX_WBITS for zlib.
+  Text is compressed in pieces of about `buffer_size` characters.
+  """
+  def __init__(self, stream, level = 9, wbits = zlib.MAX_WBITS, buffer_size = 1 << 16):
+    self.stream = stream
+    self.compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    self.buffer_size = buffer_size
+    self.parts = []
+    self.size = 0
 
-  if "name" in bp:
-    layout.meta["name"] = bp["name"]
+  def write(self, text):
+    self.parts.append(text)
+    self.size += len(text)
+    if self.size>=self.buffer_size:
+      self.flush()
 
-  if "icons" in bp:
-    layout.meta["icons"] = [elem["signal"] for elem in sorted(bp["icons"], key=lambda e: e["index"])]
+  def flush(self):
+    with profiling.stage("compress"):
+      data = self.compressor.compress("".join(self.parts).encode('utf-8'))
+    self.parts.clear()
+    self.size = 0
+    if data:
+      self.stream.write(data)
+
+  def close(self):
+    self.flush()
+    with profiling.stage("compress"):
+      data = self.compressor.flush()
+    self.stream.write(data)
+
+def getBlueprintEntity(ent):
+  """ Get the blueprint entity table of an entity """
+  ent_bp = {}
+  ent_bp["connections"] = {}
+  for i,term in enumerate(ent.terminals):
+    bp_wires_by_color = defaultdict(list)
+    for wire in term.wires:
+      other_term = wire.other(term)
+      other_ent = other_term.ent
+      circuit_id = other_ent.terminals.index(other_term)+1 # terminals are in circuit id order
+
+      bp_wires_by_color[wire.color.name].append(
+        {"circuit_id": circuit_id, "entity_id": other_ent.number})
+
+    ent_bp["connections"][str(i+1)] = bp_wires_by_color
+  ent_bp["entity_number"] = ent.number
+  ent_bp["name"] = ent.name
+  ent_bp["position"] = ent.position
+  if hasattr(ent, "direction"):
+    ent_bp["direction"] = ent.direction.value
+  if hasattr(ent, "behavior"):
+    ent_bp["control_behavior"] = ent.behavior
+  return ent_bp
+
+def getBlueprintFields(layout, first_ent_name, format):
+  """ Get the fields of the blueprint table after the entities """
+  blueprint = {}
+
+  # Name is optional
+  if "name" in layout.meta:
+    blueprint["label" if format=="json" else "name"] = layout.meta["name"]
 
-  if "entities" in bp:
-    bp_entities = bp["entities"]
+  # Icons are required
+  if "icons" in layout.meta:
+    blueprint["icons"] = [{"signal": icon, "index": i} for i, icon in enumerate(layout.meta["icons"], 1)]
+  elif first_ent_name is None:
+    raise RuntimeError("Cannot produce blueprint without entities or icons")
   else:
-    bp_entities = bp
-
-  # blueprint entities contain entity_numbers, but blueprint stringifiers remove it
-  if "entity_number" not in bp_entities[0]:
-    for i, bp_entity in enumerate(bp_entities, 1):
-      bp_entity["entity_number"] = i 
-
-  # Create all entities 
-  for bp_ent in bp_entities:
-    ent = buildEntFromBlueprint(bp_ent)
-
-    layout.entities.add(ent)
-    ents_by_id[bp_ent["entity_number"]] = ent
-  
-  # Create all wires
-  for bp_ent in bp_entities:
-    for term_i,lua_terminal in bp_ent["connections"].items():
-      source_term = ents_by_id[bp_ent["entity_number"]].terminals[int(term_i)-1]
-      for color,lua_wires in lua_terminal.items():
-        for lua_wire in lua_wires:
-          if "circuit_id" in lua_wire:
-            terminal_i = lua_wire["circuit_id"]-1
-          else:
-            terminal_i = 0
-            
-          target_ent_id = lua_wire["entity_id"]
-          target_term = ents_by_id[target_ent_id].terminals[terminal_i]
-          wire = Wire({source_term, target_term},WireColor[color])
-          wires.add(wire)
-          source_term.wires.add(wire)
-          
-  layout.flags["meta_valid"] = True
-  return layout
+    blueprint["icons"] = [{"index": 1, "signal":
+                          {"type": "item", "name": first_ent_name}}]
+
+  if format=="json":
+    blueprint["item"] = "blueprint"
+    blueprint["version"] = json_blueprint_version
+  return blueprint
 
-def exportBlueprint(layout, string = True):
+@profiling.staged("export blueprint")
+def writeBlueprint(layout, stream, string = True, format = "lua", level = 9):
   """
-  Convert Layout to lua blueprint.
-  If string==True, outputs a blueprint string (gzip+base64)
-  Otherwise, blueprint is an entity list that can be used via
-  "/c game.player.cursor_stack.set_blueprint_entities(blueprint)"
+  Write a Layout as a blueprint to a text stream; see exportBlueprint.
+  Entities are serialized one at a time, through a compressor, into a base64 writer,
+  so the blueprint is never held whole in memory.
   """
   if not layout.flags["meta_valid"]:
       raise RuntimeError("Cannot produce blueprint without valid meta info")
+  if format not in blueprint_formats:
+    raise RuntimeError("Unknown blueprint format {}".format(format))
 
-  bp_entities = []
-  for ent in layout.entities:
-    ent_bp = {}
-    ent_bp["connections"] = {}
-    for i,term in enumerate(ent.terminals):
-      bp_term = str(i+1)
-      bp_wires_by_color = defaultdict(list)
-      for wire in term.wires:
-        other_term = list(wire.terminals - {term})[0]
-        other_ent = other_term.ent
-        circuit_id = other_ent.terminal_types[other_term.type]+1
-
-        bp_wires_by_color[wire.color.name].append(
-          {"circuit_id": circuit_id, "entity_id": other_ent.number})
-      
-      ent_bp["connections"][bp_term] = bp_wires_by_color
-      ent_bp["entity_number"] = ent.number
-      ent_bp["name"] = ent.name
-      ent_bp["position"] = ent.position
-      if hasattr(ent, "direction"):
-        ent_bp["direction"] = ent.direction.value
-      if hasattr(ent, "behavior"):
-        ent_bp["control_behavior"] = ent.behavior
-    bp_entities.append(ent_bp)
-  bp_entities.sort(key=lambda ent_bp: ent_bp["entity_number"])
+  if not string:
+    writer = stream
+  elif format=="json":
+    stream.write(json_version_byte)
+    base64_writer = Base64Writer(stream)
+    writer = CompressingWriter(base64_writer, level, zlib.MAX_WBITS)
+  else:
+    base64_writer = Base64Writer(stream)
+    writer = CompressingWriter(base64_writer, level, 16+zlib.MAX_WBITS) # gzip
 
   if not string:
-    lua_entities = lua.encode(bp_entities)
-    return lua_entities
+    writer.write("{")
+    writeBlueprintEntities(layout, writer, format)
+    writer.write("}")
+    return
+
+  if format=="json":
+    writer.write('{"blueprint":')
+    writeBlueprintTable(layout, writer, format)
+    writer.write("}")
+  else:
+    writer.write("do local _=")
+    writeBlueprintTable(layout, writer, format)
+    writer.write(";return _;end")
+  writer.close()
+  base64_writer.close()
+
+def writeBlueprintEntities(layout, writer, format):
+  """ Write the comma-separated blueprint entity tables of a Layout, returning the name of the first one """
+  first_ent_name = None
+  for ent in layout.getSortedEntities():
+    ent_bp = getBlueprintEntity(ent)
+    if first_ent_name is None:
+      first_ent_name = ent.name
+    else:
+      writer.write(",")
+    if format=="json":
+      writer.write(json.dumps(ent_bp, separators=(",", ":")))
+    else:
+      lua_table.dump(ent_bp, writer)
+  return first_ent_name
+
+def writeBlueprintTable(layout, writer, format):
+  """ Write the blueprint table of a Layout: its entities, then name and icons """
+  if format=="json":
+    writer.write('{"entities":[')
+    first_ent_name = writeBlueprintEntities(layout, writer, format)
+    blueprint = getBlueprintFields(layout, first_ent_name, format)
+    writer.write("]," + json.dumps(blueprint, separators=(",", ":"))[1:])
+  else:
+    writer.write("{entities={")
+    first_ent_name = writeBlueprintEntities(layout, writer, format)
+    blueprint = getBlueprintFields(layout, first_ent_name, format)
+    writer.write("}")
+    for key, value in blueprint.items():
+      writer.write("," + lua_table.encodeKey(key))
+      lua_table.dump(value, writer)
+    writer.write("}")
+
+def exportBlueprint(layout, string = True, format = "lua", level = 9):
+  """
+  Convert Layout to blueprint.
+  If string==True, outputs a blueprint string, in one of blueprint_formats:
+    lua: gzip+base64 of a Lua table
+    json: version byte, then base64 of zlib-compressed JSON
+  compressed at zlib `level` (1 is fastest, 9 smallest).
+  Otherwise, blueprint is a Lua entity list that can be used via
+  "/c game.player.cursor_stack.set_blueprint_entities(blueprint)"
+  """
+  buffer = io.StringIO()
+  writeBlueprint(layout, buffer, string, format, level)
+  return buffer.getvalue()
+
+# Books whose decompressed text is at least this long have their pages built in parallel by default
+parallel_threshold = 1 << 20
+# Fields of the book table kept in BlueprintBook.meta, besides the name and icons
+book_meta_keys = ("active_index", "description")
+
+class BlueprintBook:
+  """
+  A blueprint book: its pages in order, and meta with its name, icons, active_index and description.
+  A page is a Layout or, in JSON books, a nested BlueprintBook, with its index in the
+  book in meta["index"]; other JSON book items (e.g. deconstruction planners) are kept
+  as their decoded tables, so exporting the book loses nothing.
+  """
+  def __init__(self, pages = None, meta = None):
+    self.pages = pages if pages is not None else []
+    self.meta = meta if meta is not None else {}
+
+  def getLayouts(self):
+    """ The Layouts of the book and of the books inside it, in page order """
+    layouts = []
+    for page in self.pages:
+      if isinstance(page, Layout):
+        layouts.append(page)
+      elif isinstance(page, BlueprintBook):
+        layouts.extend(page.getLayouts())
+    return layouts
+
+def addBookMeta(book, bp, name_key):
+  addBlueprintMeta(book, bp, name_key)
+  for key in book_meta_keys:
+    if key in bp:
+      book.meta[key] = bp[key]
+
+# Strings, comments and braces of Lua text, and the start of a book table:
+# enough to find the page tables of a book without decoding them
+book_token_re = re.compile(r'''(?P<book>\bbook\s*=\s*\{)
+  |"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'
+  |--\[(?P<c>=*)\[.*?\](?P=c)\]|--[^\n]*
+  |\[(?P<s>=*)\[.*?\](?P=s)\]
+  |[{}]''', re.S|re.X)
+
+def splitLuaBook(text):
+  """
+  Cut the page tables out of the text of a Lua blueprint book.
+  Returns (outer text, page texts), the outer text holding the number i in place of page i,
+  or None if the text isn't a book.
+  """
+  depth = 0
+  book_depth = None # depth inside the book table, while in it
+  found = False
+  outer = []
+  pages = []
+  last = start = 0
+  for match in book_token_re.finditer(text):
+    token = match.group()
+    if match.group("book"):
+      depth += 1
+      if depth==2 and not found:
+        book_depth = depth
+        found = True
+    elif token=="{":
+      if depth==book_depth:
+        start = match.start()
+      depth += 1
+    elif token=="}":
+      depth -= 1
+      if depth==book_depth:
+        outer.append(text[last:start])
+        outer.append(str(len(pages)))
+        pages.append(text[start:match.end()])
+        last = match.end()
+      elif book_depth is not None and depth<book_depth:
+        book_depth = None
+  if not found:
+    return None
+  outer.append(text[last:])
+  return "".join(outer), pages
+
+def importBookPage(format, page):
+  """ Build the Layout of a book page: a decoded JSON blueprint table, or the text of a Lua one """
+  if format=="json":
+    return buildJsonLayout(page)
+  return importBlueprintChunks([page], string=False)
+
+def buildBookPages(format, pages, jobs):
+  """
+  Build the Layouts of the pages of a book with importBookPage, in `jobs` worker processes.
+  The largest pages are started first, so the slowest page doesn't start last.
+  """
+  if jobs<=1 or len(pages)<=1:
+    return [importBookPage(format, page) for page in pages]
+  from concurrent.futures import ProcessPoolExecutor
+  if format=="json":
+    sizes = [len(page.get("entities", ())) for page in pages]
   else:
-    blueprint = {"entities": bp_entities}
+    sizes = [len(page) for page in pages]
+  order = sorted(range(len(pages)), key=lambda i: -sizes[i])
+  layouts = [None]*len(pages)
+  with ProcessPoolExecutor(max_workers=jobs) as pool:
+    with pausedCollector(): # unpickling the Layouts
+      for i, layout in zip(order, pool.map(importBookPage, itertools.repeat(format), [pages[i] for i in order])):
+        layouts[i] = layout
+  return layouts
+
+def readJsonBook(bp, pages, places):
+  """
+  Get the BlueprintBook of a decoded JSON book table, leaving out the Layouts of its pages:
+  their blueprint tables are appended to `pages`, and (book, position, index) to `places`.
+  """
+  book = BlueprintBook()
+  addBookMeta(book, bp, "label")
+  for item in sorted(bp.get("blueprints", ()), key=lambda item: item.get("index", 0)):
+    if "blueprint" in item:
+      pages.append(item["blueprint"])
+      places.append((book, len(book.pages), item.get("index")))
+      book.pages.append(None)
+    elif "blueprint_book" in item:
+      nested = readJsonBook(item["blueprint_book"], pages, places)
+      nested.meta["index"] = item.get("index")
+      book.pages.append(nested)
+    else:
+      book.pages.append(item)
+  return book
 
-    # Name is optional
-    if "name" in layout.meta:
-      blueprint["name"] = layout.meta["name"]
+def readLuaBook(outer, page_texts, pages, places):
+  """ Like readJsonBook, for a Lua book split by splitLuaBook """
+  try:
+    bp = lua_table.decode(outer)
+  except LuaDecodeError as e:
+    raise RuntimeError("Could not parse blueprint book: {}".format(e)) from e
+  book = BlueprintBook()
+  addBookMeta(book, bp, "name")
+  items = bp["book"].items() if isinstance(bp["book"], dict) else enumerate(bp["book"], 1)
+  for index, page_i in sorted(items):
+    pages.append(page_texts[page_i])
+    places.append((book, len(book.pages), index))
+    book.pages.append(None)
+  return book
 
-    # Icons are required
-    if "icons" in layout.meta:
-      blueprint["icons"] = [{"signal": icon, "index": i} for i, icon in enumerate(layout.meta["icons"], 1)]
+@profiling.staged("import blueprint book")
+def importBlueprintBook(blueprint, jobs = None):
+  """
+  Convert a blueprint book string, in either format of importBlueprint, to BlueprintBook.
+  The book is decompressed, then its pages are decoded and built in `jobs` worker processes.
+  jobs=1 always builds them serially, and jobs=None does so for books shorter than parallel_threshold.
+  A single blueprint is also accepted, as a book of one page.
+  """
+  profiling.count("blueprint chars", len(blueprint))
+  pages = []
+  places = []
+  if isJsonBlueprint(blueprint):
+    format = "json"
+    with profiling.stage("base64+zlib"):
+      text = zlib.decompress(base64.b64decode(blueprint.strip()[1:]))
+    profiling.count("decompressed chars", len(text))
+    with profiling.stage("json decode"):
+      data = json.loads(text)
+    if "blueprint_book" in data:
+      book = readJsonBook(data["blueprint_book"], pages, places)
+    elif "blueprint" in data:
+      book = BlueprintBook()
+      pages.append(data["blueprint"])
+      places.append((book, 0, 0))
+      book.pages.append(None)
+    else:
+      raise RuntimeError("Not a blueprint: {}".format(", ".join(data)))
+  else:
+    format = "lua"
+    with profiling.stage("base64+gzip"):
+      text = "".join(iterBlueprintText((blueprint,)))
+    with profiling.stage("split pages"):
+      split = splitLuaBook(text)
+    if split is not None:
+      book = readLuaBook(*split, pages, places)
     else:
-      first_ent_name = bp_entities[0]["name"]
-      blueprint["icons"] = [{"index": 1, "signal":
-                            {"type": "item", "name": first_ent_name}}]
+      book = BlueprintBook()
+      pages.append(text)
+      places.append((book, 0, 1))
+      book.pages.append(None)
+
+  if jobs is None:
+    jobs = os.cpu_count() if len(text)>=parallel_threshold else 1
+  del text
+  with profiling.stage("build pages"):
+    layouts = buildBookPages(format, pages, jobs)
+  for (page_book, position, index), layout in zip(places, layouts):
+    layout.meta["index"] = index
+    page_book.pages[position] = layout
+  return book
+
+def getBookFields(book, format):
+  """ Get the fields of the book table after the pages """
+  fields = {}
+  if "name" in book.meta:
+    fields["label" if format=="json" else "name"] = book.meta["name"]
+  if "icons" in book.meta:
+    fields["icons"] = [{"signal": icon, "index": i} for i, icon in enumerate(book.meta["icons"], 1)]
+  for key in book_meta_keys:
+    if key in book.meta:
+      fields[key] = book.meta[key]
+  if format=="json":
+    fields["item"] = "blueprint-book"
+    fields["version"] = json_blueprint_version
+  return fields
+
+def writeBookTable(book, writer, format):
+  """ Write the book table of a BlueprintBook: its pages, then its meta """
+  for page in book.pages:
+    if isinstance(page, Layout) and not page.flags["meta_valid"]:
+      raise RuntimeError("Cannot produce blueprint without valid meta info")
+    if format=="lua" and not isinstance(page, Layout):
+      raise RuntimeError("Lua blueprint books can only hold blueprints")
+
+  if format=="json":
+    writer.write('{"blueprints":[')
+    for position, page in enumerate(book.pages):
+      if position:
+        writer.write(",")
+      if isinstance(page, dict):
+        writer.write(json.dumps(page, separators=(",", ":")))
+        continue
+      index = page.meta.get("index", position)
+      if isinstance(page, BlueprintBook):
+        writer.write('{{"index":{},"blueprint_book":'.format(json.dumps(index)))
+        writeBookTable(page, writer, format)
+      else:
+        writer.write('{{"index":{},"blueprint":'.format(json.dumps(index)))
+        writeBlueprintTable(page, writer, format)
+      writer.write("}")
+    writer.write("]," + json.dumps(getBookFields(book, format), separators=(",", ":"))[1:])
+  else:
+    writer.write("{book={")
+    for position, page in enumerate(book.pages):
+      if position:
+        writer.write(",")
+      writeBlueprintTable(page, writer, format)
+    writer.write("}")
+    for key, value in getBookFields(book, format).items():
+      writer.write("," + lua_table.encodeKey(key))
+      lua_table.dump(value, writer)
+    writer.write("}")
 
-    lua_blueprint = lua.encode(blueprint)
-    lua_blueprint = "do local _="+lua_blueprint+";return _;end"
+@profiling.staged("export blueprint book")
+def writeBlueprintBook(book, stream, format = "lua", level = 9):
+  """ Write a BlueprintBook as a blueprint book string to a text stream; see exportBlueprintBook """
+  if format not in blueprint_formats:
+    raise RuntimeError("Unknown blueprint format {}".format(format))
+  base64_writer = Base64Writer(stream)
+  if format=="json":
+    stream.write(json_version_byte)
+    writer = CompressingWriter(base64_writer, level, zlib.MAX_WBITS)
+    writer.write('{"blueprint_book":')
+    writeBookTable(book, writer, format)
+    writer.write("}")
+  else:
+    writer = CompressingWriter(base64_writer, level, 16+zlib.MAX_WBITS) # gzip
+    writer.write("do local _=")
+    writeBookTable(book, writer, format)
+    writer.write(";return _;end")
+  writer.close()
+  base64_writer.close()
 
-     # Encode blueprint string
-    bp_string = base64.b64encode(gzip.compress(lua_blueprint.encode('utf-8'))).decode('utf-8')
-    return bp_string
+def exportBlueprintBook(book, format = "lua", level = 9):
+  """
+  Convert BlueprintBook to a blueprint book string, in one of blueprint_formats.
+  Pages are written in order, each as exportBlueprint would write its blueprint table.
+  JSON books keep the page indexes in meta["index"]; Lua books hold a list of pages
+  and can't hold nested books or other items.
+  """
+  buffer = io.StringIO()
+  writeBlueprintBook(book, buffer, format, level)
+  return buffer.getvalue()
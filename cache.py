@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# Content-addressed on-disk cache of conversion results
+#
+# Entries are keyed by a hash of the converter version, the kind of result, its options and
+# the input text, so an unchanged input is served with a hash and a file read instead of a
+# decode and parse, and editing any converter module invalidates every entry.
+# Entries are files named by their key; a hit refreshes the file's modification time, and
+# once the cache grows past its size limit the least recently used entries are deleted.
+# Writes go through a temporary file and a rename, so processes can share a cache directory.
+# The total size of the entries is kept in a `.size` file, so stores don't walk the directory;
+# concurrent stores may miss each other's updates, which eviction corrects by walking it.
+#
+# The cache in use is `active`, set with enable() or the FACTORILOG_CACHE environment
+# variable (which worker processes inherit); with no active cache nothing is stored.
+
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+
+from factorilog import pausedCollector
+import profiling
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+# Files whose contents decide conversion results
+converter_files = ("conversion.py", "factorilog.py", "canonical.py", "blueprint_layer.py", "netlist_layer.py", "netlist_fastparser.py",
+                   "netlist_parser.py", "lua_table.py", "string_ops.py", "signals.lua")
+cache_format = 1
+
+default_directory = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "factorilog")
+default_max_bytes = 256 << 20
+
+@functools.lru_cache(maxsize=None)
+def getConverterVersion():
+  """ Hash of the converter sources, computed once per process """
+  digest = hashlib.blake2b(str(cache_format).encode(), digest_size=16)
+  for name in converter_files:
+    with open(os.path.join(package_dir, name), 'rb') as f:
+      digest.update(f.read())
+  return digest.hexdigest()
+
+class ConversionCache:
+  """
+  A cache directory holding at most about `max_bytes` of entries.
+  With layouts=False, only converted strings are stored, not pickled Layouts.
+  """
+  def __init__(self, directory = default_directory, max_bytes = default_max_bytes, layouts = True):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.layouts = layouts
+    self.size_path = os.path.join(directory, ".size")
+
+  def getKey(self, kind, text, **options):
+    """ Key of the result of kind `kind` for an input string or bytes, with conversion options """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(getConverterVersion().encode())
+    digest.update(repr((kind, sorted(options.items()))).encode())
+    digest.update(text.encode("utf-8", "surrogatepass") if isinstance(text, str) else text)
+    return digest.hexdigest()
+
+  def getFileKey(self, kind, path, **options):
+    """ Key of the result of kind `kind` for the contents of a file, read in chunks """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(getConverterVersion().encode())
+    digest.update(repr((kind, sorted(options.items()))).encode())
+    with open(path, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+  def getPath(self, key):
+    return os.path.join(self.directory, key[:2], key)
+
+  def get(self, key):
+    """ Get the bytes stored under a key, or None """
+    path = self.getPath(key)
+    try:
+      with open(path, 'rb') as f:
+        data = f.read()
+    except OSError:
+      profiling.count("cache misses")
+      return None
+    try:
+      os.utime(path) # most recently used
+    except OSError:
+      pass
+    profiling.count("cache hits")
+    return data
+
+  def put(self, key, data):
+    """ Store bytes under a key, evicting old entries if the cache is full. Failures are ignored """
+    path = self.getPath(key)
+    try:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+      with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+      os.replace(temp_path, path)
+    except OSError:
+      return
+    size = self.getSize()
+    if size is None:
+      # no total kept yet, so count the entries (including this one) once
+      size = sum(size for _, size, _ in self.getEntries())
+    else:
+      size += len(data)
+    if size > self.max_bytes:
+      self.evict()
+    else:
+      self.setSize(size)
+
+  def getSize(self):
+    """ Total bytes of entries as last stored, or None """
+    try:
+      with open(self.size_path) as f:
+        return int(f.read())
+    except (OSError, ValueError):
+      return None
+
+  def setSize(self, size):
+    try:
+      fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+      with os.fdopen(fd, 'w') as f:
+        f.write(str(size))
+      os.replace(temp_path, self.size_path)
+    except OSError:
+      pass
+
+  def getEntries(self):
+    """ (modification time, size, path) of every entry """
+    entries = []
+    for dirpath, _, filenames in os.walk(self.directory):
+      for filename in filenames:
+        if filename.startswith("."): # temporary files and the size total
+          continue
+        path = os.path.join(dirpath, filename)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          continue
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+    return entries
+
+  def evict(self, fraction = 0.75):
+    """ Delete the least recently used entries until the cache is down to `fraction` of its limit """
+    entries = sorted(self.getEntries())
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+      if total <= self.max_bytes*fraction:
+        break
+      try:
+        os.unlink(path)
+      except OSError:
+        continue
+      total -= size
+    self.setSize(total)
+
+  def clear(self):
+    for _, _, path in self.getEntries():
+      try:
+        os.unlink(path)
+      except OSError:
+        pass
+    self.setSize(0)
+
+  def getText(self, key):
+    data = self.get(key)
+    return data.decode("utf-8") if data is not None else None
+
+  def putText(self, key, text):
+    self.put(key, text.encode("utf-8"))
+
+  def getLayout(self, key):
+    """ Get a fresh copy of the Layout stored under a key, or None """
+    if not self.layouts:
+      return None
+    data = self.get(key)
+    if data is None:
+      return None
+    try:
+      with pausedCollector():
+        return pickle.loads(data)
+    except Exception:
+      return None # e.g. a truncated entry; it will be replaced
+
+  def putLayout(self, key, layout):
+    if self.layouts:
+      with pausedCollector():
+        data = pickle.dumps(layout, pickle.HIGHEST_PROTOCOL)
+      self.put(key, data)
+
+def getEnvironmentCache():
+  if not os.environ.get("FACTORILOG_CACHE"):
+    return None
+  return ConversionCache(os.environ["FACTORILOG_CACHE"],
+    int(os.environ.get("FACTORILOG_CACHE_SIZE") or default_max_bytes),
+    os.environ.get("FACTORILOG_CACHE_LAYOUTS", "1")!="0")
+
+active = getEnvironmentCache()
+
+def enable(directory = default_directory, max_bytes = default_max_bytes, layouts = True):
+  """ Make a cache directory the active cache, for this process and the workers it starts """
+  global active
+  active = ConversionCache(directory, max_bytes, layouts)
+  os.environ["FACTORILOG_CACHE"] = directory
+  os.environ["FACTORILOG_CACHE_SIZE"] = str(max_bytes)
+  os.environ["FACTORILOG_CACHE_LAYOUTS"] = "1" if layouts else "0"
+  return active
+
+def disable():
+  global active
+  active = None
+  os.environ.pop("FACTORILOG_CACHE", None)
+
+def cachedText(kind, text, convert, **options):
+  """ Get the string converted from `text` by `convert()` from the active cache, or convert and store it """
+  store = active
+  if store is None:
+    return convert()
+  key = store.getKey(kind, text, **options)
+  result = store.getText(key)
+  if result is None:
+    result = convert()
+    store.putText(key, result)
+  return result
+
+def cachedLayout(kind, text, build, **options):
+  """ Get the Layout built from `text` by `build()` from the active cache, or build and store it """
+  store = active
+  if store is None:
+    return build()
+  key = store.getKey(kind, text, **options)
+  layout = store.getLayout(key)
+  if layout is None:
+    layout = build()
+    store.putLayout(key, layout)
+  return layout
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# Canonical ordering of the entities and hyperwires of a circuit
+#
+# A circuit is a graph of entity and hyperwire nodes, with an edge for each terminal of an entity
+# on a hyperwire, weighted by the terminal type. Entities with the same label and the same
+# hyperwires on each terminal are interchangeable, as are hyperwires joining the same terminals,
+# so each such group of twins becomes a single node.
+# Each connected part of the graph is ordered by colour refinement to a stable colouring. Where
+# nodes are still tied, each node of the smallest tied colour is individualized in turn and the
+# colouring refined again, keeping the order with the smallest certificate; nodes that the
+# automorphisms found so far map onto an explored node are skipped. Parts are then sorted by
+# their certificates, so the order only depends on the structure of the circuit.
+
+from collections import defaultdict, deque
+
+from factorilog import DisjointSet
+
+def getWeight(term_type):
+  """ Edge weight of a terminal type, kept apart from the others when summed """
+  return 1 << (32*term_type.value)
+
+class Partition:
+  """
+  An ordered partition of the nodes 0..n-1 of a graph, as refined by colour refinement.
+  `elements` lists the nodes cell by cell; a cell is named by the position of its first node,
+  and ends at cell_end[cell]. `tied` holds the cells of several nodes.
+  """
+  __slots__ = ("elements", "pos", "cell_of", "cell_end", "tied")
+
+  def __init__(self, colors = ()):
+    self.elements = sorted(range(len(colors)), key=colors.__getitem__)
+    self.pos = [0]*len(colors)
+    self.cell_of = [0]*len(colors)
+    self.cell_end = [0]*len(colors)
+    cell = 0
+    for i, node in enumerate(self.elements):
+      self.pos[node] = i
+      if colors[node]!=colors[self.elements[cell]]:
+        self.cell_end[cell] = i
+        cell = i
+      self.cell_of[node] = cell
+    if colors:
+      self.cell_end[cell] = len(colors)
+    self.tied = {cell for cell in self.getCells() if self.cell_end[cell]-cell>1}
+
+  def copy(self):
+    other = Partition()
+    other.elements = list(self.elements)
+    other.pos = list(self.pos)
+    other.cell_of = list(self.cell_of)
+    other.cell_end = list(self.cell_end)
+    other.tied = set(self.tied)
+    return other
+
+  def getCells(self):
+    cell = 0
+    while cell<len(self.elements):
+      yield cell
+      cell = self.cell_end[cell]
+
+  def split(self, cell, members, counts, queue, queued):
+    """
+    Split the cell holding `members` by their counts, the other nodes of the cell counting 0.
+    The members are moved to the end of the cell in count order, so the rest keep the cell's name.
+    New cells are queued as splitters, but for the largest piece of a cell that wasn't queued.
+    """
+    end = self.cell_end[cell]
+    if len(members)==end-cell:
+      first = counts[members[0]]
+      if all(counts[node]==first for node in members):
+        return
+    members.sort(key=counts.__getitem__)
+    elements, pos = self.elements, self.pos
+    tail = end - len(members)
+    for i, node in enumerate(members, tail):
+      other = elements[i]
+      elements[pos[node]] = other
+      pos[other] = pos[node]
+      elements[i] = node
+      pos[node] = i
+
+    starts = [cell] if tail>cell else []
+    previous = None
+    for i, node in enumerate(members, tail):
+      if counts[node]!=previous:
+        starts.append(i)
+        previous = counts[node]
+      self.cell_of[node] = starts[-1]
+    for start, next_start in zip(starts, starts[1:] + [end]):
+      self.cell_end[start] = next_start
+      if next_start-start>1:
+        self.tied.add(start)
+      else:
+        self.tied.discard(start)
+
+    if cell in queued:
+      new = starts[1:]
+    else:
+      largest = max(starts, key=lambda start: self.cell_end[start]-start)
+      new = [start for start in starts if start!=largest]
+    queue.extend(new)
+    queued.update(new)
+
+  def refine(self, adjacency, queue, queued):
+    """ Refine until every cell has the same weighted count of edges to each cell, splitting by queued cells """
+    while queue:
+      splitter = queue.popleft()
+      queued.discard(splitter)
+      counts = defaultdict(int)
+      for other in self.elements[splitter:self.cell_end[splitter]]:
+        for node, weight in adjacency[other]:
+          counts[node] += weight
+      touched = defaultdict(list)
+      for node in counts:
+        touched[self.cell_of[node]].append(node)
+      for cell in sorted(touched):
+        self.split(cell, touched[cell], counts, queue, queued)
+
+  def individualize(self, node, adjacency):
+    """ Give a node a cell of its own, then refine """
+    queue = deque()
+    queued = set()
+    self.split(self.cell_of[node], [node], {node: 1}, queue, queued)
+    self.refine(adjacency, queue, queued)
+
+  def getTarget(self):
+    """ Nodes of the smallest cell holding several nodes, the first such cell on ties, or None """
+    if not self.tied:
+      return None
+    target = min(self.tied, key=lambda cell: (self.cell_end[cell]-cell, cell))
+    return self.elements[target:self.cell_end[target]]
+
+def getCertificate(partition, adjacency, colors):
+  """ The graph as relabelled by a discrete partition, comparable between graphs with the same colours """
+  pos = partition.pos
+  return tuple((colors[node], tuple(sorted((pos[other], weight) for other, weight in adjacency[node])))
+               for node in partition.elements)
+
+class SearchNode:
+  """ A partition in the search for the smallest certificate, and the nodes individualized below it """
+  __slots__ = ("partition", "targets", "children", "explored", "orbits", "first_child")
+
+  def __init__(self, partition, targets):
+    self.partition = partition
+    self.targets = set(targets)
+    self.children = iter(targets)
+    self.explored = []
+    self.first_child = None # partition after individualizing the first child
+    self.orbits = DisjointSet() # of the targets, under the automorphisms fixing the nodes above
+
+  def addAutomorphism(self, moved):
+    """ Merge the orbits of an automorphism, given as {node: image} for the nodes it moves """
+    for node, image in moved.items():
+      if node in self.targets:
+        self.orbits.union(node, image)
+
+  def isExplored(self, child):
+    """ Whether an automorphism maps a child onto one explored before it """
+    root = self.orbits.find(child)
+    return any(self.orbits.find(node)==root for node in self.explored if node!=child)
+
+  def nextChild(self):
+    """ The next node to individualize that no automorphism maps onto an explored one, or None """
+    roots = {self.orbits.find(node) for node in self.explored}
+    for node in self.children:
+      if self.orbits.find(node) not in roots:
+        self.explored.append(node)
+        return node
+    return None
+
+def isSingleton(partition, node):
+  cell = partition.cell_of[node]
+  return partition.cell_end[cell]==cell+1
+
+def guessAutomorphism(first, other, adjacency, colors):
+  """
+  Try the permutation swapping the nodes that are alone in their cell at the same position in
+  two partitions, as when individualizing either of two interchangeable parts of a circuit.
+  Returns it as {node: image} for the nodes it moves if it is an automorphism, or None.
+  """
+  moved = {}
+  for a, b in zip(first.elements, other.elements):
+    if a!=b and isSingleton(first, a) and isSingleton(other, b):
+      moved[a] = b
+  for a, b in list(moved.items()):
+    moved.setdefault(b, a)
+  if not moved or set(moved)!=set(moved.values()):
+    return None
+  for node, image in moved.items():
+    if colors[node]!=colors[image]:
+      return None
+    mapped = sorted((moved.get(other, other), weight) for other, weight in adjacency[node])
+    if mapped!=sorted(adjacency[image]):
+      return None
+  return moved
+
+def searchPart(adjacency, colors):
+  """
+  Find the canonical labeling of a connected graph with nodes coloured by `colors`: the discrete
+  partition with the smallest certificate among those reached by individualization and refinement.
+  A leaf with the certificate of the first or the best leaf gives an automorphism, which
+  shows the rest of its subtree to hold nothing new, so the search returns to the node where
+  the two leaves' paths part, and skips the children that the automorphism maps onto explored ones.
+  Automorphisms swapping a child with the first child of a node are also tried directly,
+  which saves searching below every one of many interchangeable parts.
+  Returns (certificate, nodes in canonical order).
+  """
+  partition = Partition(colors)
+  partition.refine(adjacency, deque(partition.getCells()), set(partition.getCells()))
+  first = best = None # (certificate, labeling, path of individualized nodes)
+  stack = []
+  path = []
+  while True:
+    targets = partition.getTarget()
+    if targets is not None:
+      stack.append(SearchNode(partition, targets))
+    else:
+      leaf = (getCertificate(partition, adjacency, colors), list(partition.elements), list(path))
+      if first is None:
+        first = best = leaf
+      else:
+        for reference in (first, best):
+          if leaf[0]==reference[0]:
+            depth = next(i for i, (a, b) in enumerate(zip(path, reference[2])) if a!=b)
+            moved = {node: image for node, image in zip(reference[1], leaf[1]) if node!=image}
+            for node in stack[:depth+1]:
+              node.addAutomorphism(moved)
+            del stack[depth+1:]
+            break
+        else:
+          if leaf[0]<best[0]:
+            best = leaf
+
+    while stack:
+      node = stack[-1]
+      child = node.nextChild()
+      if child is None:
+        stack.pop()
+        continue
+      partition = node.partition.copy()
+      partition.individualize(child, adjacency)
+      if node.first_child is None:
+        node.first_child = partition
+      else:
+        moved = guessAutomorphism(node.first_child, partition, adjacency, colors)
+        if moved:
+          for ancestor in stack:
+            ancestor.addAutomorphism(moved)
+          if node.isExplored(child):
+            continue
+      path[len(stack)-1:] = [child]
+      break
+    else:
+      return best[0], best[1]
+
+def getTwinGroups(items, key):
+  groups = defaultdict(list)
+  for item in items:
+    groups[key(item)].append(item)
+  return list(groups.values())
+
+def getCanonicalOrder(layout, labels):
+  """
+  Order the entities and hyperwires of a Layout from the structure of its circuit alone.
+  `labels` maps each entity to a string describing it. Wire colours are ignored, as in bare netlists.
+  Returns (entities, hyperwires): hyperwires in the order their first entity is reached, and
+  twins (interchangeable entities or hyperwires) next to each other in any order.
+  """
+  layout.getHyperwires()
+  hyper_groups = getTwinGroups([hyperwire for hyperwire in layout.hyperwires if hyperwire.terminals],
+                               lambda hyperwire: frozenset(hyperwire.terminals))
+  hyper_group = {hyperwire: i for i, group in enumerate(hyper_groups) for hyperwire in group}
+  ent_groups = getTwinGroups(layout.entities, lambda ent: (labels[ent],
+    tuple(frozenset(hyper_group[hyperwire] for hyperwire in term.hyperwires) for term in ent.terminals)))
+
+  # nodes: entity groups, then hyperwire groups
+  hyper_base = len(ent_groups)
+  keys = [(0, labels[group[0]], len(group)) for group in ent_groups]
+  keys += [(1, "", len(group)) for group in hyper_groups]
+  ranks = {key: rank for rank, key in enumerate(sorted(set(keys)))}
+  adjacency = [[] for _ in keys]
+  for node, group in enumerate(ent_groups):
+    for term in group[0].terminals:
+      weight = getWeight(term.type)
+      for hyper_node in {hyper_base + hyper_group[hyperwire] for hyperwire in term.hyperwires}:
+        adjacency[node].append((hyper_node, weight))
+        adjacency[hyper_node].append((node, weight))
+
+  parts = []
+  seen = [False]*len(keys)
+  for start in range(len(keys)):
+    if seen[start]:
+      continue
+    seen[start] = True
+    nodes = [start]
+    for node in nodes: # extended as the walk goes
+      for other, _ in adjacency[node]:
+        if not seen[other]:
+          seen[other] = True
+          nodes.append(other)
+    local = {node: i for i, node in enumerate(nodes)}
+    certificate, labeling = searchPart(
+      [[(local[other], weight) for other, weight in adjacency[node]] for node in nodes],
+      [ranks[keys[node]] for node in nodes])
+    parts.append((certificate, [nodes[i] for i in labeling]))
+  parts.sort(key=lambda part: part[0])
+
+  entities = []
+  hyper_order = {}
+  for _, nodes in parts:
+    for node in nodes:
+      if node<hyper_base:
+        entities.extend(ent_groups[node])
+      else:
+        hyper_order[node - hyper_base] = len(hyper_order)
+  hyperwires = {}
+  for ent in entities:
+    for term in ent.terminals:
+      for hyperwire in sorted(term.hyperwires, key=lambda hyperwire: hyper_order[hyper_group[hyperwire]]):
+        hyperwires.setdefault(hyperwire, None)
+  return entities, list(hyperwires)
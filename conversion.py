@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# Blueprint/netlist conversion of single files and batches
+
+import glob
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import blueprint_layer as BlueprintLayer
+import netlist_layer as NetlistLayer
+import cache
+import profiling
+
+# Files picked up when walking a directory, by input format. Neither includes the output
+# suffix of the other direction, so outputs written next to inputs aren't picked up again;
+# .txt is read as whichever format is being converted from.
+blueprint_suffixes = (".blueprint", ".bp", ".txt")
+netlist_suffixes = (".netlist", ".net", ".txt")
+
+def importBlueprintText(bp):
+  """ Import a blueprint string (Lua or JSON) or Lua entity table """
+  try:
+    return BlueprintLayer.importBlueprint(bp, string=True)
+  except OSError:
+    return BlueprintLayer.importBlueprint(bp, string=False)
+
+def blueprintToNetlist(bp, meta = True):
+  """ Convert a blueprint string (Lua or JSON) or Lua entity table to a netlist string """
+  return cache.cachedText("netlist", bp,
+    lambda: NetlistLayer.exportNetlist(importBlueprintText(bp), meta=meta), meta=meta)
+
+def importBlueprintFile(stream):
+  """ Import a blueprint string or Lua entity table from a seekable text file """
+  try:
+    return BlueprintLayer.importBlueprintStream(stream, string=True)
+  except OSError:
+    stream.seek(0)
+    return BlueprintLayer.importBlueprintStream(stream, string=False)
+
+def blueprintStreamToNetlist(stream, meta = True):
+  """ Convert a blueprint string or Lua entity table read from a seekable text file to a netlist string """
+  return NetlistLayer.exportNetlist(importBlueprintFile(stream), meta=meta)
+
+def convertBlueprintFile(in_path, out_path, meta = True):
+  """
+  Convert a blueprint file, streaming the netlist to the output file as it is generated.
+  The output file is only created once the blueprint has been imported.
+  Returns the number of characters written.
+  """
+  profiling.count("bytes in", os.path.getsize(in_path))
+  store = cache.active
+  if store:
+    key = store.getFileKey("netlist", in_path, meta=meta)
+    netlist = store.getText(key)
+    if netlist is not None:
+      with open(out_path, 'w') as out_file:
+        written = out_file.write(netlist)
+      profiling.count("chars out", written)
+      return written
+  with open(in_path, 'r') as in_file:
+    layout = importBlueprintFile(in_file)
+  with open(out_path, 'w') as out_file:
+    written = NetlistLayer.writeNetlist(layout, out_file, meta=meta)
+  profiling.count("chars out", written)
+  profiling.countLayout(layout)
+  if store:
+    storeFile(store, key, out_path)
+  return written
+
+def storeFile(store, key, path):
+  """ Store the contents of an output file in a conversion cache """
+  try:
+    with open(path, 'rb') as f:
+      store.put(key, f.read())
+  except OSError:
+    pass
+
+def netlistToBlueprint(netlist, entity_table = False, format = "lua", level = 9):
+  """
+  Convert a netlist string to a blueprint string in `format` (see BlueprintLayer.blueprint_formats)
+  compressed at zlib `level`, or a Lua entity table.
+  """
+  def convert():
+    layout = NetlistLayer.importNetlist(netlist)
+    return BlueprintLayer.exportBlueprint(layout, string=not entity_table, format=format, level=level)
+  return cache.cachedText("blueprint", netlist, convert, entity_table=entity_table, format=format, level=level)
+
+def convertNetlistFile(in_path, out_path, entity_table = False, format = "lua", level = 9):
+  """
+  Convert a netlist file, streaming the blueprint to the output file as it is compressed.
+  The output file is only created once the netlist has been imported.
+  """
+  profiling.count("bytes in", os.path.getsize(in_path))
+  store = cache.active
+  if store:
+    key = store.getFileKey("blueprint", in_path, entity_table=entity_table, format=format, level=level)
+    blueprint = store.get(key)
+    if blueprint is not None:
+      with open(out_path, 'wb') as out_file:
+        out_file.write(blueprint)
+      profiling.count("bytes out", len(blueprint))
+      return
+  with open(in_path, 'r') as in_file:
+    netlist = in_file.read()
+  layout = NetlistLayer.importNetlist(netlist)
+  del netlist
+  with open(out_path, 'w') as out_file:
+    BlueprintLayer.writeBlueprint(layout, out_file, string=not entity_table, format=format, level=level)
+  profiling.count("bytes out", os.path.getsize(out_path))
+  profiling.countLayout(layout)
+  if store:
+    storeFile(store, key, out_path)
+
+def convertFile(in_path, out_path, to_netlist, meta = True, entity_table = False, format = "lua",
+                level = 9):
+  """
+  Convert one file, writing the output file and creating its directory.
+  Returns a result dict instead of raising, so batches can report every failure.
+  """
+  result = {"input": in_path, "output": out_path, "error": None, "bytes_in": 0, "bytes_out": 0}
+  start = time.perf_counter()
+  try:
+    result["bytes_in"] = os.path.getsize(in_path)
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    if to_netlist:
+      result["bytes_out"] = convertBlueprintFile(in_path, out_path, meta=meta)
+    else:
+      convertNetlistFile(in_path, out_path, entity_table=entity_table, format=format, level=level)
+      result["bytes_out"] = os.path.getsize(out_path)
+  except Exception as e:
+    result["error"] = "{}: {}".format(type(e).__name__, e)
+  result["seconds"] = time.perf_counter() - start
+  return result
+
+def isWithin(path, directory):
+  """ Whether `path` is `directory` or below it, both given as real paths """
+  return path==directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+def findInputs(paths, suffixes, exclude = None):
+  """
+  Expand files, directories and glob patterns into (input path, path relative to its root) pairs.
+  Directories are walked recursively for files with the given suffixes.
+  Files under the `exclude` directory (the output tree) are skipped, unless a whole root is inside it.
+  """
+  exclude = os.path.realpath(exclude) if exclude else None
+  inputs = []
+  for path in paths:
+    if os.path.isdir(path):
+      skip = exclude and not isWithin(os.path.realpath(path), exclude)
+      for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(dirname for dirname in dirnames
+          if not (skip and os.path.realpath(os.path.join(dirpath, dirname))==exclude))
+        for filename in sorted(filenames):
+          if filename.lower().endswith(suffixes):
+            file_path = os.path.join(dirpath, filename)
+            inputs.append((file_path, os.path.relpath(file_path, path)))
+    elif glob.has_magic(path):
+      # mirror relative to the part of the pattern before the first wildcard
+      root = path
+      while glob.has_magic(root):
+        root = os.path.dirname(root)
+      skip = exclude and not isWithin(os.path.realpath(root or "."), exclude)
+      for file_path in sorted(glob.glob(path, recursive=True)):
+        if os.path.isfile(file_path) and not (skip and isWithin(os.path.realpath(file_path), exclude)):
+          inputs.append((file_path, os.path.relpath(file_path, root or ".")))
+    else:
+      inputs.append((path, os.path.basename(path)))
+  return inputs
+
+def getOutputPaths(outdir, rel_paths, to_netlist, entity_table = False):
+  """
+  Map relative input paths to output paths by swapping the suffix.
+  Inputs that would collide (e.g. a.txt and a.bp) keep their original suffix too.
+  """
+  if to_netlist:
+    suffix = ".netlist"
+  else:
+    suffix = ".lua" if entity_table else ".blueprint"
+  stems = [os.path.splitext(rel_path)[0] for rel_path in rel_paths]
+  counts = Counter(stems)
+  return [os.path.join(outdir, (stem if counts[stem]==1 else rel_path) + suffix)
+          for stem, rel_path in zip(stems, rel_paths)]
+
+def warmUp():
+  """ Process pool initializer: pay for imports and the signal table once per worker """
+  from string_ops import signalFromString
+  signalFromString("A")
+
+def convertBatch(paths, outdir, to_netlist, meta = True, entity_table = False, jobs = None,
+                 report = print, format = "lua", level = 9):
+  """
+  Convert all files found under `paths` into a mirrored tree under `outdir`,
+  using a pool of worker processes that stay alive for the whole batch.
+  Calls `report` with a line for each failure and a final summary.
+  Returns the list of per-file results.
+  """
+  inputs = findInputs(paths, blueprint_suffixes if to_netlist else netlist_suffixes, exclude=outdir)
+  out_paths = getOutputPaths(outdir, [rel_path for _, rel_path in inputs], to_netlist, entity_table)
+  start = time.perf_counter()
+  results = []
+  with ProcessPoolExecutor(max_workers=jobs, initializer=warmUp) as pool:
+    futures = [pool.submit(convertFile, in_path, out_path, to_netlist, meta, entity_table, format, level)
+               for (in_path, _), out_path in zip(inputs, out_paths)]
+    for future in as_completed(futures):
+      result = future.result()
+      results.append(result)
+      if result["error"]:
+        report("FAILED {input}: {error}".format(**result))
+  elapsed = time.perf_counter() - start
+
+  report(getSummary(results, elapsed))
+  return results
+
+def getInputStamps(inputs):
+  """ (modification time, size) of each input path that still exists """
+  stamps = {}
+  for in_path, _ in inputs:
+    try:
+      stat = os.stat(in_path)
+    except OSError:
+      continue
+    stamps[in_path] = (stat.st_mtime_ns, stat.st_size)
+  return stamps
+
+def watchBatch(paths, outdir, to_netlist, meta = True, entity_table = False, jobs = None,
+               report = print, format = "lua", level = 9, interval = 1.0, stop = None):
+  """
+  Convert all files found under `paths` like convertBatch, then look for new and changed
+  files every `interval` seconds and convert them again, until the `stop` event is set
+  (or forever). Calls `report` with a line for each converted file.
+  """
+  suffixes = blueprint_suffixes if to_netlist else netlist_suffixes
+  stamps = {}
+  with ProcessPoolExecutor(max_workers=jobs, initializer=warmUp) as pool:
+    while True:
+      inputs = findInputs(paths, suffixes, exclude=outdir)
+      out_paths = getOutputPaths(outdir, [rel_path for _, rel_path in inputs], to_netlist, entity_table)
+      current = getInputStamps(inputs)
+      futures = [pool.submit(convertFile, in_path, out_path, to_netlist, meta, entity_table, format, level)
+                 for (in_path, _), out_path in zip(inputs, out_paths)
+                 if in_path in current and stamps.get(in_path)!=current[in_path]]
+      stamps = current
+      for future in as_completed(futures):
+        result = future.result()
+        if result["error"]:
+          report("FAILED {input}: {error}".format(**result))
+        else:
+          report("Converted {input} -> {output} in {ms:.1f} ms".format(ms=result["seconds"]*1e3, **result))
+      if stop is None:
+        time.sleep(interval)
+      elif stop.wait(interval):
+        return
+
+def getSummary(results, elapsed):
+  failed = sum(1 for result in results if result["error"])
+  bytes_in = sum(result["bytes_in"] for result in results)
+  bytes_out = sum(result["bytes_out"] for result in results)
+  rate = lambda amount: amount/elapsed if elapsed else 0.0
+  return ("Converted {ok}/{total} files ({failed} failed) in {secs:.2f} s: "
+          "{files:.1f} files/s, {mb_in:.2f} MB read ({mbs_in:.2f} MB/s), {mb_out:.2f} MB written").format(
+    ok=len(results)-failed, total=len(results), failed=failed, secs=elapsed,
+    files=rate(len(results)), mb_in=bytes_in/1e6, mbs_in=rate(bytes_in)/1e6, mb_out=bytes_out/1e6)
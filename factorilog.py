@@ -1,4 +1,12 @@
 from enum import Enum 
+from collections import Counter, defaultdict
+from array import array
+import contextlib
+import gc
+import hashlib
+import math
+
+import profiling
 
 class Direction(Enum):
   N = 0
@@ -7,7 +15,11 @@ class Direction(Enum):
   W = 3
 
 class CircuitEnt:
-  """ Abstract entity in the circuit network. May have multiple terminals. """
+  """
+  Abstract entity in the circuit network. May have multiple terminals.
+  Optional attributes (number, position, direction, behavior) are unset until assigned.
+  """
+  __slots__ = ("name", "terminals", "number", "position", "direction", "behavior")
 
   @classmethod
   def fromName(class_, name, bp_ent=None):
@@ -32,25 +44,46 @@ class Terminal:
     out: output to circuits
     pass: do nothing (i.e. power pole)
   """
+  __slots__ = ("ent", "type", "wires", "hyperwires")
+
   def __init__(self, ent, type):
     self.ent = ent
     self.type = type
-    self.wires = set()
-    self.hyperwires = set()
+    # Lists are only created for the first wire or hyperwire; most terminals have one or two
+    self.wires = () # physical wires
+    self.hyperwires = ()
+
+  def addWire(self, wire):
+    """ Add a wire, which callers make sure isn't on the terminal already """
+    if self.wires:
+      self.wires.append(wire)
+    else:
+      self.wires = [wire]
+
+  def addHyperwire(self, hyperwire):
+    """ Add a hyperwire, which callers make sure isn't on the terminal already """
+    if self.hyperwires:
+      self.hyperwires.append(hyperwire)
+    else:
+      self.hyperwires = [hyperwire]
 
 class DeciderCombinator(CircuitEnt):
+  __slots__ = ()
   names = {"decider-combinator"}
   terminal_types = {TermType["in"]: 0, TermType["out"]: 1}
 
 class ArithmeticCombinator(CircuitEnt):
+  __slots__ = ()
   names = {"arithmetic-combinator"}
   terminal_types = {TermType["in"]: 0, TermType["out"]: 1}
 
 class ConstantCombinator(CircuitEnt):
+  __slots__ = ()
   names = {"constant-combinator"}
   terminal_types = {TermType["out"]: 0}
 
 class PowerPole(CircuitEnt):
+  __slots__ = ()
   names = {"small electric pole", "medium-electric-pole", "big-electric-pole",
           "substation"}
   terminal_types = {TermType["pass"]: 0}
@@ -58,28 +91,289 @@ class PowerPole(CircuitEnt):
 WireColor = Enum("WireColor","red green")
 class Wire:
   """ 
-  A connection between terminals.
-  In a Layout, a Wire is an edge connecting exactly two terminals and has a color.
-  In a Netlist, a Wire is a hyperedge connecting 2+ terminals. Also referred to as a "hyperwire".
+  A physical wire: an edge of one color connecting exactly two terminals in a Layout.
+  Wires are immutable and compare by terminals and color; the hash is computed once.
+  The terminals of a two-terminal wire are a tuple in a canonical order, other wires use a frozenset.
   """
-  def __init__(self, terminals={}, color=None):
-    self.terminals = frozenset(terminals)
+  __slots__ = ("terminals", "color", "hash")
+
+  def __init__(self, terminals=(), color=None):
+    terminals = frozenset(terminals)
+    if len(terminals)==2:
+      terminals = tuple(sorted(terminals, key=id))
+    self.terminals = terminals
     self.color = color
-    self.name = None
+    self.hash = hash((terminals, color))
     
   def __eq__(self, other):
-    return self.terminals==other.terminals and self.color==other.color
+    if not isinstance(other, Wire):
+      return NotImplemented
+    return self.hash==other.hash and self.terminals==other.terminals and self.color==other.color
   
   def __hash__(self):
-    return hash((self.terminals,self.color))
+    return self.hash
+
+  def other(self, terminal):
+    """ The terminal at the other end of a two-terminal wire """
+    first, second = self.terminals
+    return second if terminal is first else first
+
+class Hyperwire:
+  """
+  A net: the set of terminals connected by wires of one color, as a hyperedge in a Netlist.
+  Terminals can be added as the net is built. Hyperwires are distinct objects,
+  compared and hashed by identity.
+  """
+  __slots__ = ("terminals", "color", "name", "wires")
+
+  def __init__(self, terminals=(), color=None, name=None):
+    self.terminals = set(terminals)
+    self.color = color
+    self.name = name
+    self.wires = {} # the physical wires of the net, as an insertion-ordered set
+
+  def add(self, terminal):
+    self.terminals.add(terminal)
+
+class DisjointSet:
+  """
+  Union-find over hashable items, with path halving and union by size.
+  Items are added implicitly the first time they are seen.
+  """
+  __slots__ = ("parent", "size")
+
+  def __init__(self):
+    self.parent = {}
+    self.size = {}
+
+  def find(self, item):
+    parent = self.parent
+    if item not in parent:
+      parent[item] = item
+      self.size[item] = 1
+      return item
+    while parent[item] is not item:
+      parent[item] = parent[parent[item]]
+      item = parent[item]
+    return item
+
+  def union(self, a, b):
+    root_a, root_b = self.find(a), self.find(b)
+    if root_a is root_b:
+      return root_a
+    if self.size[root_a] < self.size[root_b]:
+      root_a, root_b = root_b, root_a
+    self.parent[root_b] = root_a
+    self.size[root_a] += self.size[root_b]
+    return root_a
+
+  def groups(self):
+    """Get a list of items for every set, keyed by set representative"""
+    groups = defaultdict(list)
+    for item in self.parent:
+      groups[self.find(item)].append(item)
+    return groups
+
+def gridCell(x, y):
+  """ Key of the grid cell (one tile) holding a position """
+  return (math.floor(x), math.floor(y))
+
+class EdgeList:
+  """
+  Array-backed edge list of the physical wire graph, for layouts too large to
+  analyze as objects. Terminals are numbered densely from 0; edge i joins terminals
+  first[i] and second[i] with a wire of color colors[i] (a WireColor value).
+  """
+  __slots__ = ("first", "second", "colors", "terminal_count")
+
+  def __init__(self, terminal_count = 0):
+    self.first = array('L')
+    self.second = array('L')
+    self.colors = array('B')
+    self.terminal_count = terminal_count
+
+  def __len__(self):
+    return len(self.first)
+
+  def add(self, first, second, color):
+    self.first.append(first)
+    self.second.append(second)
+    self.colors.append(color.value)
+    self.terminal_count = max(self.terminal_count, first+1, second+1)
+
+  @classmethod
+  def fromLayout(class_, layout):
+    """ Get (edge list, terminals by number) for the physical wires of a Layout """
+    terminals = [term for ent in layout.entities for term in ent.terminals]
+    numbers = {term: i for i, term in enumerate(terminals)}
+    edges = class_(len(terminals))
+    for term in terminals:
+      number = numbers[term]
+      for wire in term.wires:
+        other = numbers[wire.other(term)]
+        if number < other:
+          edges.add(number, other, wire.color)
+    return edges, terminals
+
+  def getComponents(self):
+    """
+    Get the terminal numbers of every connected component, like Layout.getComponents.
+    Returns {color: [[terminal number, ...], ...]}, skipping unconnected terminals.
+    """
+    components = {}
+    for color in WireColor:
+      parent = array('L', range(self.terminal_count))
+      def find(item):
+        while parent[item]!=item:
+          parent[item] = parent[parent[item]]
+          item = parent[item]
+        return item
+
+      connected = array('B', bytes(self.terminal_count))
+      for first, second, wire_color in zip(self.first, self.second, self.colors):
+        if wire_color==color.value:
+          connected[first] = connected[second] = 1
+          root_first, root_second = find(first), find(second)
+          if root_first!=root_second:
+            parent[max(root_first, root_second)] = min(root_first, root_second)
+
+      groups = defaultdict(list)
+      for term in range(self.terminal_count):
+        if connected[term]:
+          groups[find(term)].append(term)
+      components[color] = list(groups.values())
+    return components
 
 class Layout:
+  """
+  A circuit network. Entities and hyperwires should be added with addEntity and
+  addHyperwire, which keep the lookup indexes up to date.
+  """
+  __slots__ = ("entities", "hyperwires", "components", "flags", "meta",
+               "ents_by_number", "ents_by_name", "grid", "hyperwires_by_name", "last_name")
+
   def __init__(self):
     self.entities = set()
     self.hyperwires = set()
+    self.components = {} # terminal lists of each hyperwire by color, as of getHyperwires
     self.flags = {"hyperwires_named": False,
              "meta_valid": False}
     self.meta = {}
+    self.ents_by_number = {}
+    self.ents_by_name = defaultdict(set)
+    self.grid = defaultdict(set) # entities by the tile holding their position
+    self.hyperwires_by_name = {}
+    self.last_name = None # last name given by freshName
+
+  # Pickling. The object graph links entities, terminals, wires and hyperwires in long
+  # chains that would overflow the recursion limit of pickle, so a Layout is pickled as
+  # flat tables referring to terminals, wires and hyperwires by index.
+
+  def __getstate__(self):
+    entities = list(self.entities)
+    term_index = {term: i for i, term in enumerate(term for ent in entities for term in ent.terminals)}
+    hyperwires = list(self.hyperwires)
+    hyper_index = {hyperwire: i for i, hyperwire in enumerate(hyperwires)}
+    wire_index = {}
+    for ent in entities:
+      for term in ent.terminals:
+        for wire in term.wires:
+          wire_index.setdefault(wire, len(wire_index))
+    for hyperwire in hyperwires:
+      for wire in hyperwire.wires:
+        wire_index.setdefault(wire, len(wire_index))
+
+    ent_states = [(type(ent), {slot: getattr(ent, slot) for slot in ("name", "number", "position", "direction", "behavior")
+                               if hasattr(ent, slot)})
+                  for ent in entities]
+    term_states = [([wire_index[wire] for wire in term.wires], [hyper_index[hyper] for hyper in term.hyperwires])
+                   for ent in entities for term in ent.terminals]
+    wire_states = [([term_index[term] for term in wire.terminals], wire.color) for wire in wire_index]
+    hyper_states = [([term_index[term] for term in hyperwire.terminals], hyperwire.color, hyperwire.name,
+                     [wire_index[wire] for wire in hyperwire.wires]) for hyperwire in hyperwires]
+    components = {color: [[term_index[term] for term in terms] for terms in components]
+                  for color, components in self.components.items()}
+    return {"entities": ent_states, "terminals": term_states, "wires": wire_states, "hyperwires": hyper_states,
+            "components": components, "flags": self.flags, "meta": self.meta, "last_name": self.last_name}
+
+  def __setstate__(self, state):
+    self.__init__()
+    terminals = []
+    for class_, attrs in state["entities"]:
+      ent = class_(attrs["name"])
+      for slot, value in attrs.items():
+        setattr(ent, slot, value)
+      terminals.extend(ent.terminals)
+      self.addEntity(ent)
+    wires = [Wire([terminals[i] for i in terms], color) for terms, color in state["wires"]]
+    hyperwires = []
+    for terms, color, name, wire_indexes in state["hyperwires"]:
+      hyperwire = Hyperwire([terminals[i] for i in terms], color, name)
+      hyperwire.wires = dict.fromkeys(wires[i] for i in wire_indexes)
+      hyperwires.append(hyperwire)
+      self.addHyperwire(hyperwire)
+    for term, (wire_indexes, hyper_indexes) in zip(terminals, state["terminals"]):
+      if wire_indexes:
+        term.wires = [wires[i] for i in wire_indexes]
+      if hyper_indexes:
+        term.hyperwires = [hyperwires[i] for i in hyper_indexes]
+    self.components = {color: [[terminals[i] for i in terms] for terms in components]
+                       for color, components in state["components"].items()}
+    self.flags = state["flags"]
+    self.meta = state["meta"]
+    self.last_name = state["last_name"]
+
+  def addEntity(self, ent):
+    """ Add an entity, indexing it by number, name and position (if it has them) """
+    self.entities.add(ent)
+    if getattr(ent, "number", None) is not None:
+      self.ents_by_number[ent.number] = ent
+    self.ents_by_name[ent.name].add(ent)
+    if hasattr(ent, "position"):
+      self.grid[gridCell(ent.position["x"], ent.position["y"])].add(ent)
+
+  def addHyperwire(self, hyperwire):
+    """ Add a hyperwire, indexing it by name if it has one """
+    self.hyperwires.add(hyperwire)
+    if hyperwire.name is not None:
+      self.hyperwires_by_name[hyperwire.name] = hyperwire
+
+  def getEntity(self, number):
+    """ Get the entity with an entity number, or None """
+    return self.ents_by_number.get(number)
+
+  def getEntitiesByName(self, name):
+    """ Get the set of entities with a prototype name, e.g. "decider-combinator" """
+    return self.ents_by_name.get(name, set())
+
+  def getEntityAt(self, x, y):
+    """ Get the entity positioned exactly at (x, y), or None """
+    for ent in self.grid.get(gridCell(x, y), ()):
+      if ent.position["x"]==x and ent.position["y"]==y:
+        return ent
+    return None
+
+  def getEntitiesInArea(self, left, top, right, bottom):
+    """ Get the entities positioned within a rectangle, edges included """
+    found = []
+    for cell_x in range(math.floor(left), math.floor(right)+1):
+      for cell_y in range(math.floor(top), math.floor(bottom)+1):
+        for ent in self.grid.get((cell_x, cell_y), ()):
+          if left<=ent.position["x"]<=right and top<=ent.position["y"]<=bottom:
+            found.append(ent)
+    return found
+
+  def getHyperwire(self, name):
+    """ Get a hyperwire by name, or None """
+    return self.hyperwires_by_name.get(name)
+
+  def getDrivers(self, hyperwire):
+    """ Get the output terminals connected to a hyperwire """
+    return [term for term in hyperwire.terminals if term.type is TermType["out"]]
+
+  def getReaders(self, hyperwire):
+    """ Get the input terminals connected to a hyperwire """
+    return [term for term in hyperwire.terminals if term.type is TermType["in"]]
 
   def getConnectedTerminals(self, terminal, color):
     """
@@ -97,55 +391,307 @@ class Layout:
       frontier -= explored
     return explored
 
-  def assignHyperwiresToTerminals(self):
-    # assign hyperwire refs to terminals
-    for hyperwire in self.hyperwires:
+  def getComponents(self):
+    """
+    Get the terminals of every connected component of the wire graph.
+    Returns {color: [[terminal, ...], ...]}, skipping unconnected terminals.
+    Runs in near-linear time in the number of physical wires.
+    """
+    sets = {color: DisjointSet() for color in WireColor}
+    for ent in self.entities:
+      for term in ent.terminals:
+        for wire in term.wires:
+          dset = sets[wire.color]
+          for other in wire.terminals:
+            dset.union(term, other)
+
+    return {color: [terms for terms in dset.groups().values() if len(terms)>1]
+            for color, dset in sets.items()}
+
+  def assignHyperwiresToTerminals(self, hyperwires = None):
+    # assign hyperwire refs to terminals, in the order of `hyperwires` if given
+    for hyperwire in self.hyperwires if hyperwires is None else hyperwires:
       for term in hyperwire.terminals:
-        term.hyperwires.add(hyperwire)
+        term.addHyperwire(hyperwire)
 
   def getHyperwires(self):
     """Get the set of hyperwires describing all connections"""
     if self.hyperwires:
       return self.hyperwires
 
-    self.hyperwires = set()
-    explored = {color:set() for color in WireColor}
+    with profiling.stage("find hyperwires"):
+      self.hyperwires = set()
+      self.hyperwires_by_name = {}
+      self.last_name = None
+      self.flags["hyperwires_named"] = False
+      with profiling.stage("components"):
+        self.components = self.getComponents()
+      hyperwires = [Hyperwire(terms, color) for color, components in self.components.items()
+                    for terms in components]
+      for hyperwire in hyperwires:
+        self.addHyperwire(hyperwire)
 
-    for ent in self.entities:
-      for term in ent.terminals:
-        for color in WireColor:
-          if term not in explored[color]:
-            terms = self.getConnectedTerminals(term, color)
-            explored[color].update(terms)
-            if len(terms)>1:
-              self.hyperwires.add(Wire(terms, color))
+      # by color, so each terminal lists its red hyperwire before its green one
+      self.assignHyperwiresToTerminals(hyperwires)
 
-    self.assignHyperwiresToTerminals()
+      # bucket the physical wires by hyperwire, in entity order
+      with profiling.stage("bucket wires"):
+        for ent in self.getSortedEntities():
+          for term in ent.terminals:
+            for wire in term.wires:
+              getTerminalHyperwire(term, wire.color).wires[wire] = None
 
     return self.hyperwires
 
+  def getSortedEntities(self):
+    """ Get the entities ordered by number, unnumbered ones last """
+    return sorted(self.entities, key=lambda ent: (getattr(ent, "number", None) is None,
+                                                  getattr(ent, "number", None) or 0))
+
+  def getOrderedHyperwires(self, entities = None):
+    """
+    Generate the hyperwires in a deterministic order: by their first terminal in entity order,
+    then any without terminals by name. `entities` can pass in getSortedEntities().
+    """
+    seen = set()
+    for ent in self.getSortedEntities() if entities is None else entities:
+      for term in ent.terminals:
+        for hyperwire in term.hyperwires:
+          if hyperwire not in seen:
+            seen.add(hyperwire)
+            yield hyperwire
+    rest = [hyperwire for hyperwire in self.hyperwires if not hyperwire.terminals]
+    yield from sorted(rest, key=lambda hyperwire: hyperwire.name or "")
+
   def nameHyperwires(self):
     if self.flags["hyperwires_named"]:
       return
 
     # name the hyperwires
-    name = "a"
-    # get next lowercase alphabetical string
-    def next_str(name):
-      def roll_str(name):
-        if len(name)==0:
-          return "-"
-        elif name[-1]!='z':
-          return name[:-1] + chr(ord(name[-1])+1)
-        else:
-          return roll_str(name[:-1])+'a'
-      new = roll_str(name)
-      return new if new[0]!='-' else new[1:]+'a'
-
-    for hyperwire in self.hyperwires:
-      hyperwire.name = name
-      name = next_str(name)
+    for hyperwire in self.getOrderedHyperwires():
+      hyperwire.name = self.freshName()
+      self.hyperwires_by_name[hyperwire.name] = hyperwire
 
     self.flags["hyperwires_named"] = True
 
-#TODO: separate hyperwire class with mutable terminals and no hash
\ No newline at end of file
+  def freshName(self):
+    """ Get the next alphabetical hyperwire name that isn't in use """
+    name = self.last_name
+    while True:
+      name = nextName(name)
+      if name not in self.hyperwires_by_name:
+        self.last_name = name
+        return name
+
+  # Structural hashing. The entity numbers, positions and hyperwire names of a layout are left out,
+  # so layouts of the same circuit, however numbered and placed, get the same colours.
+  # canonical.getCanonicalOrder refines to a stable colouring instead, to order the circuit.
+
+  def refineColors(self, labels, rounds = 3):
+    """
+    Weisfeiler-Lehman colour refinement of the graph of entities, terminals and hyperwires.
+    `labels` maps each entity to a string describing it. Entities start coloured by label and
+    hyperwires all alike; each round recolours every hyperwire by the colours of its entities
+    and the types of the terminals joining them, then every entity by the colours of the
+    hyperwires on each of its terminals. Wire colours are ignored, as in bare netlists.
+    Stops after `rounds` rounds, or once no colour class splits.
+    Returns (entity colours, hyperwire colours, digest): colours are ranks of the sorted
+    signatures of each round, and the digest is a blake2b hash of all the signatures and their
+    counts, so all three agree between layouts of the same circuit.
+    """
+    self.getHyperwires()
+    entities = list(self.entities)
+    hyperwires = [hyperwire for hyperwire in self.hyperwires if hyperwire.terminals]
+    digest = hashlib.blake2b(digest_size=16)
+
+    def recolor(items, signatures):
+      counts = Counter(signatures)
+      ordered = sorted(counts)
+      digest.update(repr([(signature, counts[signature]) for signature in ordered]).encode())
+      ranks = {signature: rank for rank, signature in enumerate(ordered)}
+      return {item: ranks[signature] for item, signature in zip(items, signatures)}, len(ranks)
+
+    ent_colors, ent_classes = recolor(entities, [labels[ent] for ent in entities])
+    hyper_colors, hyper_classes = {hyperwire: 0 for hyperwire in hyperwires}, 1
+    for _ in range(rounds):
+      hyper_colors, new_hyper_classes = recolor(hyperwires, [
+        (hyper_colors[hyperwire], tuple(sorted((ent_colors[term.ent], term.type.value) for term in hyperwire.terminals)))
+        for hyperwire in hyperwires])
+      ent_colors, new_ent_classes = recolor(entities, [
+        (ent_colors[ent], tuple(tuple(sorted(hyper_colors[hyperwire] for hyperwire in term.hyperwires))
+                                for term in ent.terminals))
+        for ent in entities])
+      if (new_ent_classes, new_hyper_classes)==(ent_classes, hyper_classes):
+        break
+      ent_classes, hyper_classes = new_ent_classes, new_hyper_classes
+    return ent_colors, hyper_colors, digest.hexdigest()
+
+  # Mutation. Once hyperwires have been computed, edits keep them, their names and the
+  # terminal back-references consistent, in time proportional to the affected nets.
+  # Hyperwires are assumed to follow the physical wires, as in layouts from blueprints
+  # or netlists with metadata.
+
+  def removeEntity(self, ent):
+    """ Remove an entity, disconnecting all its wires """
+    for term in ent.terminals:
+      for wire in list(term.wires):
+        self.disconnect(wire)
+      for hyperwire in list(term.hyperwires): # nets without physical wires
+        self.removeFromHyperwire(hyperwire, term)
+
+    self.entities.discard(ent)
+    number = getattr(ent, "number", None)
+    if self.ents_by_number.get(number) is ent:
+      del self.ents_by_number[number]
+    self.ents_by_name[ent.name].discard(ent)
+    if hasattr(ent, "position"):
+      self.grid[gridCell(ent.position["x"], ent.position["y"])].discard(ent)
+
+  def moveEntity(self, ent, position):
+    """ Set the position of an entity in the layout, e.g. {"x": 0.5, "y": 1} """
+    if hasattr(ent, "position"):
+      self.grid[gridCell(ent.position["x"], ent.position["y"])].discard(ent)
+    ent.position = position
+    self.grid[gridCell(position["x"], position["y"])].add(ent)
+
+  def connect(self, term_a, term_b, color):
+    """ Connect two terminals with a wire, merging their hyperwires. Returns the wire. """
+    if term_a is term_b:
+      raise RuntimeError("Cannot connect a terminal to itself")
+    wire = Wire((term_a, term_b), color)
+    if wire in min(term_a.wires, term_b.wires, key=len):
+      return wire # already connected
+    term_a.addWire(wire)
+    term_b.addWire(wire)
+    if not self.hyperwires:
+      return wire # computed on demand by getHyperwires
+
+    hyper_a = getTerminalHyperwire(term_a, color)
+    hyper_b = getTerminalHyperwire(term_b, color)
+    if hyper_a is None and hyper_b is None:
+      hyper_a = Hyperwire((), color)
+      if self.flags["hyperwires_named"]:
+        hyper_a.name = self.freshName()
+      self.addHyperwire(hyper_a)
+      self.addToHyperwire(hyper_a, term_a)
+      self.addToHyperwire(hyper_a, term_b)
+    elif hyper_a is None:
+      hyper_a = hyper_b
+      self.addToHyperwire(hyper_a, term_a)
+    elif hyper_b is None:
+      self.addToHyperwire(hyper_a, term_b)
+    elif hyper_a is not hyper_b:
+      # move the smaller net into the larger one, which keeps its name
+      if len(hyper_a.terminals) < len(hyper_b.terminals):
+        hyper_a, hyper_b = hyper_b, hyper_a
+      for term in hyper_b.terminals:
+        term.hyperwires.remove(hyper_b)
+        self.addToHyperwire(hyper_a, term)
+      hyper_a.wires.update(hyper_b.wires)
+      self.dropHyperwire(hyper_b)
+    hyper_a.wires[wire] = None
+    return wire
+
+  def disconnect(self, wire):
+    """ Remove a wire, splitting its hyperwire if the two ends are no longer connected """
+    term_a, term_b = wire.terminals
+    term_a.wires.remove(wire)
+    term_b.wires.remove(wire)
+    hyperwire = getTerminalHyperwire(term_a, wire.color)
+    if hyperwire is None:
+      return
+    hyperwire.wires.pop(wire, None)
+
+    part = self.searchSplit(term_a, term_b, wire.color)
+    if part is None:
+      return
+    if len(part)==1:
+      self.removeFromHyperwire(hyperwire, part[0])
+    else:
+      new_hyperwire = Hyperwire((), wire.color)
+      if self.flags["hyperwires_named"]:
+        new_hyperwire.name = self.freshName()
+      self.addHyperwire(new_hyperwire)
+      for term in part:
+        hyperwire.terminals.discard(term)
+        term.hyperwires.remove(hyperwire)
+        self.addToHyperwire(new_hyperwire, term)
+        for part_wire in term.wires:
+          if part_wire in hyperwire.wires:
+            del hyperwire.wires[part_wire]
+            new_hyperwire.wires[part_wire] = None
+    if len(hyperwire.terminals)==1:
+      self.removeFromHyperwire(hyperwire, next(iter(hyperwire.terminals)))
+
+  def searchSplit(self, term_a, term_b, color):
+    """
+    Search the `color` wires outward from two terminals, a step from each side in turn.
+    Returns the terminals on the side that was exhausted first, in the order they were
+    found, or None if the searches meet.
+    """
+    sides = (({term_a: None}, [term_a]), ({term_b: None}, [term_b]))
+    while True:
+      for side, (seen, frontier) in enumerate(sides):
+        if not frontier:
+          return list(seen)
+        term = frontier.pop()
+        other_seen = sides[1-side][0]
+        for wire in term.wires:
+          if wire.color==color:
+            other = wire.other(term)
+            if other in other_seen:
+              return None
+            if other not in seen:
+              seen[other] = None
+              frontier.append(other)
+
+  def addToHyperwire(self, hyperwire, term):
+    hyperwire.add(term)
+    term.addHyperwire(hyperwire)
+
+  def removeFromHyperwire(self, hyperwire, term):
+    """ Take a terminal off a hyperwire, dropping the hyperwire once it has no terminals """
+    hyperwire.terminals.discard(term)
+    term.hyperwires.remove(hyperwire)
+    if not hyperwire.terminals:
+      self.dropHyperwire(hyperwire)
+
+  def dropHyperwire(self, hyperwire):
+    self.hyperwires.discard(hyperwire)
+    if self.hyperwires_by_name.get(hyperwire.name) is hyperwire:
+      del self.hyperwires_by_name[hyperwire.name]
+
+def getTerminalHyperwire(term, color):
+  """ Get the hyperwire of a color on a terminal, or None """
+  for hyperwire in term.hyperwires:
+    if hyperwire.color==color:
+      return hyperwire
+  return None
+
+def nextName(name):
+  """ Get the next lowercase alphabetical string after `name`: a, b, ..., z, aa, ab, ... """
+  if name is None:
+    return "a"
+  def roll_str(name):
+    if len(name)==0:
+      return "-"
+    elif name[-1]!='z':
+      return name[:-1] + chr(ord(name[-1])+1)
+    else:
+      return roll_str(name[:-1])+'a'
+  new = roll_str(name)
+  return new if new[0]!='-' else new[1:]+'a'
+
+@contextlib.contextmanager
+def pausedCollector():
+  """
+  Pause the garbage collector while unpickling Layouts: they are many small objects,
+  and the collector would scan them over and over as they are created.
+  """
+  enabled = gc.isenabled()
+  gc.disable()
+  try:
+    yield
+  finally:
+    if enabled:
+      gc.enable()
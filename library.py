@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# Blueprint library index in SQLite
+#
+# Indexing imports each blueprint file once and stores its metadata: name and icons, entity
+# counts by CircuitEnt subclass, the signals its entities' behaviors refer to, wire and
+# hyperwire counts, a canonical netlist and a structural hash, which is the same for blueprints
+# of the same circuit however numbered and placed. Queries then only read the database.
+# Re-indexing skips files whose modification time and size are unchanged, and files whose
+# hash is unchanged, unless the converter changed since they were indexed.
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import cache
+import conversion
+from factorilog import CircuitEnt
+import netlist_layer as NetlistLayer
+from string_ops import signalFromString
+
+default_path = "library.sqlite"
+schema_version = 2
+
+schema = """
+CREATE TABLE IF NOT EXISTS blueprints (
+  id INTEGER PRIMARY KEY,
+  path TEXT UNIQUE NOT NULL,
+  mtime_ns INTEGER NOT NULL,
+  size INTEGER NOT NULL,
+  hash TEXT NOT NULL,
+  converter TEXT NOT NULL,
+  name TEXT,
+  icons TEXT,
+  entities INTEGER,
+  wires INTEGER,
+  hyperwires INTEGER,
+  netlist TEXT,
+  structure TEXT,
+  error TEXT
+);
+CREATE INDEX IF NOT EXISTS blueprints_by_structure ON blueprints(structure);
+CREATE TABLE IF NOT EXISTS entity_counts (
+  blueprint_id INTEGER NOT NULL REFERENCES blueprints(id) ON DELETE CASCADE,
+  class TEXT NOT NULL,
+  count INTEGER NOT NULL,
+  PRIMARY KEY (blueprint_id, class)
+);
+CREATE INDEX IF NOT EXISTS entity_counts_by_class ON entity_counts(class, count);
+CREATE TABLE IF NOT EXISTS signals (
+  blueprint_id INTEGER NOT NULL REFERENCES blueprints(id) ON DELETE CASCADE,
+  type TEXT NOT NULL,
+  name TEXT NOT NULL,
+  PRIMARY KEY (blueprint_id, type, name)
+);
+CREATE INDEX IF NOT EXISTS signals_by_name ON signals(name);
+"""
+
+def hashFile(path):
+  digest = hashlib.blake2b(digest_size=20)
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+def getBehaviorSignals(behavior):
+  """ The (type, name) of every signal table in a behavior """
+  signals = set()
+  stack = [behavior]
+  while stack:
+    value = stack.pop()
+    if isinstance(value, dict):
+      if isinstance(value.get("name"), str) and isinstance(value.get("type"), str):
+        signals.add((value["type"], value["name"]))
+      else:
+        stack.extend(value.values())
+    elif isinstance(value, (list, tuple)):
+      stack.extend(value)
+  return signals
+
+def getLayoutRecord(layout):
+  """ Index record of a Layout """
+  signals = set()
+  for ent in layout.entities:
+    if hasattr(ent, "behavior"):
+      signals |= getBehaviorSignals(ent.behavior)
+  netlist = NetlistLayer.exportNetlist(layout, canonical=True)
+  return {
+    "name": layout.meta.get("name"),
+    "icons": [icon["name"] for icon in layout.meta.get("icons", ())],
+    "entity_counts": Counter(type(ent).__name__ for ent in layout.entities),
+    "signals": sorted(signals),
+    "entities": len(layout.entities),
+    "wires": sum(len(term.wires) for ent in layout.entities for term in ent.terminals)//2,
+    "hyperwires": len(layout.hyperwires),
+    "netlist": netlist,
+    "structure": NetlistLayer.getStructuralHash(layout),
+    "error": None,
+  }
+
+def getFileRecord(path):
+  """ Index record of a blueprint file, holding the import error if it fails """
+  with open(path, 'rb') as f:
+    data = f.read()
+  record = {"hash": hashlib.blake2b(data, digest_size=20).hexdigest()}
+  try:
+    layout = conversion.importBlueprintText(data.decode("utf-8"))
+    record.update(getLayoutRecord(layout))
+  except Exception as e:
+    record.update(name=None, icons=[], entity_counts={}, signals=[], entities=None, wires=None,
+                  hyperwires=None, netlist=None, structure=None, error="{}: {}".format(type(e).__name__, e))
+  return record
+
+def getEntityClass(entity):
+  """ CircuitEnt subclass name for a subclass name or an entity prototype name """
+  for subclass in CircuitEnt.__subclasses__():
+    if entity==subclass.__name__ or entity in subclass.names:
+      return subclass.__name__
+  raise RuntimeError("Entity {} not supported".format(entity))
+
+def getSignalName(signal):
+  """ Full signal name for a netlist signal string, like "A" for "signal-A" """
+  try:
+    return signalFromString(signal)["name"]
+  except KeyError:
+    return signal
+
+class Library:
+  """ A blueprint index in an SQLite database, usable as a context manager """
+  def __init__(self, path = default_path):
+    self.db = sqlite3.connect(path)
+    self.db.row_factory = sqlite3.Row
+    self.db.execute("PRAGMA foreign_keys = ON")
+    if self.db.execute("PRAGMA user_version").fetchone()[0]!=schema_version:
+      with self.db:
+        for table in ("signals", "entity_counts", "blueprints"):
+          self.db.execute("DROP TABLE IF EXISTS " + table)
+        self.db.execute("PRAGMA user_version = {}".format(schema_version))
+    self.db.executescript(schema)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+    return False
+
+  def close(self):
+    self.db.close()
+
+  def index(self, paths, jobs = None, prune = True, report = None):
+    """
+    Index the blueprint files found under `paths` (files, directories or glob patterns),
+    importing only new and changed files in a pool of `jobs` worker processes.
+    With prune=True, files that no longer exist are dropped from the index.
+    Calls `report` with a line for each failure. Returns counts of indexed, unchanged, failed and removed files.
+    """
+    converter = cache.getConverterVersion()
+    known = {row["path"]: row for row in self.db.execute(
+      "SELECT id, path, mtime_ns, size, hash, converter FROM blueprints")}
+    counts = Counter(indexed=0, unchanged=0, failed=0, removed=0)
+
+    changed = []
+    for in_path, _ in conversion.findInputs(paths, conversion.blueprint_suffixes):
+      path = os.path.abspath(in_path)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      row = known.get(path)
+      if row and row["converter"]==converter:
+        if (row["mtime_ns"], row["size"])==(stat.st_mtime_ns, stat.st_size):
+          counts["unchanged"] += 1
+          continue
+        if row["hash"]==hashFile(path):
+          with self.db:
+            self.db.execute("UPDATE blueprints SET mtime_ns = ?, size = ? WHERE id = ?",
+              (stat.st_mtime_ns, stat.st_size, row["id"]))
+          counts["unchanged"] += 1
+          continue
+      changed.append((path, stat))
+
+    if changed:
+      with ProcessPoolExecutor(max_workers=jobs, initializer=conversion.warmUp) as pool:
+        records = pool.map(getFileRecord, [path for path, _ in changed], chunksize=16)
+        with self.db:
+          for (path, stat), record in zip(changed, records):
+            self.store(path, stat, converter, record)
+            if record["error"]:
+              counts["failed"] += 1
+              if report:
+                report("FAILED {}: {}".format(path, record["error"]))
+            else:
+              counts["indexed"] += 1
+
+    if prune:
+      gone = [(row["id"],) for path, row in known.items() if not os.path.exists(path)]
+      with self.db:
+        self.db.executemany("DELETE FROM blueprints WHERE id = ?", gone)
+      counts["removed"] = len(gone)
+    return counts
+
+  def store(self, path, stat, converter, record):
+    """ Replace the index entry of a file with a record from getFileRecord """
+    self.db.execute("DELETE FROM blueprints WHERE path = ?", (path,))
+    cursor = self.db.execute(
+      "INSERT INTO blueprints (path, mtime_ns, size, hash, converter, name, icons, entities, wires, hyperwires,"
+      " netlist, structure, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+      (path, stat.st_mtime_ns, stat.st_size, record["hash"], converter, record["name"],
+       json.dumps(record["icons"]), record["entities"], record["wires"], record["hyperwires"],
+       record["netlist"], record["structure"], record["error"]))
+    blueprint_id = cursor.lastrowid
+    self.db.executemany("INSERT INTO entity_counts VALUES (?, ?, ?)",
+      [(blueprint_id, class_name, count) for class_name, count in record["entity_counts"].items()])
+    self.db.executemany("INSERT INTO signals VALUES (?, ?, ?)",
+      [(blueprint_id, type, name) for type, name in record["signals"]])
+
+  def findBySignal(self, signal):
+    """ Paths of the blueprints with an entity behavior referring to a signal, by full or netlist name """
+    return [row["path"] for row in self.db.execute(
+      "SELECT DISTINCT path FROM blueprints JOIN signals ON signals.blueprint_id = blueprints.id"
+      " WHERE signals.name = ? ORDER BY path", (getSignalName(signal),))]
+
+  def findByEntityCount(self, entity, min_count = 1):
+    """ (path, count) of the blueprints with at least `min_count` entities of a class or prototype name """
+    return [(row["path"], row["count"]) for row in self.db.execute(
+      "SELECT path, count FROM blueprints JOIN entity_counts ON entity_counts.blueprint_id = blueprints.id"
+      " WHERE class = ? AND count >= ? ORDER BY count DESC, path", (getEntityClass(entity), min_count))]
+
+  def findByName(self, pattern):
+    """ Paths of the blueprints whose name matches an SQL LIKE pattern """
+    return [row["path"] for row in self.db.execute(
+      "SELECT path FROM blueprints WHERE name LIKE ? ORDER BY path", (pattern,))]
+
+  def findDuplicates(self):
+    """
+    Paths of the blueprints of each circuit found more than once, as lists of paths.
+    Blueprints are grouped by structural hash, then by canonical netlist, so circuits
+    that only collide on the hash aren't reported.
+    """
+    groups = {}
+    for row in self.db.execute(
+        "SELECT path, structure, netlist FROM blueprints WHERE structure IN"
+        " (SELECT structure FROM blueprints GROUP BY structure HAVING COUNT(*) > 1) ORDER BY path"):
+      groups.setdefault((row["structure"], row["netlist"]), []).append(row["path"])
+    return sorted(paths for paths in groups.values() if len(paths)>1)
+
+  def findByStructure(self, path):
+    """ Paths of the other indexed blueprints with the same circuit as an indexed blueprint file """
+    entry = self.getBlueprint(path)
+    if entry is None or entry["structure"] is None:
+      return []
+    return [row["path"] for row in self.db.execute(
+      "SELECT path FROM blueprints WHERE structure = ? AND netlist = ? AND id != ? ORDER BY path",
+      (entry["structure"], entry["netlist"], entry["id"]))]
+
+  def getBlueprint(self, path):
+    """ Index entry of a blueprint file as a dict, or None """
+    row = self.db.execute("SELECT * FROM blueprints WHERE path = ?", (os.path.abspath(path),)).fetchone()
+    if row is None:
+      return None
+    entry = dict(row)
+    entry["icons"] = json.loads(entry["icons"])
+    entry["entity_counts"] = {row["class"]: row["count"] for row in self.db.execute(
+      "SELECT class, count FROM entity_counts WHERE blueprint_id = ?", (entry["id"],))}
+    entry["signals"] = [row["name"] for row in self.db.execute(
+      "SELECT name FROM signals WHERE blueprint_id = ? ORDER BY name", (entry["id"],))]
+    return entry
+
+if __name__=="__main__":
+  parser = argparse.ArgumentParser(description="Index blueprint files in an SQLite database and query it")
+  parser.add_argument('--db', default=default_path, help="Library database (default: %(default)s)")
+  commands = parser.add_subparsers(dest="command", required=True)
+  index = commands.add_parser("index", help="Index new and changed blueprint files")
+  index.add_argument('paths', nargs='+', metavar="PATH", help="Blueprint files, directories or glob patterns")
+  index.add_argument('-j','--jobs', type=int, help="Number of worker processes (default: CPU count)")
+  index.add_argument('--keep-missing', action="store_true", help="Don't drop files that no longer exist")
+  signal = commands.add_parser("signal", help="List blueprints whose entities use a signal")
+  signal.add_argument('signal', help="Signal name, in full or netlist form (e.g. A, iron-plate)")
+  count = commands.add_parser("count", help="List blueprints with at least some number of an entity")
+  count.add_argument('entity', help="Entity name or class, e.g. decider-combinator or DeciderCombinator")
+  count.add_argument('--min', type=int, default=1, help="Minimum number of entities (default: 1)")
+  name = commands.add_parser("name", help="List blueprints with a name matching an SQL LIKE pattern")
+  name.add_argument('pattern', help="Pattern, with %% for any text")
+  show = commands.add_parser("show", help="Show the index entry of a blueprint file")
+  show.add_argument('path', help="Blueprint file")
+  duplicates = commands.add_parser("duplicates", help="List blueprints of the same circuit, in groups")
+  same = commands.add_parser("same", help="List blueprints of the same circuit as a blueprint file")
+  same.add_argument('path', help="Indexed blueprint file")
+  args = parser.parse_args()
+
+  with Library(args.db) as library:
+    if args.command=="index":
+      counts = library.index(args.paths, jobs=args.jobs, prune=not args.keep_missing, report=print)
+      print("Indexed {indexed} files ({failed} failed), {unchanged} unchanged, {removed} removed".format(**counts))
+    elif args.command=="signal":
+      print("\n".join(library.findBySignal(args.signal)))
+    elif args.command=="count":
+      for path, number in library.findByEntityCount(args.entity, args.min):
+        print("{:>8} {}".format(number, path))
+    elif args.command=="name":
+      print("\n".join(library.findByName(args.pattern)))
+    elif args.command=="show":
+      entry = library.getBlueprint(args.path)
+      if entry is None:
+        print("{} is not indexed".format(args.path))
+        sys.exit(1)
+      for key in ("path", "hash", "structure", "name", "icons", "entities", "wires", "hyperwires", "entity_counts",
+                  "signals", "error"):
+        print("{:<14} {}".format(key, entry[key]))
+      if entry["netlist"] is not None:
+        print(entry["netlist"])
+    elif args.command=="duplicates":
+      print("\n\n".join("\n".join(paths) for paths in library.findDuplicates()))
+    elif args.command=="same":
+      print("\n".join(library.findByStructure(args.path)))
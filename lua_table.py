@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# Lua table codec for the serpent dialect of blueprint strings and entity tables
+#
+# Tables with only positional items decode to lists and all other tables to dicts,
+# like slpp. The decoder can be fed text in chunks, and can hand back selected values
+# as soon as they are complete instead of storing them in their parent table.
+# The encoder writes compact single-line Lua to a stream in buffered pieces.
+
+import functools
+import io
+import math
+import re
+
+class LuaDecodeError(ValueError):
+  pass
+
+# Token kinds
+SKIP, LONG_STRING, PUNCT, DQ_STRING, SQ_STRING, NUMBER, KEY, NAME = range(1, 9)
+
+# Whitespace, then alternatives in order of how common they are in blueprints
+token_re = re.compile(r'''\s*(?:
+  ([{}\]=,;]|\[(?!=*\[))
+  |([A-Za-z_][A-Za-z0-9_]*)[ \t]*=(?!=)                 # name = ...
+  |"((?:[^"\\\n]|\\.)*)"
+  |(-?(?:0[xX][0-9a-fA-F]+|(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?))
+  |([A-Za-z_][A-Za-z0-9_]*)
+  |(--\[(?P<c>=*)\[.*?\](?P=c)\]|--[^\n]*)       # comments
+  |\[(?P<s>=*)\[\n?(.*?)\](?P=s)\]                  # long string
+  |'((?:[^'\\\n]|\\.)*)'
+)''', re.S|re.X)
+# Token kinds by the number of the capture group that matched
+token_groups = {1: PUNCT, 2: KEY, 3: DQ_STRING, 4: NUMBER, 5: NAME, 6: SKIP, 9: LONG_STRING, 10: SQ_STRING}
+long_open_re = re.compile(r'--\[=*\[')
+long_prefix_re = re.compile(r'\[=*')
+number_tail_re = re.compile(r'[eE][+-]?|[xX]')
+
+escapes = {"n": "\n", "t": "\t", "r": "\r", "a": "\a", "b": "\b", "f": "\f", "v": "\v",
+           "\\": "\\", '"': '"', "'": "'", "\n": "\n"}
+escape_re = re.compile(r'\\(?:([0-9]{1,3})|x([0-9a-fA-F]{2})|(.))', re.S)
+
+def unescape(text):
+  if "\\" not in text:
+    return text
+  def replace(match):
+    decimal, hexadecimal, char = match.groups()
+    if decimal:
+      return chr(int(decimal))
+    if hexadecimal:
+      return chr(int(hexadecimal, 16))
+    return escapes.get(char, char)
+  return escape_re.sub(replace, text)
+
+def parseNumber(text):
+  body = text.lstrip("-")
+  if body[:2] in ("0x", "0X"):
+    value = int(body, 16)
+    return -value if text[0]=="-" else value
+  if "." in body or "e" in body or "E" in body:
+    return float(text)
+  return int(text)
+
+constants = {"true": True, "false": False, "nil": None}
+
+class Table:
+  """ A table being decoded """
+  __slots__ = ("path", "items", "fields", "count", "key", "state")
+
+  def __init__(self, path):
+    self.path = path
+    self.items = [] # positional values
+    self.fields = {} # keyed values
+    self.count = 0 # positional values seen, including streamed ones
+    self.key = None
+    self.state = "field"
+
+  def value(self):
+    if not self.fields:
+      return self.items if self.count else {}
+    for i, item in enumerate(self.items, 1):
+      self.fields.setdefault(i, item)
+    return self.fields
+
+class LuaTableDecoder:
+  """
+  Decode the first table constructor in a text fed in chunks, ignoring any code around it.
+  `stream(path)` selects values to hand back from feed() and close() as (path, value)
+  pairs, instead of storing them in their table; path is the tuple of keys from the
+  outer table, with 1-based indexes for positional values.
+  The decoded table is in `result` after close().
+  """
+  def __init__(self, stream = None):
+    self.stream = stream
+    self.buffer = ""
+    self.stack = []
+    self.started = False
+    self.done = False
+    self.result = None
+    self.name = None # a bare name that may turn out to be a key
+
+  def feed(self, text, final = False):
+    """ Decode as much as possible of the text so far, returning the completed streamed values """
+    if self.done:
+      return []
+    buffer = self.buffer + text if self.buffer else text
+    streamed = []
+    pos = 0
+    end = len(buffer)
+    token = self.token
+    scanner = token_re.scanner(buffer)
+    match_next = scanner.match
+    while True:
+      match = match_next()
+      if match is None:
+        if final and buffer[pos:].strip():
+          raise LuaDecodeError("Unexpected {!r}".format(buffer[pos:pos+10]))
+        break # maybe an unterminated string
+      index = match.lastindex
+      if not final:
+        # wait for the rest of a token that may continue in the next chunk
+        if match.end()==end:
+          break
+        if index==6 and match.group("c") is None and long_open_re.match(match.group(6)):
+          break # an unterminated long comment matched as a line comment
+        if index==1 and match.group(1)=="[" and long_prefix_re.fullmatch(buffer, match.start(1)):
+          break # may be the start of a long string
+        if index==4 and number_tail_re.fullmatch(buffer, match.end()):
+          break # may be a number with an exponent or in hex
+      pos = match.end()
+      if index!=6:
+        token(token_groups[index], match.group(index), streamed)
+        if self.done:
+          break
+    self.buffer = "" if self.done else buffer[pos:]
+    return streamed
+
+  def close(self):
+    """ Finish decoding, returning the last streamed values """
+    streamed = self.feed("", final=True)
+    if not self.done:
+      if not self.started:
+        raise LuaDecodeError("No table found")
+      raise LuaDecodeError("Unterminated table")
+    return streamed
+
+  def token(self, kind, text, streamed):
+    if not self.started:
+      if kind==PUNCT and text=="{":
+        self.started = True
+        self.stack.append(Table(()))
+      return
+
+    table = self.stack[-1]
+    if self.name is not None:
+      # a bare name is a key if '=' follows, and a value otherwise
+      name, self.name = self.name, None
+      if kind==PUNCT and text=="=":
+        table.key = name
+        table.state = "value"
+        return
+      if name not in constants:
+        raise LuaDecodeError("Unexpected name {!r}".format(name))
+      self.complete(constants[name], streamed)
+
+    state = table.state
+    if kind==KEY and state=="field":
+      table.key = text
+      table.state = "value"
+      return
+    if state=="field" or state=="value":
+      if kind==PUNCT:
+        if text=="{":
+          self.stack.append(Table(table.path + (self.nextKey(table),)))
+          return
+        if text=="}" and state=="field":
+          self.closeTable(streamed)
+          return
+        if text=="[" and state=="field":
+          table.state = "key"
+          return
+        raise LuaDecodeError("Unexpected {!r}".format(text))
+      if kind==NAME:
+        if state=="field":
+          self.name = text
+        elif text in constants:
+          self.complete(constants[text], streamed)
+        else:
+          raise LuaDecodeError("Unexpected name {!r}".format(text))
+        return
+      if kind==KEY:
+        raise LuaDecodeError("Unexpected key {!r}".format(text))
+      self.complete(self.scalar(kind, text), streamed)
+    elif state=="key":
+      if kind==PUNCT or kind==NAME or kind==KEY:
+        raise LuaDecodeError("Unsupported table key {!r}".format(text))
+      table.key = self.scalar(kind, text)
+      table.state = "key_end"
+    elif state=="key_end":
+      if text!="]":
+        raise LuaDecodeError("Expected ']', got {!r}".format(text))
+      table.state = "key_assign"
+    elif state=="key_assign":
+      if text!="=":
+        raise LuaDecodeError("Expected '=', got {!r}".format(text))
+      table.state = "value"
+    elif state=="separator":
+      if text=="," or text==";":
+        table.state = "field"
+      elif text=="}":
+        self.closeTable(streamed)
+      else:
+        raise LuaDecodeError("Expected ',' or '}}', got {!r}".format(text))
+
+  def scalar(self, kind, text):
+    if kind==NUMBER:
+      return parseNumber(text)
+    if kind==LONG_STRING:
+      return text
+    return unescape(text)
+
+  def nextKey(self, table):
+    """ Key of the value starting in `table` """
+    if table.state=="value":
+      return table.key
+    return table.count + 1
+
+  def complete(self, value, streamed):
+    """ Store a completed value in the innermost table, or stream it """
+    table = self.stack[-1]
+    positional = table.state!="value"
+    if positional:
+      table.count += 1
+      key = table.count
+    else:
+      key = table.key
+      table.key = None
+    table.state = "separator"
+    if value is None:
+      return # nil fields don't exist in Lua
+    if self.stream and self.stream(table.path + (key,)):
+      streamed.append((table.path + (key,), value))
+    elif positional:
+      table.items.append(value)
+    else:
+      table.fields[key] = value
+
+  def closeTable(self, streamed):
+    table = self.stack.pop()
+    value = table.value()
+    if not self.stack:
+      self.result = value
+      self.done = True
+      return
+    self.complete(value, streamed)
+
+def decode(text):
+  """ Decode the first table constructor in a string """
+  decoder = LuaTableDecoder()
+  decoder.feed(text)
+  decoder.close()
+  return decoder.result
+
+lua_keywords = {"and", "break", "do", "else", "elseif", "end", "false", "for", "function", "goto",
+                "if", "in", "local", "nil", "not", "or", "repeat", "return", "then", "true",
+                "until", "while"}
+identifier_re = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+string_escapes = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r", "\0": "\\0"})
+
+def encodeString(text):
+  return '"' + text.translate(string_escapes) + '"'
+
+def encodeScalar(value):
+  if value is True:
+    return "true"
+  if value is False:
+    return "false"
+  if value is None:
+    return "nil"
+  if isinstance(value, str):
+    return encodeString(value)
+  if isinstance(value, int):
+    return str(value)
+  if isinstance(value, float):
+    if math.isfinite(value):
+      return repr(value)
+    if math.isnan(value):
+      return "0/0"
+    return "math.huge" if value>0 else "-math.huge"
+  raise TypeError("Cannot encode {!r} as Lua".format(value))
+
+@functools.lru_cache(maxsize=1024, typed=True) # blueprints repeat the same few keys
+def encodeKey(key):
+  if isinstance(key, str) and key not in lua_keywords and identifier_re.fullmatch(key):
+    return key + "="
+  return "[" + encodeScalar(key) + "]="
+
+def tableFields(value):
+  """ (prefix, value) for each field of a table, the prefix holding the separator and key """
+  if isinstance(value, dict):
+    first = True
+    for key, item in value.items():
+      yield ("" if first else ",") + encodeKey(key), item
+      first = False
+  else:
+    first = True
+    for item in value:
+      yield "" if first else ",", item
+      first = False
+
+def dump(value, stream, buffer_size = 1 << 12):
+  """
+  Write `value` as a Lua table constructor to a text stream, without recursion.
+  Pieces are joined and written every `buffer_size` pieces.
+  """
+  parts = []
+  append = parts.append
+  stack = [iter((("", value),))]
+  while stack:
+    for prefix, item in stack[-1]:
+      if isinstance(item, (dict, list, tuple)):
+        append(prefix + "{")
+        stack.append(tableFields(item))
+        break
+      append(prefix + encodeScalar(item))
+    else:
+      stack.pop()
+      if stack:
+        append("}")
+    if len(parts)>=buffer_size:
+      stream.write("".join(parts))
+      parts.clear()
+  stream.write("".join(parts))
+
+def encode(value):
+  """ Encode `value` as a Lua table constructor string """
+  buffer = io.StringIO()
+  dump(value, buffer)
+  return buffer.getvalue()
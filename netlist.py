@@ -1,69 +1,140 @@
 #!/usr/bin/env python
 import argparse
 import sys
-import blueprint_layer as BlueprintLayer
-import netlist_layer as NetlistLayer
+import cache
+import conversion
+import profiling
+import server
 
 def convert(args):
-  output = None
   if args.blueprint and args.netlist:
     parser.print_help()
 
   elif args.blueprint:
-    with open(args.blueprint, 'r') as bp_file:
-      bp = bp_file.read()
-
-    try:
-      layout = BlueprintLayer.importBlueprint(bp, string=True)
-    except OSError:
-      layout = BlueprintLayer.importBlueprint(bp, string=False)
-
-    output = NetlistLayer.exportNetlist(layout, meta=not args.no_meta)
-    message = "Wrote {name} to file {filename}".format(
+    conversion.convertBlueprintFile(args.blueprint, args.outfile, meta=not args.no_meta)
+    print("Wrote {name} to file {filename}".format(
       name = "netlist" + (" with metadata" if not args.no_meta else ""),
-      filename = args.outfile)
+      filename = args.outfile))
 
   elif args.netlist:
-    with open(args.netlist, 'r') as net_file:
-      netlist = net_file.read()
-
-    layout = NetlistLayer.importNetlist(netlist)
-    output = BlueprintLayer.exportBlueprint(layout, string=not args.entity_table)
-    message = "Wrote {name} to file {filename}".format(
+    conversion.convertNetlistFile(args.netlist, args.outfile, entity_table=args.entity_table,
+      format=args.format, level=args.level)
+    print("Wrote {name} to file {filename}".format(
       name = "blueprint string" if not args.entity_table else "entity table",
-      filename = args.outfile)
+      filename = args.outfile))
 
   else:
     parser.print_help()
 
-  if output:
-    with open(args.outfile, 'w') as out_file:
-      out_file.write(output)
-    print(message)
+def convertBatch(args):
+  if args.batch_blueprints and args.batch_netlists:
+    parser.error("choose one of --batch-blueprints and --batch-netlists")
+  if not args.outdir:
+    parser.error("batch conversion requires --outdir")
+
+  to_netlist = bool(args.batch_blueprints)
+  if args.watch:
+    try:
+      conversion.watchBatch(args.batch_blueprints or args.batch_netlists, args.outdir, to_netlist,
+        meta=not args.no_meta, entity_table=args.entity_table, jobs=args.jobs, format=args.format,
+        level=args.level, interval=args.interval)
+    except KeyboardInterrupt:
+      pass
+    return
+  results = conversion.convertBatch(args.batch_blueprints or args.batch_netlists, args.outdir,
+    to_netlist, meta=not args.no_meta, entity_table=args.entity_table, jobs=args.jobs, format=args.format,
+    level=args.level)
+  if any(result["error"] for result in results):
+    sys.exit(1)
 
 if __name__=="__main__":
   parser = argparse.ArgumentParser(description="Translate between blueprints and netlists",
     usage="\n%(prog)s -h\
-           \n%(prog)s -n NETLIST [--entities-only] -o OUTFILE\
-           \n%(prog)s -b BLUEPRINT [--no-meta] -o OUTFILE")
+           \n%(prog)s -n NETLIST [--entity-table | --format {lua,json}] [--level LEVEL] [--profile] -o OUTFILE\
+           \n%(prog)s -b BLUEPRINT [--no-meta] [--profile] -o OUTFILE\
+           \n%(prog)s --batch-blueprints PATH [PATH ...] [--no-meta] --outdir OUTDIR [-j JOBS] [--watch [--interval SECONDS]]\
+           \n%(prog)s --batch-netlists PATH [PATH ...] [--entity-table | --format {lua,json}] [--level LEVEL] --outdir OUTDIR [-j JOBS] [--watch [--interval SECONDS]]\
+           \n%(prog)s --serve | --socket PATH [-j JOBS]")
 
 
   netlist = parser.add_argument_group("Netlist->Blueprint")
   netlist.add_argument('-n','--netlist', help="Filename of input netlist")
   netlist.add_argument('--entity-table', action="store_true", help="Output Lua entity table instead of blueprint string")
+  netlist.add_argument('--format', choices=["lua", "json"], default="lua",
+    help="Blueprint string format: gzipped Lua (0.14) or zlib-compressed JSON (0.15+). Blueprint input is detected automatically")
+  netlist.add_argument('--level', type=int, choices=range(0, 10), default=9, metavar="LEVEL",
+    help="Compression level of blueprint strings, from 1 (fastest) to 9 (smallest, default); 0 stores them uncompressed")
 
   blueprint = parser.add_argument_group("Blueprint->Netlist")
   blueprint.add_argument('-b','--blueprint', help="Filename of input blueprint string or Lua entity table")
   blueprint.add_argument('--no-meta', action="store_true", help="Don't include metadata (positions, wire colors, etc)")
 
+  batch = parser.add_argument_group("Batch conversion")
+  batch.add_argument('--batch-blueprints', nargs='+', metavar="PATH",
+    help="Blueprint files, directories or glob patterns to convert to netlists")
+  batch.add_argument('--batch-netlists', nargs='+', metavar="PATH",
+    help="Netlist files, directories or glob patterns to convert to blueprints")
+  batch.add_argument('--outdir', help="Directory for the mirrored output tree")
+  batch.add_argument('-j','--jobs', type=int,
+    help="Number of worker processes for a batch or the server (default: CPU count)")
+  batch.add_argument('--watch', action="store_true",
+    help="Keep converting new and changed files until interrupted")
+  batch.add_argument('--interval', type=float, default=1.0, metavar="SECONDS",
+    help="Seconds between looking for changed files with --watch (default: 1)")
+
+  serve = parser.add_argument_group("Server")
+  serve.add_argument('--serve', action="store_true",
+    help="Serve conversion requests as JSON-RPC on stdin/stdout, one message per line")
+  serve.add_argument('--socket', metavar="PATH", help="Serve conversion requests on a Unix socket instead of stdio")
+
+  cached = parser.add_argument_group("Cache")
+  cached.add_argument('--no-cache', action="store_true",
+    help="Convert every input, instead of reusing results for inputs converted before")
+  cached.add_argument('--cache-dir', default=cache.default_directory, metavar="DIR",
+    help="Directory of the conversion cache (default: %(default)s)")
+  cached.add_argument('--cache-size', type=int, default=cache.default_max_bytes >> 20, metavar="MB",
+    help="Size the cache is kept under by deleting the least recently used results (default: %(default)s)")
+
+  parser.add_argument('--profile', action="store_true",
+    help="Print the time, peak memory allocated and counts for each stage of a single file conversion, bypassing the cache")
+
   req = parser.add_argument_group("required arguments")
-  req.add_argument('-o','--outfile', required=True, help="Filename of output file")
+  req.add_argument('-o','--outfile', help="Filename of output file (not used in batch mode)")
 
   if len(sys.argv)==1:
     parser.print_help()
     sys.exit(1)
 
   args = parser.parse_args()
-
-  convert(args)
-
+  if args.profile:
+    # time the conversion itself, not a cache lookup
+    cache.disable()
+  elif not args.no_cache:
+    # converted strings only; pickled Layouts are for library users
+    cache.enable(args.cache_dir, args.cache_size << 20, layouts=False)
+
+  if args.serve or args.socket:
+    if args.profile:
+      parser.error("--profile only works on single file conversions")
+    try:
+      if args.socket:
+        server.serveSocket(args.socket, jobs=args.jobs)
+      else:
+        server.serveStdio(jobs=args.jobs)
+    except KeyboardInterrupt:
+      pass
+  elif args.batch_blueprints or args.batch_netlists:
+    if args.profile:
+      parser.error("--profile only works on single file conversions")
+    convertBatch(args)
+  else:
+    if args.watch:
+      parser.error("--watch requires --batch-blueprints or --batch-netlists")
+    if not args.outfile:
+      parser.error("the following arguments are required: -o/--outfile")
+    if args.profile:
+      with profiling.Profile() as profile:
+        convert(args)
+      print(profile.report())
+    else:
+      convert(args)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# Single-pass recursive-descent parser for the netlist language (see netlist.ebnf)
+#
+# Produces the same semantic output as the generated grako parser in netlist_parser.py,
+# calling the same semantic actions, but without memoization or backtracking beyond
+# the descriptor alternatives. On a syntax error it raises NetlistSyntaxError, and
+# callers can rerun the grako parser for its diagnostics.
+
+import re
+
+class NetlistSyntaxError(Exception):
+  def __init__(self, message, text, pos):
+    line = text.count("\n", 0, pos) + 1
+    col = pos - (text.rfind("\n", 0, pos) + 1) + 1
+    super().__init__("({}:{}) {}".format(line, col, message))
+    self.pos = pos
+
+class Node(dict):
+  """ AST node: a dict whose keys can be read as attributes, None when missing """
+  __slots__ = ()
+
+  def __getattr__(self, name):
+    return self.get(name)
+
+whitespace_re = re.compile(r'(?:[\t ]+|#[^\r\n]*)*')
+newline_re = re.compile(r'[\r\n]+')
+name_re = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+signal_re = re.compile(r'[A-Za-z0-9\-]+')
+uint_re = re.compile(r'0|[1-9][0-9]*')
+int_re = re.compile(r'0|[\-]?[1-9][0-9]*')
+float_re = re.compile(r'[\-]?[0-9]*\.[0-9]+')
+rest_of_line_re = re.compile(r'[^\n]*')
+word_char_re = re.compile(r'[A-Za-z0-9_]')
+
+class Backtrack(Exception):
+  """ Failure of one alternative; the caller restores the position """
+
+class FastNetlistParser:
+  def __init__(self, text, semantics):
+    self.text = text
+    self.pos = 0
+    self.semantics = semantics
+    self.error_pos = 0
+
+  def fail(self):
+    self.error_pos = max(self.error_pos, self.pos)
+    raise Backtrack()
+
+  def skip(self):
+    self.pos = whitespace_re.match(self.text, self.pos).end()
+
+  def pattern(self, regex):
+    """ Match a regex after whitespace, returning the matched string """
+    self.skip()
+    match = regex.match(self.text, self.pos)
+    if not match or match.end()==self.pos:
+      self.fail()
+    self.pos = match.end()
+    return match.group()
+
+  def tryPattern(self, regex):
+    pos = self.pos
+    try:
+      return self.pattern(regex)
+    except Backtrack:
+      self.pos = pos
+      return None
+
+  def token(self, *tokens):
+    """ Match one of several literal tokens after whitespace, returning it """
+    self.skip()
+    text, pos = self.text, self.pos
+    for token in tokens:
+      if text.startswith(token, pos):
+        end = pos + len(token)
+        # keywords don't match as a prefix of a longer word
+        if token[0].isalpha() and word_char_re.match(text, end):
+          continue
+        self.pos = end
+        return token
+    self.fail()
+
+  def tryToken(self, *tokens):
+    pos = self.pos
+    try:
+      return self.token(*tokens)
+    except Backtrack:
+      self.pos = pos
+      return None
+
+  def alternatives(self, *rules):
+    """ Return the result of the first rule that matches (PEG ordered choice) """
+    pos = self.pos
+    for rule in rules:
+      try:
+        return rule()
+      except Backtrack:
+        self.pos = pos
+    self.fail()
+
+  def atNewline(self):
+    """ Consume a newline or end of text, after whitespace """
+    self.skip()
+    if self.pos==len(self.text):
+      return True
+    match = newline_re.match(self.text, self.pos)
+    if match:
+      self.pos = match.end()
+      return True
+    return False
+
+  # Grammar rules
+
+  def parseFile(self):
+    text = self.text
+    entities = []
+    metadata = None
+    while True:
+      self.skip()
+      if self.pos==len(text):
+        break
+      match = newline_re.match(text, self.pos)
+      if match:
+        self.pos = match.end()
+      elif text.startswith("||", self.pos):
+        self.pos += 2
+        metadata = self.parseMetadata()
+        break
+      else:
+        entities.append(self.netline())
+
+    self.skip()
+    if self.pos!=len(text):
+      self.fail()
+    return Node(Entities=entities, Metadata=metadata)
+
+  def parseMetadata(self):
+    metadata = []
+    while True:
+      self.skip()
+      if self.pos==len(self.text):
+        break
+      match = newline_re.match(self.text, self.pos)
+      if match:
+        self.pos = match.end()
+        continue
+      meta = self.alternatives(self.ent_meta, self.net_meta, self.global_meta)
+      if not self.atNewline():
+        self.fail()
+      metadata.append(meta)
+    return metadata or None
+
+  def netlist(self):
+    names = [self.pattern(name_re)]
+    while self.tryToken(","):
+      names.append(self.pattern(name_re))
+    return names
+
+  def tryNetlist(self):
+    pos = self.pos
+    try:
+      return self.netlist()
+    except Backtrack:
+      self.pos = pos
+      return None
+
+  def netline(self):
+    out_nets = None
+    in_nets = self.tryNetlist()
+    if in_nets is not None and self.tryToken("<="):
+      out_nets, in_nets = in_nets, self.tryNetlist()
+    self.token(":")
+    descriptor = self.alternatives(self.decider_descriptor, self.constant_descriptor,
+                                   self.arithmetic_descriptor, self.entity_descriptor)
+    ent_id = None
+    pos = self.pos
+    if self.tryToken("|"):
+      ent_id = self.tryUint()
+      if ent_id is None:
+        self.pos = pos
+    ast = Node(OutNets=out_nets, InNets=in_nets, Descriptor=descriptor, ID=ent_id)
+    return self.semantics.netline(ast)
+
+  def tryUint(self):
+    value = self.tryPattern(uint_re)
+    return int(value) if value is not None else None
+
+  def decider_descriptor(self):
+    ast = Node()
+    ast["OutType"] = self.token("1", "@")
+    ast["OutSig"] = self.pattern(signal_re)
+    self.token("if")
+    ast["Op1"] = self.pattern(signal_re)
+    ast["Comparator"] = self.token(">", "=", "<")
+    ast["Op2"] = self.pattern(signal_re)
+    return self.semantics.decider_descriptor(ast)
+
+  def signal_with_value(self):
+    value = int(self.pattern(int_re))
+    return Node(Value=value, Signal=self.pattern(signal_re))
+
+  def constant_descriptor(self):
+    signals = [self.signal_with_value()]
+    while self.tryToken(","):
+      signals.append(self.signal_with_value())
+    return self.semantics.constant_descriptor(signals)
+
+  def arithmetic_descriptor(self):
+    ast = Node()
+    ast["OutSig"] = self.pattern(signal_re)
+    self.token("=")
+    ast["Op1"] = self.pattern(signal_re)
+    ast["Operator"] = self.token("+", "-", "/", "*")
+    ast["Op2"] = self.pattern(signal_re)
+    return self.semantics.arithmetic_descriptor(ast)
+
+  def entity_descriptor(self):
+    return self.semantics.entity_descriptor(self.pattern(signal_re))
+
+  def number(self):
+    value = self.tryPattern(float_re)
+    if value is not None:
+      return float(value)
+    return int(self.pattern(int_re))
+
+  def ent_meta(self):
+    ast = Node(ID=int(self.pattern(uint_re)))
+    self.token("|")
+    ast["X"] = self.number()
+    ast["Y"] = self.number()
+    ast["Direction"] = self.tryToken("N", "S", "E", "W")
+    return ast
+
+  def terminal(self):
+    return Node(ID=int(self.pattern(uint_re)), Type=self.tryToken("i", "o", "p"))
+
+  def wire(self):
+    first = self.terminal()
+    self.token("-")
+    return Node(Terminals=[first, self.terminal()])
+
+  def net_meta(self):
+    ast = Node(WireName=self.pattern(name_re))
+    self.token("|")
+    ast["Color"] = self.token("red", "green")
+    wires = []
+    while True:
+      pos = self.pos
+      try:
+        wires.append(self.wire())
+      except Backtrack:
+        self.pos = pos
+        break
+    ast["Wires"] = wires
+    return ast
+
+  def global_name(self):
+    self.token("name")
+    self.token("||")
+    match = rest_of_line_re.match(self.text, self.pos)
+    self.pos = match.end()
+    return Node(Name=match.group())
+
+  def global_icons(self):
+    self.token("icons")
+    self.token("||")
+    names = [self.pattern(signal_re)]
+    while True:
+      name = self.tryPattern(signal_re)
+      if name is None:
+        break
+      names.append(name)
+    return Node(Names=names)
+
+  def global_meta(self):
+    return self.alternatives(self.global_name, self.global_icons)
+
+def parseNetlist(text, semantics):
+  """
+  Parse a netlist string, calling `semantics` actions like the grako parser does.
+  Entities is always a list, and Metadata a list or None.
+  """
+  parser = FastNetlistParser(text, semantics)
+  try:
+    return parser.parseFile()
+  except Backtrack:
+    raise NetlistSyntaxError("Invalid netlist syntax", text, parser.error_pos) from None
@@ -4,10 +4,14 @@
 from grako.exceptions import SemanticError
 from grako.model import ModelBuilderSemantics
 from collections import defaultdict
+import io
 
 from factorilog import *
 from string_ops import signalToString, signalFromString
-from netlist_parser import NetlistParser
+from netlist_fastparser import parseNetlist, NetlistSyntaxError
+import cache
+import canonical
+import profiling
 
 class NetlistSemantics(ModelBuilderSemantics):
   def decider_descriptor(self, ast):
@@ -52,92 +56,139 @@ class NetlistSemantics(ModelBuilderSemantics):
     del ast["OutNets"]
     return ast
 
+def parseNetlistAst(netlist):
+  """
+  Parse netlist string with the fast parser, falling back to the grako parser
+  on syntax errors for its diagnostics.
+  """
+  try:
+    return parseNetlist(netlist, NetlistSemantics())
+  except NetlistSyntaxError:
+    from netlist_parser import NetlistParser
+    parser = NetlistParser(parseinfo=False)
+    return parser.parse(netlist, rule_name='start', semantics=NetlistSemantics())
+
+def getNetlistTables(ast):
+  """
+  Collect the tables importNetlist links together from a parsed netlist:
+    entities: [(descriptor, entity id)] in netlist order
+    nets: net name -> [(entity index, terminal type name)]
+    hyperwire_meta: net name -> (color, [((entity id, terminal type), (entity id, terminal type))])
+    entity_meta: entity id -> (x, y, direction)
+    layout_meta: blueprint name and icons
+  """
+  tables = {"entities": [], "nets": defaultdict(list),
+            "hyperwire_meta": {}, "entity_meta": {}, "layout_meta": {},
+            "has_meta": bool(ast.Metadata)}
+
+  for i, entity_ast in enumerate(ast.Entities or ()):
+    tables["entities"].append((entity_ast.Descriptor, entity_ast.ID))
+    for term_name, term_nets in entity_ast.nets.items():
+      for net_name in term_nets or ():
+        tables["nets"][net_name].append((i, term_name))
+
+  for meta_ast in ast.Metadata or ():
+    if "WireName" in meta_ast: # hyperwire metadata
+      wires = [tuple((term.ID, term.Type) for term in wire.Terminals) for wire in meta_ast.Wires]
+      tables["hyperwire_meta"][meta_ast.WireName] = (meta_ast.Color, wires)
+    elif "ID" in meta_ast: # entity metadata
+      tables["entity_meta"][meta_ast.ID] = (meta_ast.X, meta_ast.Y, meta_ast.Direction)
+    elif "Name" in meta_ast:
+      tables["layout_meta"]["name"] = meta_ast.Name
+    elif "Names" in meta_ast:
+      tables["layout_meta"]["icons"] = [signalFromString(name) for name in meta_ast.Names]
+  return tables
+
+def parseNetlistTables(netlist):
+  """ Parse a netlist into the tables from getNetlistTables """
+  return getNetlistTables(parseNetlistAst(netlist))
+
+@profiling.staged("import netlist")
 def importNetlist(netlist):
-  """ 
-  Parse netlist string to produce a Layout.
   """
-  parser = NetlistParser(parseinfo=False)
-  ast = parser.parse(netlist, rule_name='start', semantics=NetlistSemantics())
+  Parse netlist string to produce a Layout, or get it from the active conversion cache.
+  """
+  return cache.cachedLayout("netlist layout", netlist, lambda: buildNetlistLayout(netlist))
+
+def buildNetlistLayout(netlist):
+  """ Parse netlist string to produce a Layout, see importNetlist """
+  with profiling.stage("parse netlist"):
+    tables = parseNetlistTables(netlist)
+  entity_meta = tables["entity_meta"]
 
   layout = Layout()
+  layout.meta.update(tables["layout_meta"])
 
-  # Catalog all metadata and create hyperwires
-  hyperwire_meta = {} #by name
-  entity_meta = {} #by id
-  entities = set()
-  meta = bool(ast.Metadata) # Netlist includes metadata
-  # TODO cleanup here
-  if ast.Metadata:
-    for meta_ast in ast.Metadata:
-      if "WireName" in meta_ast: # hyperwire metadata
-        hyperwire_meta[meta_ast.WireName] = meta_ast
-      elif "ID" in meta_ast: # entity metadata
-        entity_meta[meta_ast.ID] = meta_ast
-      elif "Name" in meta_ast:
-        layout.meta["name"] = meta_ast.Name
-      elif "Names" in meta_ast:
-        layout.meta["icons"] = [signalFromString(name) for name in meta_ast.Names]
-
-  # Create entities and hyperwires from netspec
+  # Create entities from netspec
   metadata_labels = 0
-  hyperwires = defaultdict(Wire) #by name
-  for entity_ast in ast.Entities:
-    # Make new entity
-    ent = CircuitEnt.fromName(entity_ast.Descriptor["name"])
-
-    entities.add(ent)
-
-    # Populate connected hyperwires
-    for term_name, term_nets in entity_ast.nets.items():
-      if term_nets:
-        term = ent.terminals[ent.terminal_types[TermType[term_name]]]
-        for net_name in term_nets:
-          hyperwires[net_name].terminals |= {term}
-    # Assign hyperwire names
-    for name,hyperwire in hyperwires.items():
-      hyperwire.name = name
-
-    # Add info from entity metadata, if any
-    ent.number = entity_ast.ID
-    if entity_ast.ID:
-      # assume we have metadata
-      metadata_labels += 1
-      try:
-        meta = entity_meta[entity_ast.ID]
-      except KeyError:
-        raise SemanticError("Missing metadata for entity {}".format(entity_ast.ID))
-      ent.position = {"x": meta.X, "y": meta.Y}
-      if meta.Direction:
-        ent.direction = Direction[meta.Direction]
-      entity_meta[entity_ast.ID]["ent"] = ent
-
-    if "behavior" in entity_ast.Descriptor:
-      ent.behavior = entity_ast.Descriptor["behavior"]
-
-  if metadata_labels != 0 and metadata_labels != len(ast.Entities):
+  entities = []
+  with profiling.stage("build entities"):
+    for descriptor, ent_id in tables["entities"]:
+      ent = CircuitEnt.fromName(descriptor["name"])
+      entities.append(ent)
+
+      # Add info from entity metadata, if any
+      ent.number = ent_id
+      if ent_id:
+        # assume we have metadata
+        metadata_labels += 1
+        try:
+          x, y, direction = entity_meta[ent_id]
+        except KeyError:
+          raise SemanticError("Missing metadata for entity {}".format(ent_id))
+        ent.position = {"x": x, "y": y}
+        if direction:
+          ent.direction = Direction[direction]
+
+      if "behavior" in descriptor:
+        ent.behavior = descriptor["behavior"]
+      layout.addEntity(ent)
+
+  if metadata_labels != 0 and metadata_labels != len(entities):
     raise SemanticError("Incomplete metadata provided")
 
+  # Create hyperwires from the terminals on each net
+  with profiling.stage("build hyperwires"):
+    hyperwires = {} #by name
+    for net_name, terms in tables["nets"].items():
+      hyperwire = hyperwires[net_name] = Hyperwire(name=net_name)
+      for i, term_name in terms:
+        ent = entities[i]
+        term_type = TermType[term_name]
+        if term_type not in ent.terminal_types: # "a: ..." lists the inputs of combinators
+          term_type = TermType["in"]
+        hyperwire.add(ent.terminals[ent.terminal_types[term_type]])
+    for name in tables["hyperwire_meta"]:
+      if name not in hyperwires:
+        hyperwires[name] = Hyperwire(name=name)
+
   # Create all wires from metadata
-  for name,meta in hyperwire_meta.items():
-    hyperwires[name].color = WireColor[meta.Color]
-    for wire in meta.Wires:
-      terminals = set() 
-      for term_ast in wire.Terminals:
-        ent = entity_meta[term_ast.ID].ent
-        if term_ast.Type:
-          terminal_i = ent.terminal_types[terminal_short[term_ast.Type]]
-        else:
-          terminal_i = 0
-        terminals.add(ent.terminals[terminal_i])
-      wire = Wire(terminals, WireColor[meta.Color])
-      for terminal in terminals:
-        terminal.wires.add(wire)
-
-  layout.entities = entities
-  layout.hyperwires = set(hyperwires.values())
-  layout.assignHyperwiresToTerminals()
-  layout.flags["meta_valid"] = meta
-  layout.flags["hyperwires_named"] = meta
+  with profiling.stage("wires from metadata"):
+    for name,(color,wires) in tables["hyperwire_meta"].items():
+      hyperwires[name].color = WireColor[color]
+      for wire_terms in wires:
+        terminals = set() 
+        for ent_id, term_type in wire_terms:
+          ent = layout.ents_by_number[ent_id]
+          if term_type:
+            terminal_i = ent.terminal_types[terminal_short[term_type]]
+          else:
+            terminal_i = 0
+          terminals.add(ent.terminals[terminal_i])
+        wire = Wire(terminals, WireColor[color])
+        if wire in hyperwires[name].wires:
+          continue # listed twice
+        for terminal in terminals:
+          terminal.addWire(wire)
+        hyperwires[name].wires[wire] = None
+
+  for hyperwire in hyperwires.values():
+    layout.addHyperwire(hyperwire)
+  # red before green on each terminal, like Layout.getHyperwires
+  layout.assignHyperwiresToTerminals(sorted(hyperwires.values(),
+    key=lambda hyperwire: hyperwire.color.value if hyperwire.color else 0))
+  layout.flags["meta_valid"] = tables["has_meta"]
+  layout.flags["hyperwires_named"] = tables["has_meta"]
   return layout
 
 def getDescString(ent):
@@ -190,16 +241,33 @@ def getEntityMetaString(ent):
         y = ent.position["y"], dir = direction)
   return metastr
 
-def getWireMetaString(wire):
-  """Get a description including all component wires"""
-  # Tracer()()
-  subwires = {subwire for term in wire.terminals for subwire in term.wires if subwire.color==wire.color}
-  term_str = lambda term: "{num}{type}".format(num=term.ent.number,
-        type=term.type.name[0] if len(term.ent.terminals)>1 else "")
+# Compared by identity, as hashing enum members is slow in the export loops
+in_type, out_type, pass_type = TermType["in"], TermType["out"], TermType["pass"]
 
-  wire_strings = ("-".join(map(term_str, wire.terminals)) for wire in subwires)
-  return "{name} | {color} {wires}".format(name=wire.name, 
-        color=wire.color.name, wires=" ".join(wire_strings))
+def getTerminalString(term):
+  """ Entity number, with the terminal type for entities with several terminals """
+  ent = term.ent
+  if len(ent.terminals)>1:
+    letter = "i" if term.type is in_type else "o" if term.type is out_type else "p"
+    return "{}{}".format(ent.number, letter)
+  return str(ent.number)
+
+def getWireMetaString(hyperwire):
+  """
+  Get a description including all component wires, from the wires bucketed on the hyperwire.
+  Each wire starts from the lower numbered entity, or the first terminal of an entity.
+  """
+  wire_strings = []
+  for wire in hyperwire.wires:
+    first, second = wire.terminals
+    if first.ent is second.ent:
+      if first is not first.ent.terminals[0]:
+        first, second = second, first
+    elif first.ent.number > second.ent.number:
+      first, second = second, first
+    wire_strings.append(getTerminalString(first) + "-" + getTerminalString(second))
+  return "{name} | {color} {wires}".format(name=hyperwire.name,
+        color=hyperwire.color.name, wires=" ".join(wire_strings))
 
 def getLayoutMetaString(layout):
   meta_strs = []
@@ -210,57 +278,134 @@ def getLayoutMetaString(layout):
       signalToString(sig) for sig in layout.meta["icons"]))
   return "\n".join(meta_strs)
 
-def entInterfacesToString(interfaces):
+def entInterfacesToString(outs, ins, passes):
   elements = []
-  for type_ in [TermType["out"], TermType["in"], TermType["pass"]]:
-    separated = ", ".join(interfaces[type_])
-    if separated:
-      elements.append(separated)
-      if type_==TermType["out"]:
-        elements.append("<=")
+  if outs:
+    elements.append(", ".join(outs))
+    elements.append("<=")
+  if ins:
+    elements.append(", ".join(ins))
+  if passes:
+    elements.append(", ".join(passes))
   return " ".join(elements)
 
-def getNetString(ent, meta = False):
+def getNetString(ent, meta = False, hyperwire_names = None):
   """
   Return primary netlist representation of entity.
   If meta==True, add metadata identifier and return (netstr, metastr)
   Otherwise, just return the netstr
+  Hyperwires are named by `hyperwire_names` if given, listed by name on each terminal.
   """
-  interface = {type_:[] for type_ in TermType}
+  outs, ins, passes = [], [], []
   for term in ent.terminals:
-    for hyper in term.hyperwires:
-      interface[term.type].append(hyper.name)
+    names = outs if term.type is out_type else ins if term.type is in_type else passes
+    if hyperwire_names is None:
+      for hyper in term.hyperwires:
+        names.append(hyper.name)
+    else:
+      names.extend(sorted((hyperwire_names[hyper] for hyper in term.hyperwires), key=lambda name: (len(name), name)))
 
   netstr = "{iface}: {desc}".format(
-      iface=entInterfacesToString(interface), desc=getDescString(ent))
+      iface=entInterfacesToString(outs, ins, passes), desc=getDescString(ent))
   if meta:
-    netstr_meta = "{netstr} \t| {num}".format(
-            netstr = netstr, num = ent.number)
-    return (netstr_meta, getEntityMetaString(ent))
+    return (netstr, getEntityMetaString(ent))
   else:
     return netstr
 
-def exportNetlist(layout, meta = False):
-  layout.getHyperwires()
+def getEntityLabels(layout):
+  """ Netlist description of each entity, as labels for Layout.refineColors """
+  return {ent: getDescString(ent) for ent in layout.entities}
 
-  layout.nameHyperwires()
+def getStructuralHash(layout, rounds = 3):
+  """
+  Hash of the circuit of a Layout, leaving out entity numbers, positions, wire colors and names:
+  the digest of Layout.refineColors labelled with netlist descriptions.
+  Layouts with the same canonical netlist have the same hash. Different circuits get different
+  hashes unless `rounds` rounds of refinement can't tell them apart, as for circuits differing
+  only beyond `rounds` hyperwires from any entity; compare canonical netlists to be sure.
+  """
+  return layout.refineColors(getEntityLabels(layout), rounds)[2]
+
+def iterCanonicalLines(layout):
+  """
+  Generate the lines of the canonical netlist of a Layout: entities in canonical.getCanonicalOrder,
+  and hyperwires named a, b, c... in that order, so it doesn't depend on entity numbers,
+  positions or the hyperwire names of the layout. Hyperwire names of the layout are left as they are.
+  """
+  with profiling.stage("canonical order"):
+    entities, hyperwires = canonical.getCanonicalOrder(layout, getEntityLabels(layout))
+  names = {}
+  name = None
+  for hyperwire in hyperwires:
+    name = nextName(name)
+    names[hyperwire] = name
+  for ent in entities:
+    yield getNetString(ent, hyperwire_names=names)
+
+def iterNetlistLines(layout, meta = False, canonical = False):
+  """
+  Generate the lines of the netlist of a Layout, without line endings, as entities are visited.
+  With metadata, entity lines are aligned on the '|' before their number, so all of them
+  are formatted first to find the widest.
+  With canonical=True, generate the bare canonical netlist, see iterCanonicalLines.
+  """
+  if canonical:
+    if meta:
+      raise RuntimeError("Canonical netlists have no metadata")
+    yield from iterCanonicalLines(layout)
+    return
 
-  # generate string for each entity
-  strings = []
-  for ent in sorted(layout.entities, key=lambda e: e.number):
-    strings.append(getNetString(ent, meta))
+  layout.getHyperwires()
 
-  if meta:
-    net_strs, ent_meta_strs = zip(*strings)
-    hyper_meta_strs = tuple(getWireMetaString(hyper) for hyper in layout.hyperwires)
-    global_meta_str = getLayoutMetaString(layout)
-    meta_strs = ent_meta_strs + hyper_meta_strs
-    if global_meta_str:
-      meta_strs = (global_meta_str,) + meta_strs
-
-    max_tab = max(s.find('\t') for s in net_strs)
-    return "{nets}\n||\n{metas}".format(
-        nets = "\n".join(net_strs), metas = "\n".join(meta_strs)) \
-        .expandtabs(max_tab+1)
-  else:
-    return "\n".join(strings)
\ No newline at end of file
+  with profiling.stage("name hyperwires"):
+    layout.nameHyperwires()
+
+  entities = layout.getSortedEntities()
+  if not meta:
+    for ent in entities:
+      yield getNetString(ent)
+    return
+
+  with profiling.stage("align"):
+    netstrs = [getNetString(ent) for ent in entities]
+    width = max(map(len, netstrs), default=0) + 2
+  for ent, netstr in zip(entities, netstrs):
+    yield "{netstr}| {num}".format(netstr=netstr.ljust(width), num=ent.number)
+  del netstrs
+  yield "||"
+  global_meta_str = getLayoutMetaString(layout)
+  if global_meta_str:
+    yield global_meta_str
+  for ent in entities:
+    yield getEntityMetaString(ent)
+  for hyper in layout.getOrderedHyperwires(entities):
+    yield getWireMetaString(hyper)
+
+@profiling.staged("export netlist")
+def writeNetlist(layout, stream, meta = False, canonical = False, buffer_lines = 1024):
+  """
+  Write the netlist of a Layout to a text stream, in pieces of `buffer_lines` lines.
+  Returns the number of characters written.
+  """
+  written = 0
+  lines = []
+  def flush():
+    # lines are separated by newlines, with none after the last one
+    piece = ("\n" if written else "") + "\n".join(lines)
+    stream.write(piece)
+    lines.clear()
+    return len(piece)
+
+  for line in iterNetlistLines(layout, meta, canonical):
+    lines.append(line)
+    if len(lines)>=buffer_lines:
+      written += flush()
+  if lines:
+    written += flush()
+  return written
+
+def exportNetlist(layout, meta = False, canonical = False):
+  """ Convert Layout to netlist, see iterNetlistLines """
+  buffer = io.StringIO()
+  writeNetlist(layout, buffer, meta, canonical)
+  return buffer.getvalue()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# Stage timers and counters for conversions
+#
+# Code marks its stages with `with profiling.stage("name"):` or the @profiling.staged("name")
+# decorator, and records totals with profiling.count(). Nothing is recorded unless a Profile is active, so when profiling
+# is off a stage costs one global check and a shared no-op context manager.
+
+import contextlib
+import functools
+import time
+import tracemalloc
+from collections import defaultdict
+
+active = None # the Profile being recorded, if any
+null_stage = contextlib.nullcontext()
+
+class StageStats:
+  __slots__ = ("depth", "calls", "seconds", "peak")
+
+  def __init__(self, depth):
+    self.depth = depth # nesting depth the stage was first seen at
+    self.calls = 0
+    self.seconds = 0.0
+    self.peak = 0 # most memory allocated above the start of the stage, in bytes
+
+class Stage:
+  """ A running stage of the active Profile """
+  __slots__ = ("profile", "name", "start", "start_memory", "max_peak")
+
+  def __init__(self, profile, name):
+    self.profile = profile
+    self.name = name
+
+  def __enter__(self):
+    profile = self.profile
+    if self.name not in profile.stages:
+      profile.stages[self.name] = StageStats(len(profile.stack))
+    self.max_peak = 0
+    if profile.memory:
+      current, peak = tracemalloc.get_traced_memory()
+      if profile.stack:
+        # the peak is reset for this stage, so hand the peak so far to the parent
+        parent = profile.stack[-1]
+        parent.max_peak = max(parent.max_peak, peak)
+      tracemalloc.reset_peak()
+      self.start_memory = current
+    profile.stack.append(self)
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    elapsed = time.perf_counter() - self.start
+    profile = self.profile
+    profile.stack.pop()
+    stats = profile.stages[self.name]
+    stats.calls += 1
+    stats.seconds += elapsed
+    if profile.memory:
+      peak = max(tracemalloc.get_traced_memory()[1], self.max_peak)
+      stats.peak = max(stats.peak, peak - self.start_memory)
+      if profile.stack:
+        parent = profile.stack[-1]
+        parent.max_peak = max(parent.max_peak, peak)
+    return False
+
+class Profile:
+  """
+  Records stages and counts while active, as a context manager:
+    with Profile() as profile:
+      convert()
+    print(profile.report())
+  With memory=True, allocation peaks are traced with tracemalloc, which slows Python code down.
+  """
+  def __init__(self, memory = True):
+    self.memory = memory
+    self.stages = {} # StageStats by name, in the order stages first started
+    self.counts = defaultdict(int)
+    self.stack = []
+
+  def __enter__(self):
+    global active
+    if active is not None:
+      raise RuntimeError("A profile is already active")
+    active = self
+    self.started_tracing = self.memory and not tracemalloc.is_tracing()
+    if self.started_tracing:
+      tracemalloc.start()
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    global active
+    self.seconds = time.perf_counter() - self.start
+    if self.started_tracing:
+      tracemalloc.stop()
+    active = None
+    return False
+
+  def report(self):
+    """ Get a table of stages, with times including nested stages, followed by the counts """
+    lines = ["{:<32} {:>6} {:>10} {:>7} {:>10}".format("stage", "calls", "seconds", "%", "peak MB")]
+    for name, stats in self.stages.items():
+      lines.append("{:<32} {:>6} {:>10.4f} {:>7.1f} {:>10}".format(
+        "  "*stats.depth + name, stats.calls, stats.seconds,
+        100*stats.seconds/self.seconds if self.seconds else 0.0,
+        "{:.2f}".format(stats.peak/1e6) if self.memory else "-"))
+    lines.append("{:<32} {:>6} {:>10.4f}".format("total", "", self.seconds))
+    for name, value in self.counts.items():
+      lines.append("{:<32} {:>17}".format(name, value))
+    return "\n".join(lines)
+
+def stage(name):
+  """ Context manager timing a stage of the active profile, if any """
+  if active is None:
+    return null_stage
+  return Stage(active, name)
+
+def count(name, amount = 1):
+  """ Add to a count of the active profile, if any """
+  if active is not None:
+    active.counts[name] += amount
+
+def staged(name):
+  """ Decorator running each call of a function as a stage of the active profile, if any """
+  def decorate(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      if active is None:
+        return function(*args, **kwargs)
+      with Stage(active, name):
+        return function(*args, **kwargs)
+    return wrapper
+  return decorate
+
+def countLayout(layout):
+  """ Count the entities, physical wires and hyperwires of a Layout in the active profile, if any """
+  if active is None:
+    return
+  count("entities", len(layout.entities))
+  count("wires", sum(len(term.wires) for ent in layout.entities for term in ent.terminals)//2)
+  count("hyperwires", len(layout.hyperwires))
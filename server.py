@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# Long-running conversion server, speaking JSON-RPC 2.0 with one message per line
+#
+# The server imports the conversion layers and loads the signal table once, then forks
+# its worker processes, so each request only pays for the conversion itself.
+# Requests are served concurrently by the workers and answered as they complete, so
+# responses may come back in a different order than the requests; match them by id.
+#
+# Methods:
+#   blueprintToNetlist {blueprint, meta=true} -> netlist string
+#   netlistToBlueprint {netlist, entity_table=false, format="lua", level=9} -> blueprint string
+#   convertFile {input, output, to_netlist, meta, entity_table, format, level} -> result of conversion.convertFile
+#   ping -> "pong"
+#   shutdown -> null, then stops serving
+
+import inspect
+import io
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import conversion
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+CONVERSION_ERROR = -32000
+
+# Input suffixes converted to blueprints by convertFile, when to_netlist isn't given
+netlist_only_suffixes = (".netlist", ".net")
+
+def convertFile(input, output, to_netlist = None, meta = True, entity_table = False, format = "lua", level = 9):
+  """ conversion.convertFile, raising its error, and guessing the direction from the input suffix if not given """
+  if to_netlist is None:
+    to_netlist = not input.lower().endswith(netlist_only_suffixes)
+  result = conversion.convertFile(input, output, to_netlist, meta=meta, entity_table=entity_table,
+    format=format, level=level)
+  if result["error"]:
+    raise RuntimeError(result["error"])
+  return result
+
+def blueprintToNetlist(blueprint, meta = True):
+  return conversion.blueprintToNetlist(blueprint, meta=meta)
+
+def netlistToBlueprint(netlist, entity_table = False, format = "lua", level = 9):
+  return conversion.netlistToBlueprint(netlist, entity_table=entity_table, format=format, level=level)
+
+# Methods run in the worker processes, by name
+methods = {
+  "blueprintToNetlist": blueprintToNetlist,
+  "netlistToBlueprint": netlistToBlueprint,
+  "convertFile": convertFile,
+}
+
+def callMethod(name, params):
+  method = methods[name]
+  if isinstance(params, list):
+    return method(*params)
+  return method(**params)
+
+class RequestError(Exception):
+  def __init__(self, code, message, id = None):
+    super().__init__(message)
+    self.code = code
+    self.id = id
+
+def getError(code, message, id = None):
+  return {"jsonrpc": "2.0", "id": id, "error": {"code": code, "message": message}}
+
+def parseRequest(line):
+  """ (id, method, params) of a request line, checking the method and its params """
+  try:
+    request = json.loads(line)
+  except ValueError as e:
+    raise RequestError(PARSE_ERROR, "Parse error: {}".format(e))
+  if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+    raise RequestError(INVALID_REQUEST, "Invalid request")
+  id = request.get("id")
+  method = request["method"]
+  params = request.get("params", {})
+  if method not in methods and method not in ("ping", "shutdown"):
+    raise RequestError(METHOD_NOT_FOUND, "Method not found: {}".format(method), id)
+  if not isinstance(params, (dict, list)):
+    raise RequestError(INVALID_PARAMS, "Invalid params", id)
+  if method in methods:
+    try:
+      signature = inspect.signature(methods[method])
+      if isinstance(params, list):
+        signature.bind(*params)
+      else:
+        signature.bind(**params)
+    except TypeError as e:
+      raise RequestError(INVALID_PARAMS, "Invalid params: {}".format(e), id)
+  return id, method, params
+
+def warmUp():
+  """ Also import the grako parser, which diagnoses netlist syntax errors """
+  conversion.warmUp()
+  import netlist_parser
+
+class Server:
+  """
+  Serves requests from text streams with a pool of `jobs` worker processes (default: CPU count).
+  Use as a context manager, so the workers finish the requests in progress on exit.
+  """
+  def __init__(self, jobs = None):
+    warmUp() # before the workers are forked, so they start warm
+    self.pool = ProcessPoolExecutor(max_workers=jobs, initializer=warmUp)
+    self.stopping = threading.Event()
+    self.on_shutdown = None # called once a shutdown request has been answered
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.pool.shutdown(wait=True)
+    return False
+
+  def submit(self, line, respond):
+    """
+    Start serving a request line, calling `respond` with the response dict when it's done.
+    Returns the future of a request passed to the workers, or None if it was answered already.
+    """
+    try:
+      id, method, params = parseRequest(line)
+    except RequestError as e:
+      respond(getError(e.code, str(e), e.id))
+      return None
+    if method=="ping":
+      respond({"jsonrpc": "2.0", "id": id, "result": "pong"})
+    elif method=="shutdown":
+      respond({"jsonrpc": "2.0", "id": id, "result": None})
+      self.stopping.set()
+      if self.on_shutdown:
+        self.on_shutdown()
+    else:
+      def done(future):
+        try:
+          respond({"jsonrpc": "2.0", "id": id, "result": future.result()})
+        except Exception as e:
+          respond(getError(CONVERSION_ERROR, "{}: {}".format(type(e).__name__, e), id))
+      future = self.pool.submit(callMethod, method, params)
+      future.add_done_callback(done)
+      return future
+    return None
+
+  def serveStream(self, in_stream, out_stream):
+    """
+    Serve the request lines of a text stream until it ends or the server shuts down,
+    then wait for the answers to the requests in progress.
+    """
+    lock = threading.Lock()
+    def respond(response):
+      text = json.dumps(response, separators=(",", ":")) + "\n"
+      with lock:
+        try:
+          out_stream.write(text)
+          out_stream.flush()
+        except (OSError, ValueError):
+          pass # the client went away
+    pending = []
+    for line in in_stream:
+      if line.strip():
+        future = self.submit(line, respond)
+        if future:
+          pending.append(future)
+          if len(pending)>=1024:
+            pending = [future for future in pending if not future.done()]
+      if self.stopping.is_set():
+        break
+    wait(pending)
+
+def serveStdio(jobs = None):
+  """ Serve requests from stdin, answering on stdout """
+  with Server(jobs) as server:
+    server.serveStream(sys.stdin, sys.stdout)
+
+def removeStaleSocket(path):
+  """
+  Remove a socket at `path` that no server accepts connections on any more.
+  Raises RuntimeError if a server still answers there, or if `path` is not a socket.
+  """
+  try:
+    if not stat.S_ISSOCK(os.lstat(path).st_mode):
+      raise RuntimeError("{} exists and is not a socket".format(path))
+  except FileNotFoundError:
+    return
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+    try:
+      probe.connect(path)
+    except ConnectionRefusedError:
+      os.unlink(path)
+      return
+  raise RuntimeError("A server is already listening on {}".format(path))
+
+def serveSocket(path, jobs = None):
+  """
+  Serve requests from each connection to a Unix socket at `path`, until a shutdown request.
+  A stale socket left at `path` is replaced, anything else there is an error.
+  """
+  removeStaleSocket(path)
+  with Server(jobs) as server:
+    class Handler(socketserver.StreamRequestHandler):
+      def handle(self):
+        server.serveStream(io.TextIOWrapper(self.rfile, encoding="utf-8"),
+          io.TextIOWrapper(self.wfile, encoding="utf-8"))
+
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as socket_server:
+      socket_server.daemon_threads = True
+      server.on_shutdown = lambda: threading.Thread(target=socket_server.shutdown).start()
+      try:
+        socket_server.serve_forever()
+      finally:
+        os.unlink(path)
@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+# Tick simulation of combinator Layouts
+
+import numpy as np
+
+from factorilog import DeciderCombinator, ArithmeticCombinator, ConstantCombinator, TermType
+
+# Wildcard signal codes, stored in place of a signal index
+EACH = -1
+ANYTHING = -2
+EVERYTHING = -3
+NONE = -4
+wildcards = {"signal-each": EACH, "signal-anything": ANYTHING, "signal-everything": EVERYTHING}
+
+comparators = {">": 0, "=": 1, "<": 2, "≥": 3, ">=": 3, "≤": 4, "<=": 4, "≠": 5, "!=": 5}
+# condition by comparator code and sign(lhs-rhs)+1
+comparison_table = np.array([[False, False, True],
+                             [False, True, False],
+                             [True, False, False],
+                             [False, True, True],
+                             [True, True, False],
+                             [True, False, True]])
+
+operations = {"+": 0, "-": 1, "*": 2, "/": 3}
+
+def compare(lhs, rhs, comparator):
+  """ Elementwise comparison, where comparator holds comparator codes """
+  return comparison_table[comparator, np.sign(lhs.astype(np.int64) - rhs) + 1]
+
+def divide(lhs, rhs):
+  """ Integer division truncating toward zero, with zero for division by zero """
+  safe_rhs = np.where(rhs==0, 1, rhs)
+  quotient = np.abs(lhs) // np.abs(safe_rhs) * np.sign(lhs) * np.sign(safe_rhs)
+  return np.where(rhs==0, 0, quotient)
+
+operators = (np.add, np.subtract, np.multiply, divide)
+
+def operate(lhs, rhs, operator):
+  """ Apply an arithmetic operator with int32 wraparound """
+  return operator(lhs.astype(np.int64), rhs).astype(np.int32)
+
+class Simulator:
+  """
+  Simulates a Layout one game tick at a time.
+  Signal values on all hyperwires are held in one (hyperwires x signals) int32
+  matrix, with an extra all-zero row standing in for unconnected terminals.
+  Combinator outputs reach their output hyperwires on the following tick.
+  """
+
+  def __init__(self, layout):
+    self.layout = layout
+    self.tick = 0
+
+    hyperwires = list(layout.getHyperwires())
+    self.hyperwire_index = {hyper: i for i, hyper in enumerate(hyperwires)}
+    self.hyperwires = hyperwires
+
+    ents = list(layout.entities)
+    self.deciders = [ent for ent in ents if isinstance(ent, DeciderCombinator)]
+    self.arithmetics = [ent for ent in ents if isinstance(ent, ArithmeticCombinator)]
+    self.constants = [ent for ent in ents if isinstance(ent, ConstantCombinator)]
+    # Row order of the output matrix: deciders, then arithmetics, then constants
+    self.combinators = self.deciders + self.arithmetics + self.constants
+    self.ent_index = {ent: i for i, ent in enumerate(self.combinators)}
+
+    self.signals = []
+    self.signal_index = {}
+    self.compileConditions()
+    self.compileConstants()
+    self.compileTerminals()
+
+    # keep at least one (always zero) signal column so indexing stays valid
+    width = max(len(self.signals), 1)
+    self.values = np.zeros((len(hyperwires)+1, width), np.int32)
+    self.outputs = np.zeros((len(self.combinators), width), np.int32)
+    n_readers = len(self.deciders)+len(self.arithmetics)
+    for row, col, count in self.constant_filters:
+      self.outputs[n_readers+row, col] += count
+    self.compileScatter()
+    self.plan = self.planRows(np.arange(n_readers))
+
+  def getSignalIndex(self, signal):
+    """ Get column of a signal, or its wildcard code """
+    name = signal["name"]
+    if name in wildcards:
+      return wildcards[name]
+    if name not in self.signal_index:
+      self.signal_index[name] = len(self.signals)
+      self.signals.append(name)
+    return self.signal_index[name]
+
+  def compileConditions(self):
+    """
+    Compile decider and arithmetic conditions into parameter arrays, one entry per reader.
+    For deciders `code` holds the comparator and `copy` the output count mode,
+    for arithmetics `code` holds the operation.
+    """
+    conditions = [ent.behavior["decider_conditions"] for ent in self.deciders] + \
+                 [ent.behavior["arithmetic_conditions"] for ent in self.arithmetics]
+    def getSignals(key):
+      return np.array([self.getSignalIndex(cond[key]) if cond.get(key) else NONE
+                       for cond in conditions], np.int64)
+
+    self.first = getSignals("first_signal")
+    self.second = getSignals("second_signal")
+    self.output = getSignals("output_signal")
+    self.constant = np.array([cond.get("constant", 0) for cond in conditions], np.int64)
+    self.copy = np.array([bool(cond.get("copy_count_from_input")) for cond in conditions], bool)
+    try:
+      codes = [comparators[cond["comparator"]] for cond in conditions[:len(self.deciders)]]
+    except KeyError as e:
+      raise RuntimeError("Comparator {} not supported".format(e))
+    try:
+      codes += [operations[cond["operation"]] for cond in conditions[len(self.deciders):]]
+    except KeyError as e:
+      raise RuntimeError("Operation {} not supported".format(e))
+    self.code = np.array(codes, np.int8)
+
+  def compileConstants(self):
+    """ Get (constant row, signal column, count) of every constant combinator filter """
+    self.constant_filters = [(i, self.getSignalIndex(filt["signal"]), filt["count"])
+                             for i, ent in enumerate(self.constants)
+                             for filt in ent.behavior.get("filters", []) if filt.get("signal")]
+
+  def getWireRows(self, term):
+    """ Get the hyperwire rows a terminal is connected to """
+    return [self.hyperwire_index[hyper] for hyper in term.hyperwires]
+
+  def compileWireRows(self, terms):
+    """
+    Get a (terminals x n) array of connected hyperwire rows, padded with the zero row.
+    Physical terminals have at most a red and a green hyperwire, but bare netlists may have more.
+    """
+    rows = [self.getWireRows(term) for term in terms]
+    width = max([2] + [len(term_rows) for term_rows in rows])
+    zero_row = len(self.hyperwires)
+    return np.array([term_rows + [zero_row]*(width-len(term_rows)) for term_rows in rows],
+                    np.int64).reshape(-1, width)
+
+  def compileTerminals(self):
+    def getTerminal(ent, type_):
+      return ent.terminals[ent.terminal_types[type_]]
+
+    readers = self.deciders + self.arithmetics
+    self.in_wires = self.compileWireRows(getTerminal(ent, TermType["in"]) for ent in readers)
+    self.out_wires = self.compileWireRows(getTerminal(ent, TermType["out"]) for ent in self.combinators)
+
+  def planRows(self, rows):
+    """
+    Group decider/arithmetic rows by how they are evaluated, and precompute their parameters.
+    Scalar rows read and write single signals, vector rows work on whole signal rows.
+    Arithmetic groups are further split by operation.
+    Returns a list of (evaluate function, group) pairs.
+    """
+    width = self.values.shape[1]
+    is_decider = rows < len(self.deciders)
+    scalar = (self.first[rows]>=0) & (self.output[rows]>=0)
+
+    def makeGroup(group):
+      wires = self.in_wires[group]
+      def flatIndexes(signals):
+        # index of each signal in each input hyperwire of the flattened value matrix,
+        # one contiguous array per input hyperwire column
+        return np.ascontiguousarray((wires*width + np.maximum(signals, 0)[:,None]).T)
+      return {"rows": group, "wires": np.ascontiguousarray(wires.T), "first": self.first[group],
+              "second": self.second[group], "constant": self.constant[group],
+              "output": self.output[group], "copy": self.copy[group], "code": self.code[group],
+              "first_at": flatIndexes(self.first[group]), "second_at": flatIndexes(self.second[group]),
+              "output_at": flatIndexes(self.output[group])}
+
+    # Everything outputs of a single signal condition only need whole rows for the output
+    everything = (self.first[rows]>=0) & (self.output[rows]==EVERYTHING)
+    plan = [(self.evalDecidersScalar, makeGroup(rows[is_decider & scalar])),
+            (self.evalDecidersEverything, makeGroup(rows[is_decider & everything])),
+            (self.evalDecidersVector, makeGroup(rows[is_decider & ~scalar & ~everything]))]
+    # Arithmetic vector rows must read each, and either output each or sum onto one signal
+    each = self.first[rows]==EACH
+    for code, operator in enumerate(operators):
+      is_operation = ~is_decider & (self.code[rows]==code)
+      for evaluate, mask in ((self.evalArithmeticsScalar, scalar),
+                             (self.evalArithmeticsEach, each & (self.output[rows]==EACH)),
+                             (self.evalArithmeticsSum, each & (self.output[rows]>=0))):
+        group = makeGroup(rows[is_operation & mask])
+        group["operator"] = operator
+        plan.append((evaluate, group))
+    return [(evaluate, group) for evaluate, group in plan if len(group["rows"])]
+
+  def readColumns(self, indexes):
+    """ Sum one signal per reader over its input hyperwires, given flat value indexes """
+    values = self.values.ravel()
+    result = values.take(indexes[0])
+    for col_indexes in indexes[1:]:
+      result += values.take(col_indexes)
+    return result
+
+  def readRows(self, wires):
+    """ Sum all signals per reader over its input hyperwires, given (columns x readers) hyperwire rows """
+    result = self.values.take(wires[0], axis=0)
+    for col_wires in wires[1:]:
+      result += self.values.take(col_wires, axis=0)
+    return result
+
+  def readOperand(self, group):
+    """ Get the second operand of every reader in a group """
+    return np.where(group["second"]>=0, self.readColumns(group["second_at"]), group["constant"])
+
+  def evalDecidersScalar(self, group):
+    cond = compare(self.readColumns(group["first_at"]), self.readOperand(group), group["code"])
+    counts = np.where(group["copy"], self.readColumns(group["output_at"]), 1)
+    self.outputs[group["rows"], group["output"]] = np.where(cond, counts, 0)
+
+  def evalDecidersEverything(self, group):
+    cond = compare(self.readColumns(group["first_at"]), self.readOperand(group), group["code"])
+    inputs = self.readRows(group["wires"])
+    counts = np.where(group["copy"][:,None], inputs, inputs!=0)
+    self.outputs[group["rows"]] = np.where(cond[:,None], counts, 0)
+
+  def evalDecidersVector(self, group):
+    rows, first, output = group["rows"], group["first"], group["output"]
+    inputs = self.readRows(group["wires"])
+    rhs = self.readOperand(group)
+    present = inputs != 0
+    counts = np.where(group["copy"][:,None], inputs, 1).astype(np.int32)
+    indexes = np.arange(len(rows))
+
+    passing = compare(inputs, rhs[:,None], group["code"][:,None]) & present
+    cond = np.select([first==ANYTHING, first==EVERYTHING],
+                     [passing.any(1), (passing | ~present).all(1)],
+                     compare(inputs[indexes, np.maximum(first, 0)], rhs, group["code"]) & (first>=0))
+
+    # Everything output: pass all input signals if the condition holds
+    everything = (output==EVERYTHING) & (first!=EACH)
+    outputs = np.where((cond & everything)[:,None] & present, counts, 0)
+    # Single output of a wildcard condition
+    single = np.nonzero((output>=0) & (first!=EACH))[0]
+    outputs[single, output[single]] = np.where(cond[single], counts[single, output[single]], 0)
+    # Each input: output each passing signal, or their sum on a single signal
+    each_counts = np.where(passing, counts, 0)
+    each_each = (first==EACH) & (output==EACH)
+    outputs[each_each] = each_counts[each_each]
+    each_single = np.nonzero((first==EACH) & (output>=0))[0]
+    outputs[each_single, output[each_single]] = each_counts[each_single].sum(1, dtype=np.int32)
+    self.outputs[rows] = outputs
+
+  def evalArithmeticsScalar(self, group):
+    self.outputs[group["rows"], group["output"]] = operate(
+      self.readColumns(group["first_at"]), self.readOperand(group), group["operator"])
+
+  def operateEach(self, group):
+    """ Apply the operation to every input signal, leaving absent signals at zero """
+    inputs = self.readRows(group["wires"])
+    results = operate(inputs, self.readOperand(group)[:,None], group["operator"])
+    return np.where(inputs!=0, results, 0)
+
+  def evalArithmeticsEach(self, group):
+    self.outputs[group["rows"]] = self.operateEach(group)
+
+  def evalArithmeticsSum(self, group):
+    self.outputs[group["rows"], group["output"]] = self.operateEach(group).sum(1, dtype=np.int32)
+
+  def evalPlan(self, plan):
+    """ Compute new outputs for the readers in a plan from the current hyperwire values """
+    for evaluate, group in plan:
+      evaluate(group)
+
+  def compileScatter(self):
+    """ Get flat value indexes that each combinator output column is added to """
+    width = self.values.shape[1]
+    self.scatter_at = [(self.out_wires[:,col,None]*width + np.arange(width)).ravel()
+                       for col in range(self.out_wires.shape[1])]
+
+  def sumOutputs(self):
+    """ Compute hyperwire values from all combinator outputs """
+    values = np.zeros(self.values.size, np.int32)
+    outputs = self.outputs.ravel()
+    for indexes in self.scatter_at:
+      np.add.at(values, indexes, outputs)
+    values = values.reshape(self.values.shape)
+    values[-1] = 0
+    return values
+
+  def step(self, ticks = 1):
+    """ Advance the simulation """
+    for _ in range(ticks):
+      self.values = self.sumOutputs()
+      self.evalPlan(self.plan)
+      self.tick += 1
+
+  def getSignals(self, hyperwire):
+    """ Get {signal name: value} of the nonzero signals on a hyperwire """
+    row = self.values[self.hyperwire_index[hyperwire]]
+    return {self.signals[i]: int(row[i]) for i in np.nonzero(row)[0]}
+
+  def getInputSignals(self, ent):
+    """ Get {signal name: value} of the nonzero signals read by a combinator """
+    term = ent.terminals[ent.terminal_types[TermType["in"]]]
+    row = self.values[self.getWireRows(term)].sum(0, dtype=np.int32)
+    return {self.signals[i]: int(row[i]) for i in np.nonzero(row)[0]}
+
+  def getOutputSignals(self, ent):
+    """ Get {signal name: value} of the nonzero signals a combinator outputs """
+    row = self.outputs[self.ent_index[ent]]
+    return {self.signals[i]: int(row[i]) for i in np.nonzero(row)[0]}
+
+class EventSimulator(Simulator):
+  """
+  Simulates a Layout by only re-evaluating combinators whose inputs changed.
+  Hyperwire values are updated from the output changes of the previous tick,
+  and only readers of hyperwires whose values changed are evaluated.
+  Per-tick counters are appended to `activity`.
+  While most combinators change every tick, whole ticks are left to Simulator.step, and
+  whether to switch back is only checked every `dense_check_period` ticks. The dirty
+  hyperwire and changed output counts of such ticks are not tracked, and are None.
+  """
+  plan_cache_size = 1024
+  # above this fraction of active combinators, fall back to whole-layout operations
+  dense_fraction = 0.25
+  dense_check_period = 16
+
+  def __init__(self, layout):
+    super().__init__(layout)
+    self.compileReaders()
+    self.values = np.zeros_like(self.values)
+    self.plan_cache = {}
+    self.activity = []
+
+    # Constant outputs are pending from the start, and every reader gets evaluated
+    # once on the first tick since combinators can output on empty inputs
+    n_readers = len(self.deciders)+len(self.arithmetics)
+    self.changed = np.arange(n_readers, len(self.combinators))
+    self.deltas = self.outputs[self.changed]
+    self.pending_readers = np.arange(n_readers)
+    self.plan_rows = self.pending_readers
+    self.dense = False
+
+  def compileReaders(self):
+    """ Index reader rows by input hyperwire, in compressed sparse row form, the zero row having none """
+    wires = self.in_wires.ravel()
+    readers = np.repeat(np.arange(len(self.in_wires)), self.in_wires.shape[1])
+    connected = wires < len(self.hyperwires)
+    wires, readers = wires[connected], readers[connected]
+    order = np.argsort(wires, kind="stable")
+    self.wire_readers = readers[order]
+    self.wire_readers_start = np.searchsorted(wires[order], np.arange(len(self.hyperwires)+2))
+
+  def getReaders(self, wires):
+    """ Get a mask of the readers of the given hyperwire rows """
+    starts = self.wire_readers_start[wires]
+    counts = self.wire_readers_start[wires+1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    mask = np.zeros(len(self.in_wires), bool)
+    mask[self.wire_readers[offsets + np.arange(counts.sum())]] = True
+    return mask
+
+  def getPlan(self, rows):
+    key = rows.tobytes()
+    if key not in self.plan_cache:
+      if len(self.plan_cache) >= self.plan_cache_size:
+        self.plan_cache.clear()
+      self.plan_cache[key] = self.planRows(rows)
+    return self.plan_cache[key]
+
+  def applyChanges(self):
+    """ Add last tick's output changes to the hyperwire values, returning the changed hyperwire rows """
+    if len(self.changed) > self.dense_fraction*len(self.combinators):
+      previous = self.values
+      self.values = self.sumOutputs()
+      return np.flatnonzero((self.values != previous).any(1))
+
+    out_wires = self.out_wires[self.changed]
+    mask = np.zeros(len(self.values), bool)
+    mask[out_wires] = True
+    mask[-1] = False
+    candidates = np.flatnonzero(mask)
+    previous = self.values[candidates]
+    for col in range(out_wires.shape[1]):
+      np.add.at(self.values, out_wires[:,col], self.deltas)
+    self.values[-1] = 0
+    return candidates[(self.values[candidates] != previous).any(1)]
+
+  def isDense(self):
+    """ Whether the readers of the hyperwires that last tick's output changes reach are too many for event mode """
+    n_readers = len(self.deciders)+len(self.arithmetics)
+    limit = self.dense_fraction*n_readers
+    out_wires = self.out_wires[self.changed]
+    # readers counted once per output terminal reaching them, an upper bound
+    if (self.wire_readers_start[out_wires+1] - self.wire_readers_start[out_wires]).sum() <= limit:
+      return False
+    mask = np.zeros(len(self.values), bool)
+    mask[out_wires] = True
+    mask[-1] = False
+    return np.count_nonzero(self.getReaders(np.flatnonzero(mask))) > limit
+
+  def stepDense(self):
+    """
+    Advance a tick with Simulator.step. On check ticks, rebuild the changed outputs,
+    and return to event mode if they reach few enough readers.
+    """
+    n_readers = len(self.deciders)+len(self.arithmetics)
+    if (self.tick+1) % self.dense_check_period:
+      Simulator.step(self)
+      self.activity.append({"tick": self.tick, "dirty_wires": None, "evaluated": n_readers, "changed": None})
+      return
+
+    previous = self.outputs.copy()
+    Simulator.step(self)
+    changed = (self.outputs != previous).any(1)
+    self.changed = np.flatnonzero(changed)
+    self.deltas = self.outputs[changed] - previous[changed]
+    self.dense = self.isDense()
+    self.activity.append({"tick": self.tick, "dirty_wires": None, "evaluated": n_readers, "changed": len(self.changed)})
+
+  def step(self, ticks = 1):
+    """ Advance the simulation """
+    for _ in range(ticks):
+      if self.dense:
+        self.stepDense()
+        continue
+      if not len(self.changed) and not len(self.pending_readers):
+        # nothing changed last tick, so nothing can change now
+        self.tick += 1
+        self.activity.append({"tick": self.tick, "dirty_wires": 0, "evaluated": 0, "changed": 0})
+        continue
+
+      dirty = self.applyChanges()
+      n_readers = len(self.deciders)+len(self.arithmetics)
+      if len(dirty) > self.dense_fraction*len(self.hyperwires):
+        readers = self.plan_rows
+      else:
+        mask = self.getReaders(dirty)
+        mask[self.pending_readers] = True
+        readers = np.flatnonzero(mask)
+      self.pending_readers = readers[:0]
+      if len(readers) > self.dense_fraction*n_readers:
+        readers = self.plan_rows
+        plan = self.plan
+      else:
+        plan = self.getPlan(readers)
+
+      previous = self.outputs[readers]
+      self.evalPlan(plan)
+      changed = (self.outputs[readers] != previous).any(1)
+      self.changed = readers[changed]
+      self.deltas = self.outputs[self.changed] - previous[changed]
+      self.dense = self.isDense()
+
+      self.tick += 1
+      self.activity.append({"tick": self.tick, "dirty_wires": len(dirty),
+                            "evaluated": len(readers), "changed": len(self.changed)})
@@ -1,4 +1,6 @@
-import re
+import os
+import hashlib
+import marshal
 
 signal_replacements = (("signal-everything","all"),
                         ("signal-anything","any"),
@@ -14,32 +16,177 @@ for _,i in pairs(game.item_prototypes)  do if not i.has_flag("hidden") then tabl
 
 game.write_file("signals.lua", serpent.line(map,{indent=" ",comment=false}), false)
 """
-from slpp import slpp as lua
 
-def readAllSignals():
-    with open("signals.lua",'r') as f:
-        signal_table = lua.decode(f.read())
+package_dir = os.path.dirname(os.path.abspath(__file__))
+signals_path = os.path.join(package_dir, "signals.lua")
+signals_cache_path = os.path.join(package_dir, "signals.cache")
+cache_format = 1
+
+def readAllSignals(path = signals_path):
+    from lua_table import decode
+    with open(path,'r') as f:
+        signal_table = decode(f.read())
     return {sig["name"]: sig["type"] for sig in signal_table}
 
+def loadSignalTypes(path = signals_path, cache_path = signals_cache_path):
+    """
+    Get the signal table, from a marshal cache keyed on the mtime and hash of signals.lua.
+    The Lua file is only decoded when it changed, and the cache is rewritten if possible.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    digest = None
+    try:
+        with open(cache_path, 'rb') as f:
+            version, cached_mtime, cached_digest, types = marshal.load(f)
+        if version == cache_format:
+            if cached_mtime == mtime:
+                return types
+            # touched but maybe not changed: fall back to comparing contents
+            with open(path, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            if cached_digest == digest:
+                writeSignalCache(cache_path, mtime, digest, types)
+                return types
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    if digest is None:
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+    types = readAllSignals(path)
+    writeSignalCache(cache_path, mtime, digest, types)
+    return types
+
+def writeSignalCache(cache_path, mtime, digest, types):
+    """ Atomically replace the signal cache; a read-only install just goes without """
+    tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            marshal.dump((cache_format, mtime, digest, types), f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+_signal_types = None
+def getSignalTypes():
+    """ Get {signal name: signal type}, loading it on first use """
+    global _signal_types
+    if _signal_types is None:
+        _signal_types = loadSignalTypes()
+    return _signal_types
+
+def __getattr__(name):
+    # signal_types used to be loaded at import; keep it available lazily
+    if name == "signal_types":
+        return getSignalTypes()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+class Signal(dict):
+    """
+    Interned, read-only signal specification {name="", type=""}.
+    It is a dict so it can be used anywhere a blueprint signal table can,
+    but equal signals share one instance; get them with internSignal().
+    """
+    __slots__ = ()
+
+    def __init__(self, type, name):
+        dict.__init__(self, type=type, name=name)
+
+    def readOnly(self, *args, **kwargs):
+        raise TypeError("Signal is read-only")
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = readOnly
+
+    def __hash__(self):
+        return hash((self["type"], self["name"]))
+
+    def __reduce__(self):
+        return (internSignal, (self["type"], self["name"]))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+_interned_signals = {}
+def internSignal(type, name):
+    """ Get the shared Signal for a type and name """
+    key = (type, name)
+    signal = _interned_signals.get(key)
+    if signal is None:
+        signal = _interned_signals[key] = Signal(type, name)
+    return signal
+
+def shortSignalName(name):
+    """ Netlist form of a full signal name """
+    for full, short in signal_replacements:
+        if name == full:
+            return short
+    # remove signal prefix from non-numeric virtuals
+    if name.startswith("signal-") and len(name) > 7 and not name[7].isdigit():
+        return name[7:]
+    return name
+
+_to_string = {}
+_from_string = None
+def getStringLookups():
+    """
+    Build the lookup from netlist signal strings to Signals on first use.
+    Full names take precedence over short forms, so a string that is
+    itself a signal name is never given a "signal-" prefix.
+    """
+    global _from_string
+    if _from_string is None:
+        signal_types = getSignalTypes()
+        from_string = {}
+        for name, type_ in signal_types.items():
+            short = shortSignalName(name)
+            _to_string[name] = short
+            from_string.setdefault(short, internSignal(type_, name))
+        for name, type_ in signal_types.items():
+            from_string[name] = internSignal(type_, name)
+        _from_string = from_string
+    return _from_string
+
 def signalToString(signal):
     """
     Return string from signal specification 
     {name="", type=""}
     """
-    
     name = signal["name"]
-    # remove signal prefix from non-numeric virtuals
-    replacements = signal_replacements + ((r"signal-([^0-9].*)",r"\1"),)
-    for pattern, repl in replacements:
-        name = re.sub(pattern, repl, name)
-    return name
+    try:
+        return _to_string[name]
+    except KeyError:
+        short = _to_string[name] = shortSignalName(name)
+        return short
 
 def signalFromString(signal_str):
-    for repl, pattern in signal_replacements:
-        signal_str = re.sub(pattern, repl, signal_str)
-    if signal_str not in signal_types:
-        signal_str = "signal-"+signal_str
-
-    return {"type": signal_types[signal_str], "name": signal_str}
+    """ Return the Signal for a netlist signal string """
+    lookups = _from_string or getStringLookups()
+    try:
+        return lookups[signal_str]
+    except KeyError:
+        pass
+    # short forms that keep their prefix in exports, like signal-0
+    signal = lookups.get("signal-"+signal_str)
+    if signal is None:
+        raise KeyError("signal-"+signal_str)
+    lookups[signal_str] = signal
+    return signal
 
-signal_types = readAllSignals()
\ No newline at end of file
+def internSignals(behavior):
+    """ Replace signal tables in a combinator behavior with interned Signals, in place """
+    for conditions in behavior.values():
+        if isinstance(conditions, dict):
+            for key in ("first_signal", "second_signal", "output_signal"):
+                signal = conditions.get(key)
+                if isinstance(signal, dict) and "name" in signal:
+                    conditions[key] = internSignal(signal.get("type"), signal["name"])
+    for filt in behavior.get("filters", ()):
+        signal = filt.get("signal")
+        if isinstance(signal, dict) and "name" in signal:
+            filt["signal"] = internSignal(signal.get("type"), signal["name"])
+    return behavior
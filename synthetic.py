@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# Generator for synthetic circuits of configurable size and shape
+#
+# Every shape is deterministic, so the same shape and size always give the same
+# blueprint, entity table and netlist, and benchmark results can be compared between commits.
+
+import argparse
+import math
+import os
+
+from factorilog import CircuitEnt, Layout, Wire, WireColor
+
+def connect(term_a, term_b, color):
+  wire = Wire({term_a, term_b}, color)
+  term_a.addWire(wire)
+  term_b.addWire(wire)
+
+def signal(name):
+  return {"type": "virtual", "name": "signal-"+name}
+
+def makePoleChain(size):
+  """
+  Build a Layout of `size` entities: a red pole chain with a decider combinator
+  hanging off every other pole, the deciders chained together on green.
+  """
+  layout = Layout()
+  prev_pole = prev_decider = None
+  for i in range(size):
+    if i%2:
+      ent = CircuitEnt.fromName("decider-combinator")
+      ent.behavior = {"decider_conditions": {"comparator": "<", "constant": i%1000,
+        "first_signal": signal("A"), "output_signal": signal("A"), "copy_count_from_input": True}}
+      connect(prev_pole.terminals[0], ent.terminals[0], WireColor.red)
+      if prev_decider:
+        connect(prev_decider.terminals[1], ent.terminals[1], WireColor.green)
+      prev_decider = ent
+    else:
+      ent = CircuitEnt.fromName("medium-electric-pole")
+      if prev_pole:
+        connect(prev_pole.terminals[0], ent.terminals[0], WireColor.red)
+      prev_pole = ent
+    ent.number = i+1
+    layout.addEntity(ent)
+  return layout
+
+def makeCombinatorArray(size):
+  """
+  Build a Layout of `size` combinators in independent cells of four:
+  a constant feeding a counter, a threshold decider and an each-multiplier.
+  """
+  layout = Layout()
+  for i in range(0, size, 4):
+    constant = CircuitEnt.fromName("constant-combinator")
+    constant.behavior = {"filters": [{"count": 1, "index": 1, "signal": signal("A")}]}
+    counter = CircuitEnt.fromName("arithmetic-combinator")
+    counter.behavior = {"arithmetic_conditions": {"operation": "+", "constant": 0,
+      "first_signal": signal("A"), "output_signal": signal("A")}}
+    threshold = CircuitEnt.fromName("decider-combinator")
+    threshold.behavior = {"decider_conditions": {"comparator": ">", "constant": i%100,
+      "first_signal": signal("A"), "output_signal": signal("B"), "copy_count_from_input": False}}
+    multiplier = CircuitEnt.fromName("arithmetic-combinator")
+    multiplier.behavior = {"arithmetic_conditions": {"operation": "*", "constant": 2,
+      "first_signal": signal("each"), "output_signal": signal("each")}}
+
+    connect(constant.terminals[0], counter.terminals[0], WireColor.red)
+    connect(counter.terminals[0], counter.terminals[1], WireColor.green)
+    connect(counter.terminals[1], threshold.terminals[0], WireColor.red)
+    connect(threshold.terminals[1], multiplier.terminals[0], WireColor.red)
+    for number, ent in enumerate((constant, counter, threshold, multiplier), i+1):
+      ent.number = number
+      layout.addEntity(ent)
+  return layout
+
+def makeFanoutBus(size, drivers_every = 100):
+  """
+  Build a Layout of `size` entities on two buses: a red pole chain read by a decider
+  at every other position and driven by a constant combinator every `drivers_every`
+  entities, and a green bus joining the outputs of all the deciders.
+  Each bus is a single hyperwire with a terminal for about half of the entities.
+  """
+  layout = Layout()
+  prev_pole = prev_decider = None
+  for i in range(size):
+    if i%drivers_every==1:
+      ent = CircuitEnt.fromName("constant-combinator")
+      ent.behavior = {"filters": [{"count": i, "index": 1, "signal": signal("A")}]}
+      connect(prev_pole.terminals[0], ent.terminals[0], WireColor.red)
+    elif i%2:
+      ent = CircuitEnt.fromName("decider-combinator")
+      ent.behavior = {"decider_conditions": {"comparator": ">", "constant": i%1000,
+        "first_signal": signal("A"), "output_signal": signal("B"), "copy_count_from_input": False}}
+      connect(prev_pole.terminals[0], ent.terminals[0], WireColor.red)
+      if prev_decider:
+        connect(prev_decider.terminals[1], ent.terminals[1], WireColor.green)
+      prev_decider = ent
+    else:
+      ent = CircuitEnt.fromName("medium-electric-pole")
+      if prev_pole:
+        connect(prev_pole.terminals[0], ent.terminals[0], WireColor.red)
+      prev_pole = ent
+    ent.number = i+1
+    layout.addEntity(ent)
+  return layout
+
+def makeMesh(size):
+  """
+  Build a Layout of `size` poles on a square grid, each wired to its right and lower
+  neighbours in both colors, so each color is one hyperwire full of cycles.
+  """
+  layout = Layout()
+  columns = math.ceil(math.sqrt(size))
+  poles = []
+  for i in range(size):
+    ent = CircuitEnt.fromName("medium-electric-pole")
+    if i%columns:
+      left = poles[i-1].terminals[0]
+      connect(left, ent.terminals[0], WireColor.red)
+      connect(left, ent.terminals[0], WireColor.green)
+    if i>=columns:
+      above = poles[i-columns].terminals[0]
+      connect(above, ent.terminals[0], WireColor.red)
+      connect(above, ent.terminals[0], WireColor.green)
+    ent.number = i+1
+    poles.append(ent)
+    layout.addEntity(ent)
+  return layout
+
+def placeOnGrid(layout, columns = 100):
+  """ Place the entities of a Layout by number in rows of `columns`, two tiles apart """
+  for ent in layout.entities:
+    ent.position = {"x": (ent.number-1)%columns, "y": (ent.number-1)//columns*2}
+    layout.addEntity(ent) # index the new position
+  layout.flags["meta_valid"] = True
+  return layout
+
+# Layout builders by shape name
+shapes = {
+  "chain": makePoleChain,
+  "fanout": makeFanoutBus,
+  "array": makeCombinatorArray,
+  "mesh": makeMesh,
+}
+
+def makeCircuit(shape, size):
+  """ Build a placed Layout of about `size` entities in one of the `shapes` """
+  if shape not in shapes:
+    raise RuntimeError("Unknown circuit shape {}".format(shape))
+  layout = shapes[shape](size)
+  columns = math.ceil(math.sqrt(size)) if shape=="mesh" else 100
+  return placeOnGrid(layout, columns)
+
+def writeCircuitFiles(layout, directory, stem):
+  """
+  Write a Layout as a blueprint string, a Lua entity table and a netlist with metadata.
+  Returns the paths by kind: "blueprint", "entity table" and "netlist".
+  """
+  from blueprint_layer import writeBlueprint
+  from netlist_layer import writeNetlist
+  os.makedirs(directory, exist_ok=True)
+  paths = {
+    "blueprint": os.path.join(directory, stem + ".blueprint"),
+    "entity table": os.path.join(directory, stem + ".lua"),
+    "netlist": os.path.join(directory, stem + ".netlist"),
+  }
+  with open(paths["blueprint"], 'w') as stream:
+    writeBlueprint(layout, stream, string=True)
+  with open(paths["entity table"], 'w') as stream:
+    writeBlueprint(layout, stream, string=False)
+  with open(paths["netlist"], 'w') as stream:
+    writeNetlist(layout, stream, meta=True)
+  return paths
+
+# Random netlist documents, for checking the parsers against each other
+
+net_signals = ["A", "B", "Z", "0", "9", "each", "any", "all", "red", "green", "black", "iron-plate", "small-lamp"]
+net_entities = ["medium-electric-pole", "small-electric-pole", "big-electric-pole", "small-lamp"]
+
+def makeNetlistLine(rng, number = None):
+  """ Random netline in the netlist language, spaced and commented like hand-written files """
+  space = lambda: rng.choice([" ", "  ", "\t", " \t"])
+  nets = lambda: (","+space()).join(rng.choice("abcdefgh_") + str(rng.randrange(50))
+                                    for _ in range(rng.randint(1, 3)))
+  channel = lambda: rng.choice(net_signals + [str(rng.randint(-100, 100))])
+  kind = rng.randrange(4)
+  if kind==0:
+    desc = "{} {} if {} {} {}".format(rng.choice("1@"), rng.choice(net_signals),
+      rng.choice(net_signals), rng.choice("<=>"), channel())
+  elif kind==1:
+    desc = "{} = {} {} {}".format(rng.choice(net_signals), rng.choice(net_signals),
+      rng.choice("+-*/"), channel())
+  elif kind==2:
+    desc = ", ".join("{} {}".format(rng.randint(-1000, 1000), rng.choice(net_signals))
+                     for _ in range(rng.randint(1, 4)))
+  else:
+    desc = rng.choice(net_entities)
+  iface = rng.choice(["{} <= {}".format(nets(), nets()), "{} <=".format(nets()), nets(), ""])
+  line = "{}:{}{}".format(iface, space(), desc)
+  if number is not None:
+    line += space() + "|" + space() + str(number)
+  if rng.random()<0.1:
+    line += space() + "# comment"
+  return line
+
+def makeNetlistMeta(rng, number):
+  coord = lambda: rng.choice([str(rng.randint(-50, 50)), "{:.1f}".format(rng.uniform(-50, 50))])
+  return "{} | {} {} {}".format(number, coord(), coord(), rng.choice(["N", "S", "E", "W", ""]))
+
+def makeNetlistDocument(rng, lines):
+  """ Random netlist document, with metadata for half of them """
+  meta = rng.random()<0.5
+  netlines = [makeNetlistLine(rng, i+1 if meta else None) for i in range(lines)]
+  for _ in range(rng.randrange(3)):
+    netlines.insert(rng.randrange(len(netlines)+1), rng.choice(["", "# comment", "  "]))
+  if meta:
+    metalines = [makeNetlistMeta(rng, i+1) for i in range(lines)]
+    for name in ("a1", "b2", "c3"):
+      wires = " ".join("{}{}-{}{}".format(rng.randint(1, lines), rng.choice(["i", "o", ""]),
+        rng.randint(1, lines), rng.choice(["i", "o", ""])) for _ in range(rng.randrange(3)))
+      metalines.append("{} | {} {}".format(name, rng.choice(["red", "green"]), wires))
+    metalines.append("name || Generated # not a comment")
+    metalines.append("icons || " + " ".join(rng.sample(net_entities, rng.randint(1, 2))))
+    netlines += ["||"] + metalines
+  return rng.choice(["\n", "\r\n"]).join(netlines) + rng.choice(["", "\n"])
+
+def mutateDocument(rng, text):
+  """ Delete or insert a character, to exercise the error paths """
+  i = rng.randrange(len(text)+1)
+  if rng.random()<0.5:
+    return text[:i] + text[i+1:]
+  return text[:i] + rng.choice(":|<=,-#. 1A") + text[i:]
+
+def normalizeAst(node):
+  """
+  Turn parser output into plain lists and dicts. grako returns a lone match of a
+  repeated element as the element itself, so those are wrapped in a list.
+  """
+  if isinstance(node, dict):
+    normal = {}
+    for key, value in node.items():
+      value = normalizeAst(value)
+      if key in ("Entities", "Metadata", "Wires", "Terminals", "Names", "in", "out", "pass") \
+          and value is not None and not isinstance(value, list):
+        value = [value]
+      normal[key] = value
+    if normal.get("Entities") is None and "Entities" in normal:
+      normal["Entities"] = []
+    return normal
+  if isinstance(node, (list, tuple)):
+    return [normalizeAst(item) for item in node]
+  return node
+
+def parseOutcome(parse, text):
+  from grako.exceptions import FailedParse
+  from netlist_fastparser import NetlistSyntaxError
+  try:
+    return normalizeAst(parse(text))
+  except (FailedParse, NetlistSyntaxError):
+    return "syntax error"
+  except Exception as e:
+    return "{}: {}".format(type(e).__name__, e)
+
+if __name__=="__main__":
+  parser = argparse.ArgumentParser(description="Generate synthetic circuits as blueprints, entity tables and netlists")
+  parser.add_argument('shape', choices=sorted(shapes), help="Shape of the circuit")
+  parser.add_argument('size', type=int, help="Number of entities")
+  parser.add_argument('-o','--outdir', default=".", help="Directory for the generated files")
+  args = parser.parse_args()
+
+  stem = "{}-{}".format(args.shape, args.size)
+  for kind, path in writeCircuitFiles(makeCircuit(args.shape, args.size), args.outdir, stem).items():
+    print("Wrote {} to file {}".format(kind, path))
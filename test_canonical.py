@@ -0,0 +1,62 @@
+# Checks that canonical netlists and structural hashes don't depend on how a layout was built
+
+import random
+
+from factorilog import CircuitEnt, Layout, WireColor
+from synthetic import connect, makeCircuit, signal
+from netlist_layer import exportNetlist, getStructuralHash, importNetlist
+
+def makeRing(size, links, seed, order_seed = None):
+  """
+  Build a ring of `size` identical arithmetic combinators, each output red-wired to the next
+  input, with `links` random green links from outputs to inputs chosen by `seed`.
+  With `order_seed`, the entities are numbered, added and wired in a shuffled order.
+  """
+  rng = random.Random(seed)
+  wires = [(i, (i+1)%size, WireColor.red) for i in range(size)]
+  wires += [(rng.randrange(size), rng.randrange(size), WireColor.green) for _ in range(links)]
+  entities = []
+  for _ in range(size):
+    ent = CircuitEnt.fromName("arithmetic-combinator")
+    ent.behavior = {"arithmetic_conditions": {"operation": "+", "constant": 0,
+      "first_signal": signal("A"), "output_signal": signal("A")}}
+    entities.append(ent)
+  order = list(range(size))
+  if order_seed is not None:
+    shuffler = random.Random(order_seed)
+    shuffler.shuffle(order)
+    shuffler.shuffle(wires)
+  layout = Layout()
+  for number, i in enumerate(order, 1):
+    entities[i].number = number
+    layout.addEntity(entities[i])
+  for source, target, color in wires:
+    connect(entities[source].terminals[1], entities[target].terminals[0], color)
+  return layout
+
+def test_shuffled_rings():
+  for seed in range(40):
+    size = 6 + seed%10
+    expected = exportNetlist(makeRing(size, size//3, seed), canonical=True)
+    for order_seed in range(5):
+      shuffled = makeRing(size, size//3, seed, order_seed)
+      assert exportNetlist(shuffled, canonical=True)==expected
+
+def test_symmetric_rings():
+  # without links, every combinator is alike and only individualization tells them apart
+  for size in (2, 3, 8, 25):
+    expected = exportNetlist(makeRing(size, 0, 0), canonical=True)
+    for order_seed in range(5):
+      assert exportNetlist(makeRing(size, 0, 0, order_seed), canonical=True)==expected
+
+def test_reimported_canonical_netlist():
+  for shape in ("chain", "array", "fanout", "mesh"):
+    layout = makeCircuit(shape, 200)
+    netlist = exportNetlist(layout, canonical=True)
+    reimported = importNetlist(netlist)
+    assert exportNetlist(reimported, canonical=True)==netlist
+    assert getStructuralHash(reimported)==getStructuralHash(layout)
+
+def test_different_circuits():
+  assert exportNetlist(makeRing(8, 0, 0), canonical=True)!=exportNetlist(makeRing(9, 0, 0), canonical=True)
+  assert exportNetlist(makeRing(8, 3, 1), canonical=True)!=exportNetlist(makeRing(8, 3, 2), canonical=True)
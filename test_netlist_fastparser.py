@@ -0,0 +1,60 @@
+# Checks that the fast netlist parser gives the same results as the grako parser
+
+import random
+
+from netlist_fastparser import parseNetlist
+from netlist_layer import NetlistSemantics, exportNetlist
+from netlist_parser import NetlistParser
+from synthetic import makeCircuit, makeNetlistDocument, mutateDocument, parseOutcome
+
+def parseGrako(text):
+  return NetlistParser(parseinfo=False).parse(text, rule_name='start', semantics=NetlistSemantics())
+
+def parseFast(text):
+  return parseNetlist(text, NetlistSemantics())
+
+def assertConforms(text):
+  expected = parseOutcome(parseGrako, text)
+  assert parseOutcome(parseFast, text)==expected, text
+  return expected
+
+edge_cases = [
+  # empty bodies
+  "", "\n", "\r\n\r\n", "  \t", "||", "||\n", "\n||\n\n",
+  # comments
+  "# only a comment", "# comment\n# another\n", "a: small-lamp # trailing comment",
+  "a: 1 A if B < 3# no space", "a: small-lamp\n||\nname || Generated # kept in the name",
+  # missing nets and terminals
+  ": medium-electric-pole", "a <=: A = B + 1", "<= a: A = B + 1", "a, b <= c: 5 A, -3 B | 2",
+  "a: small-lamp\n||\n1 | 0.5 -2 N\nw | red 1-1o\nw2 | green\n",
+  "a: small-lamp\n||\n1 | 3 4\nw | green 1-1\n",
+  "a: small-lamp\n||\n1 | 0.5 -2 N\nw | red 1-1o 1i-\n",
+  "a: small-lamp\n||\nw | red -1o\n",
+  # malformed lines
+  "x:\n", "a b: A", "a: A = B + 1 |", "a: 1 A if B <", "a:: small-lamp", "a, <= b: small-lamp",
+  "a: small-lamp\n||\n1 | N\n",
+]
+
+def test_edge_cases():
+  for text in edge_cases:
+    assertConforms(text)
+
+def test_empty_documents():
+  for text in ("", "\n", "# comment\n", "||"):
+    assert assertConforms(text)["Entities"]==[]
+
+def test_random_documents():
+  rng = random.Random(0)
+  rejected = 0
+  for i in range(400):
+    text = makeNetlistDocument(rng, rng.randint(1, 8))
+    if i%4==3:
+      text = mutateDocument(rng, text)
+    rejected += assertConforms(text)=="syntax error"
+  # the corpus exercises both the accepting and the error paths
+  assert 0 < rejected < 400
+
+def test_exported_netlists():
+  for shape in ("chain", "array", "fanout", "mesh"):
+    for meta in (False, True):
+      assert assertConforms(exportNetlist(makeCircuit(shape, 60), meta=meta))!="syntax error"
@@ -0,0 +1,24 @@
+# Checks of netlist import that don't depend on the parser
+
+from netlist_layer import buildNetlistLayout, exportNetlist, getStructuralHash, parseNetlistTables
+from string_ops import internSignal
+from synthetic import makeCircuit
+
+def test_tables_signals():
+  # signals in the parsed tables are the shared, interned Signals
+  tables = parseNetlistTables(exportNetlist(makeCircuit("array", 400), meta=True))
+  assert len(tables["entities"])==400 and tables["has_meta"]
+  for descriptor, _ in tables["entities"]:
+    for conditions in descriptor.get("behavior", {}).values():
+      if isinstance(conditions, dict):
+        for key in ("first_signal", "second_signal", "output_signal"):
+          if key in conditions:
+            signal = conditions[key]
+            assert signal is internSignal(signal["type"], signal["name"])
+
+def test_round_trip():
+  for shape in ("chain", "array", "fanout", "mesh"):
+    for meta in (False, True):
+      layout = makeCircuit(shape, 100)
+      imported = buildNetlistLayout(exportNetlist(layout, meta=meta))
+      assert getStructuralHash(imported)==getStructuralHash(layout), shape